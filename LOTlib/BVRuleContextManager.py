@@ -1,4 +1,35 @@
 from LOTlib.Miscellaneous import self_update
+
+
+class BVScope(object):
+    """
+        The bound variable rules in scope, as a linked list of frames: each frame has one rule, and the frame for the
+        scope around it (or None). Frames are never changed, so entering a scope is making one new frame, leaving it
+        is going back to the frame we had before, and the grammar's own rules are never touched.
+
+        Iterating gives the rules innermost first.
+    """
+    __slots__ = ('rule', 'parent')
+
+    def __init__(self, rule, parent):
+        self.rule = rule
+        self.parent = parent
+
+    def __iter__(self):
+        frame = self
+        while frame is not None:
+            yield frame.rule
+            frame = frame.parent
+
+    def without(self, r):
+        """ The frames for this scope with the rule r taken out (only needed when scopes are left out of order) """
+        rules = [x for x in self if x is not r]
+        frame = None
+        for x in reversed(rules):
+            frame = BVScope(x, frame)
+        return frame
+
+
 class BVRuleContextManager(object):
 
     def __init__(self, grammar, fn, recurse_up=False):
@@ -10,9 +41,15 @@ class BVRuleContextManager(object):
             NOTE: If rule is None, then nothing happens
 
             This actually could go in FunctionNode, *except* that it needs to know the grammar, which FunctionNodes do not
+
+            The rules are not added to grammar.rules, but to the grammar's BVScope for this thread (see
+            Grammar.add_bv_rule), so entering and leaving is O(1) for each rule and grammars can be shared between
+            threads.
         """
         self_update(self, locals())
         self.added_rules = [] # all of the rules we added -- may be more than one from recurse_up=True
+        self.saved = None     # the grammar's scope before we entered
+        self.entered = None   # and after
 
     def __str__(self):
         return "<Managing context for %s>"%str(self.fn)
@@ -23,24 +60,28 @@ class BVRuleContextManager(object):
 
         assert len(self.added_rules) == 0, "Error, __enter__ called twice on BVRuleContextManager"
 
+        self.saved = self.grammar.bv_frame
         for x in self.fn.up_to(to=None) if self.recurse_up else [self.fn]:
             if x.added_rule is not None:
-                #print "# Adding rule ", x.added_rule
-                r = x.added_rule
-                self.added_rules.append(r)
-                self.grammar.rules[r.nt].append(r)
+                self.added_rules.append(x.added_rule)
+
+        # outermost first, so that the frames nest as the lambdas do
+        for r in reversed(self.added_rules):
+            self.grammar.add_bv_rule(r)
+        self.entered = self.grammar.bv_frame
 
     def __exit__(self, t, value, traceback):
 
         if self.fn is None: # skip these
             return
 
-        #print "# Removing rule", r
-        for r in self.added_rules:
-            self.grammar.rules[r.nt].remove(r)
+        if self.grammar.bv_frame is self.entered:
+            self.grammar.set_bv_frame(self.saved)
+        else: # someone else's scope was entered and not left since we entered (e.g. interleaved iterate_subnodes)
+            for r in self.added_rules:
+                self.grammar.remove_bv_rule(r)
 
         # reset
         self.added_rules = []
 
         return False #re-raise exceptions
-
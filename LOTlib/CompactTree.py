@@ -0,0 +1,364 @@
+"""
+        A compact representation of trees, for storing lots of them.
+
+        A CompactTree stores the indices of the rules used at each node, in prefix order, as a numpy array. Uses of
+        bound variables are stored as BV_USE, and a second array gives, for each of them, the (prefix) position of
+        the lambda that introduced it. Nonterminals left unexpanded in partial trees are stored as HOLE.
+
+        The indices are rule ids in the grammar's CompiledGrammar (see Grammar.compile), so converting to and from FunctionNodes, computing priors and rendering
+        strings all take the grammar as an argument:
+
+            ct = CompactTree.from_FunctionNode(grammar, t)
+            ct.log_probability(grammar) == grammar.log_probability(t)
+            ct.pystring(grammar) == str(t)
+            ct.to_FunctionNode(grammar) == t
+
+        Trees only need to be converted using the same grammar, or one with the same rules added in the same
+        order.
+
+        For storing trees as strings, a tree can also be written as a list of codes, one int per node in prefix
+        order: the index of its rule, or for a bound variable, the number of rules plus the level of the lambda
+        that bound it (0 for the outermost lambda around it, and so on). This is how Grammar.pack_ascii has always
+        numbered bound variables. Grammar.pack writes the codes as varints, which have no limit on the number
+        of rules.
+"""
+from math import log
+
+try: import numpy as np
+except ImportError: import numpypy as np
+
+from LOTlib.FunctionNode import BVAddFunctionNode, BVUseFunctionNode, isFunctionNode, percent_s_regex, bv_regex
+from LOTlib.Miscellaneous import None2Empty
+
+BV_USE = -1 # codes for nodes that are not indexed grammar rules
+HOLE = -2
+
+
+def encode_varints(ints):
+    """ Write non-negative ints as a string, 7 bits to a byte, with the high bit set on all but each int's last """
+    out = bytearray()
+    for x in ints:
+        while x >= 0x80:
+            out.append((x & 0x7F) | 0x80)
+            x >>= 7
+        out.append(x)
+    return str(out)
+
+def decode_varints(s):
+    """ The list of ints that encode_varints wrote to s """
+    ints = []
+    x, shift = 0, 0
+    for b in bytearray(s):
+        x |= (b & 0x7F) << shift
+        if b & 0x80:
+            shift += 7
+        else:
+            ints.append(x)
+            x, shift = 0, 0
+    assert shift == 0, "*** Truncated varint"
+    return ints
+
+
+class CompactTree(object):
+    """
+    A tree stored as numpy arrays of rule indices (see the top of this file).
+
+    Arguments
+    ---------
+    rules : np.ndarray
+        The index of each node's rule in prefix order, or BV_USE or HOLE.
+    bindings : np.ndarray
+        For each BV_USE in rules (in order), the position in rules of the lambda that bound it. None if there
+        are no bound variables.
+
+    """
+    __slots__ = ['rules', 'bindings'] # no per-tree __dict__, since we want to store millions of these
+
+    def __init__(self, rules, bindings=None):
+        self.rules = rules
+        self.bindings = bindings
+
+    @classmethod
+    def from_FunctionNode(cls, grammar, t):
+        """ Encode the FunctionNode t. Any bound variables it uses must be bound within t """
+        table = grammar.compile()
+
+        rules, bindings = [], []
+        binder = dict() # the position of the lambda introducing each bound variable name
+
+        stack = [t]
+        while stack:
+            n = stack.pop()
+
+            if not isFunctionNode(n): # a nonterminal left in a partial tree
+                rules.append(HOLE)
+                continue
+
+            if isinstance(n, BVUseFunctionNode):
+                assert n.name in binder, "*** Cannot encode %s, since the bound variable %s is free" % (t, n)
+                bindings.append(binder[n.name])
+                rules.append(BV_USE)
+                to = table.bv[rules[binder[n.name]]][2]
+            else:
+                i = table.sig2idx[n.get_rule_signature()]
+                if isinstance(n, BVAddFunctionNode):
+                    binder[n.added_rule.name] = len(rules)
+                rules.append(i)
+                to = table.rules[i].to
+
+            # push the FunctionNode args, leftmost last so that it is popped first
+            for a, x in reversed(zip(None2Empty(n.args), None2Empty(to))):
+                if table.is_nonterminal(x):
+                    stack.append(a)
+                else:
+                    assert a == x, "*** Arg %s of %s does not match its rule" % (a, n)
+
+        return cls(np.array(rules, dtype=np.int32),
+                   np.array(bindings, dtype=np.int32) if len(bindings) > 0 else None)
+
+    @classmethod
+    def from_codes(cls, grammar, codes, start=0):
+        """
+        Read one tree from the list of codes (see the top of this file), starting at start. Returns the tree
+        and the position after it, so that trees written one after another can be read back in turn.
+        """
+        table = grammar.compile()
+        nrules = len(table.rules)
+
+        rules, bindings = [], []
+        lambdas = [] # the positions of the lambdas we are below, outermost first
+
+        # For each node on the path to here: [how many children are still to come, is it a lambda]
+        path = []
+        pos = start
+        while True:
+            code = codes[pos]
+            pos += 1
+            if path:
+                path[-1][0] -= 1
+
+            if code >= nrules:
+                binder = lambdas[code-nrules]
+                bindings.append(binder)
+                rules.append(BV_USE)
+                _, _, args = table.bv[rules[binder]]
+                nkids, is_lambda = len([a for a in None2Empty(args) if table.is_nonterminal(a)]), False
+            else:
+                rules.append(code)
+                nkids, is_lambda = len(table.children[code]), table.bv[code] is not None
+                if is_lambda:
+                    lambdas.append(len(rules)-1)
+
+            path.append([nkids, is_lambda])
+            while path and path[-1][0] == 0:
+                if path.pop()[1]:
+                    lambdas.pop()
+            if not path:
+                break
+
+        return cls(np.array(rules, dtype=np.int32),
+                   np.array(bindings, dtype=np.int32) if len(bindings) > 0 else None), pos
+
+    def to_codes(self, grammar):
+        """ The list of codes for this tree (see the top of this file). It must not have HOLEs. """
+        table = grammar.compile()
+        nrules = len(table.rules)
+        bindings = None2Empty(self.bindings if self.bindings is None else self.bindings.tolist())
+
+        codes = []
+        level = dict() # the position of each lambda -> how many lambdas it is below
+        nlambdas = 0
+        nbv = 0
+
+        path = [] # as in from_codes
+        for pos, code in enumerate(self.rules.tolist()):
+            assert code != HOLE, "*** Partial trees cannot be written as codes"
+            if path:
+                path[-1][0] -= 1
+
+            if code == BV_USE:
+                binder = bindings[nbv]
+                nbv += 1
+                codes.append(nrules + level[binder])
+                _, _, args = self.bv_rule(table, binder)
+                nkids, is_lambda = len([a for a in None2Empty(args) if table.is_nonterminal(a)]), False
+            else:
+                codes.append(code)
+                nkids, is_lambda = len(table.children[code]), table.bv[code] is not None
+                if is_lambda:
+                    level[pos] = nlambdas
+                    nlambdas += 1
+
+            path.append([nkids, is_lambda])
+            while path and path[-1][0] == 0:
+                if path.pop()[1]:
+                    nlambdas -= 1
+
+        return codes
+
+    def to_FunctionNode(self, grammar):
+        """ Decode into a FunctionNode. Bound variables get new names, just as when we generate. """
+        table = grammar.compile()
+        rules = self.rules.tolist()
+        bindings = None2Empty(self.bindings if self.bindings is None else self.bindings.tolist())
+
+        added_rule = dict() # position of each lambda -> the rule it introduces
+        nbv = [0]
+
+        def build(pos, parent, nt):
+            """ Build the node at rules[pos], returning it and the position after its subtree """
+            code = rules[pos]
+            pos += 1
+
+            if code == HOLE:
+                return nt, pos
+            elif code == BV_USE:
+                r = added_rule[bindings[nbv[0]]]
+                nbv[0] += 1
+            else:
+                r = table.rules[code]
+
+            fn = r.make_FunctionNodeStub(grammar, parent)
+            if fn.added_rule is not None:
+                added_rule[pos-1] = fn.added_rule
+
+            if fn.args is not None:
+                for i, a in enumerate(fn.args):
+                    if table.is_nonterminal(a):
+                        fn.args[i], pos = build(pos, fn, a)
+            return fn, pos
+
+        t, pos = build(0, None, grammar.start)
+        assert pos == len(rules)
+        return t
+
+    def log_probability(self, grammar):
+        """ The same as grammar.log_probability(self.to_FunctionNode(grammar)), without building the tree """
+        table = grammar.compile()
+        bindings = None2Empty(self.bindings if self.bindings is None else self.bindings.tolist())
+
+        lp = 0.0
+        bv_p = dict() # nt -> total p of the bound variable rules in scope
+        nbv = 0
+
+        # For each node on the path to here: [how many children are still to come, bv nt, bv p] where
+        # the last two are for the rule introduced if it is a lambda
+        path = []
+        for code in self.rules.tolist():
+            if path:
+                path[-1][0] -= 1
+
+            bvnt, bvp, nkids = None, None, 0
+            if code != HOLE:
+                if code == BV_USE:
+                    nt, p, args = self.bv_rule(table, bindings[nbv])
+                    nbv += 1
+                    nkids = len([a for a in None2Empty(args) if table.is_nonterminal(a)])
+                else:
+                    r = table.rules[code]
+                    nt, p = r.nt, r.p
+                    nkids = len(table.children[code])
+                    if table.bv[code] is not None:
+                        bvnt, bvp, _ = table.bv[code]
+
+                lp += log(p) - log(table.Z.get(nt, 0.0) + bv_p.get(nt, 0.0))
+
+            # the rule a lambda introduces is in scope until we pop it off path
+            if bvnt is not None:
+                bv_p[bvnt] = bv_p.get(bvnt, 0.0) + bvp
+
+            path.append([nkids, bvnt, bvp])
+            while path and path[-1][0] == 0:
+                _, bvnt, bvp = path.pop()
+                if bvnt is not None:
+                    bv_p[bvnt] -= bvp
+
+        return lp
+
+    def bv_rule(self, table, binder_pos):
+        """ The (nt, p, args) of the rule introduced by the lambda at binder_pos """
+        return table.bv[self.rules[binder_pos]]
+
+    def pystring(self, grammar):
+        """ The same as pystring(self.to_FunctionNode(grammar)), without building the tree """
+        table = grammar.compile()
+        rules = self.rules.tolist()
+        bindings = None2Empty(self.bindings if self.bindings is None else self.bindings.tolist())
+
+        bv_names = dict() # position of each lambda -> the name of its variable
+        nbv = [0]
+
+        def render(pos, d, nt):
+            """ Return the string for the node at rules[pos], and the position after its subtree """
+            code = rules[pos]
+            pos += 1
+
+            if code == HOLE:
+                return nt, pos
+
+            bvn = ''
+            if code == BV_USE:
+                binder = bindings[nbv[0]]
+                nbv[0] += 1
+                _, _, to = self.bv_rule(table, binder)
+                name = bv_names[binder]
+            else:
+                r = table.rules[code]
+                name, to = r.name, r.to
+                if table.bv[code] is not None:
+                    bvn = r.bv_prefix+str(d)
+                    bv_names[pos-1] = bvn
+
+            if to is None:
+                return name, pos
+
+            args = []
+            for a in to:
+                if table.is_nonterminal(a):
+                    s, pos = render(pos, d+1, a)
+                    args.append(s)
+                else:
+                    args.append(a)
+
+            if name == '':
+                assert len(args) == 1, "Null names must have exactly 1 argument"
+                ret = args[0]
+            elif percent_s_regex.search(name):
+                ret = name % tuple(args)
+            elif name == 'lambda':
+                assert len(args) == 1
+                ret = 'lambda %s: %s' % (bvn, args[0])
+            else:
+                ret = name+'('+', '.join(args)+')'
+
+            if bv_regex.search(ret):
+                ret = bv_regex.sub(bvn, ret)
+
+            return ret, pos
+
+        s, pos = render(0, 0, grammar.start)
+        assert pos == len(rules)
+        return s
+
+    def __len__(self):
+        """ The number of nodes, as in FunctionNode.count_nodes (HOLEs are not nodes) """
+        return int(np.sum(self.rules != HOLE))
+
+    def __hash__(self):
+        return hash((self.rules.tostring(), None if self.bindings is None else self.bindings.tostring()))
+
+    def __eq__(self, other):
+        if not isinstance(other, CompactTree):
+            return False
+        if self.bindings is None or other.bindings is None:
+            return self.bindings is other.bindings and np.array_equal(self.rules, other.rules)
+        return np.array_equal(self.rules, other.rules) and np.array_equal(self.bindings, other.bindings)
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __getstate__(self):
+        return (self.rules, self.bindings)
+
+    def __setstate__(self, state):
+        self.rules, self.bindings = state
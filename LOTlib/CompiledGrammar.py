@@ -0,0 +1,115 @@
+"""
+        A frozen, indexed view of a grammar, made by Grammar.compile().
+
+        A Grammar stores its rules as lists keyed by nonterminal, so anything that needs a rule's number, or a
+        nonterminal's normalizing constant, has to compute it. A CompiledGrammar computes all of that once:
+        rules and nonterminals get dense integer ids, and it keeps the normalizers (and their logs), which rules
+        are terminals, and the types of each rule's children.
+
+        A CompiledGrammar is never changed: its attributes can't be set, and it keeps tuples and ReadOnlyDicts
+        rather than lists and dicts. It has the version of the grammar it was compiled from, and Grammar.compile()
+        makes a new one whenever the grammar's version changes (when rules are added or their probabilities
+        change), so anything cached on a CompiledGrammar, or keyed on its version, is never stale.
+
+        Rules for bound variables in scope (in grammar.bv_scope) are not part of the grammar proper (grammar.rules),
+        so they are not compiled. The rules that lambdas introduce are described by bv instead.
+"""
+from math import log
+
+from LOTlib.GrammarRule import BVAddGrammarRule
+from LOTlib.Miscellaneous import None2Empty
+
+
+class ReadOnlyDict(dict):
+    """ A dict that raises an AttributeError when anything tries to change it """
+
+    def _read_only(self, *args, **kwargs):
+        raise AttributeError("*** A CompiledGrammar can't be changed; change the grammar and compile it again")
+
+    __setitem__ = __delitem__ = clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (ReadOnlyDict, (dict(self),))
+
+
+class CompiledGrammar(object):
+    """
+    A frozen, indexed view of grammar (see the top of this file).
+
+    Attributes
+    ----------
+    version
+        The grammar's version when this was compiled
+    rules : tuple
+        The rules; a rule's id is its index here
+    sig2idx : ReadOnlyDict
+        Rule signature -> rule id
+    nonterminals : tuple
+        The nonterminals, including bound variable types; a nonterminal's id is its index here
+    nt_ids : ReadOnlyDict
+        Nonterminal -> its id
+    rule_nt : tuple
+        The id of each rule's nonterminal
+    nt_rules : ReadOnlyDict
+        Nonterminal -> the ids of its rules
+    Z, log_Z : ReadOnlyDict
+        Nonterminal -> the sum of its rules' p, and its log
+    log_p : tuple
+        Each rule's log probability, log(p) - log_Z[nt], when no bound variables are in scope
+    is_terminal_rule : tuple
+        Whether each rule has no nonterminal args
+    children : tuple
+        The positions in each rule's to of its nonterminal args
+    child_types : tuple
+        The nonterminals at those positions
+    bv : tuple
+        For each rule that introduces a bound variable, the (nt, p, args) of the rule it introduces, mirroring
+        BVAddGrammarRule.make_bv_rule; None for other rules
+
+    """
+    def __init__(self, grammar):
+        self.version = grammar.version
+
+        # Rules introduced by lambdas are not part of the grammar proper, so we use grammar.rules, not get_rules
+        self.rules = tuple([r for nt in grammar.nonterminals() for r in grammar.rules[nt]])
+        self.sig2idx = ReadOnlyDict([(r.get_rule_signature(), i) for i, r in enumerate(self.rules)])
+
+        # Bound variable types count as nonterminals, even if nothing else expands to them
+        nonterminals = list(grammar.nonterminals())
+        for r in self.rules:
+            if isinstance(r, BVAddGrammarRule) and r.bv_type not in nonterminals:
+                nonterminals.append(r.bv_type)
+        self.nonterminals = tuple(nonterminals)
+        self.nt_ids = ReadOnlyDict([(nt, i) for i, nt in enumerate(self.nonterminals)])
+        self.rule_nt = tuple([self.nt_ids[r.nt] for r in self.rules])
+
+        nt_rules = dict()
+        for i, r in enumerate(self.rules):
+            nt_rules.setdefault(r.nt, []).append(i)
+        self.nt_rules = ReadOnlyDict([(nt, tuple(ids)) for nt, ids in nt_rules.items()])
+
+        self.children = tuple([tuple([i for i, a in enumerate(None2Empty(r.to)) if self.is_nonterminal(a)])
+                               for r in self.rules])
+        self.child_types = tuple([tuple([r.to[i] for i in c]) for r, c in zip(self.rules, self.children)])
+        self.is_terminal_rule = tuple([len(c) == 0 for c in self.children])
+
+        # normalizing constants for each nonterminal, not counting bound variables
+        Z = dict()
+        for r in self.rules:
+            Z[r.nt] = Z.get(r.nt, 0.0) + r.p
+        self.Z = ReadOnlyDict(Z)
+        self.log_Z = ReadOnlyDict([(nt, log(z)) for nt, z in Z.items()])
+        self.log_p = tuple([log(r.p) - self.log_Z[r.nt] for r in self.rules])
+
+        self.bv = tuple([(r.bv_type, grammar.BV_P if r.bv_p is None else r.bv_p, r.bv_args)
+                         if isinstance(r, BVAddGrammarRule) else None for r in self.rules])
+
+        self.frozen = True
+
+    def __setattr__(self, name, value):
+        if getattr(self, 'frozen', False):
+            raise AttributeError("*** A CompiledGrammar can't be changed; change the grammar and compile it again")
+        object.__setattr__(self, name, value)
+
+    def is_nonterminal(self, x):
+        return isinstance(x, str) and x in self.nt_ids
@@ -0,0 +1,382 @@
+"""
+        Compiling FunctionNodes to Python functions without going through their strings.
+
+        LOTHypothesis.compile_function normally evals str(h): the tree is written out by pystring, put into the
+        display (e.g. "lambda x: %s"), and then parsed and compiled by Python. The compilers here start from the tree:
+
+            ASTCompiler         builds a Python ast from the tree and compiles that, so nothing is written out or
+                                parsed (except each rule's name, once)
+            CombinatorCompiler  makes a closure for each node, which calls its children's closures, so nothing is
+                                parsed or compiled per tree at all (each rule's name is compiled once)
+
+            MemoCompiler        a CombinatorCompiler whose closures remember the values of subtrees, for each
+                                input, in a cache shared between hypotheses, so that the parts of a proposal it
+                                shares with the current hypothesis are not evaluated again
+
+        All give functions that compute the same thing as eval(str(h)):
+
+            compiler = ASTCompiler()
+            f = compiler(h.value, "lambda x: %s")
+
+        and a LOTHypothesis subclass can use one by setting its compiler attribute.
+
+        Rule names are Python fragments, as for pystring: a function name, a terminal (like x or 'red'), or a
+        template with %s for the arguments. These are parsed once and kept. In templates, the placeholder <BV>
+        (for the variable a BVAddFunctionNode binds) is only handled by ASTCompiler; CombinatorCompiler raises
+        NotImplementedError for it, and also needs the display to be a lambda whose body is just %s. Rule names
+        must not bind variables themselves (e.g. a rule named 'lambda x: %s'), since CombinatorCompiler looks up
+        variables in its own environment.
+"""
+import ast
+import re
+
+from LOTlib.Eval import SubexpressionCache
+from LOTlib.FunctionNode import BVAddFunctionNode, BVUseFunctionNode, isFunctionNode
+from LOTlib.Miscellaneous import None2Empty
+from LOTlib.Primitives import Features, Logic, Number, SetTheory
+
+
+def default_environment():
+    """ What LOTHypothesis evals in: the primitives, and the exceptions of LOTlib.Eval """
+    env = dict()
+    exec "from LOTlib.Eval import *\nfrom LOTlib.Primitives import *" in env
+    return env
+
+# The names we put into templates in place of %s and <BV>
+ARG = '__lotlib_arg%s__'
+BV = '__lotlib_bv__'
+placeholder_regex = re.compile(r"%s|%%|<BV>")
+
+# Where the nodes we make are in the "source"
+LOCATION = {'lineno': 1, 'col_offset': 0}
+
+# What a SubexpressionCache gives when it doesn't have a value (since values may be None)
+MISSING = object()
+
+# The primitives whose values depend only on their arguments, and which don't change them: those in these
+# modules, except the random ones and set_add_
+PURE_PRIMITIVES = frozenset([n for m in [Features, Logic, Number, SetTheory] for n, v in vars(m).items()
+                             if callable(v) and n.endswith('_')]).difference(['sample_', 'sample_unique_', 'set_add_'])
+
+
+def fill(node, args, bvn):
+    """ A copy of the ast node (from Compiler.fragment), with args in place of the %s's and bvn in place of <BV> """
+    if isinstance(node, ast.Name):
+        if node.id.startswith('__lotlib_arg'):
+            return args[int(node.id[len('__lotlib_arg'):-2])]
+        elif node.id == BV:
+            assert bvn, "*** <BV> must be in a BVAddFunctionNode"
+            return ast.copy_location(ast.Name(id=bvn, ctx=node.ctx), node)
+        return node
+    new = node.__class__()
+    for field, value in ast.iter_fields(node):
+        if isinstance(value, list):
+            value = [fill(v, args, bvn) if isinstance(v, ast.AST) else v for v in value]
+        elif isinstance(value, ast.AST):
+            value = fill(value, args, bvn)
+        setattr(new, field, value)
+    return ast.copy_location(new, node)
+
+
+class Compiler(object):
+    """
+    What the compilers share: the environment to compile in, and the parsed rule names.
+
+    Arguments
+    ---------
+    env : dict
+        The globals that compiled functions look names up in (by default, default_environment())
+
+    """
+    def __init__(self, env=None):
+        self.env = default_environment() if env is None else env
+        self.fragments = dict() # rule name -> (its ast, how many %s it has)
+
+    def fragment(self, name):
+        """ The ast for name, with %s replaced by ARG % i for the i'th, and <BV> by BV, and how many %s it has """
+        if name not in self.fragments:
+            count = [0]
+            def replace(m):
+                if m.group(0) == '%s':
+                    count[0] += 1
+                    return ARG % (count[0]-1)
+                elif m.group(0) == '%%':
+                    return '%'
+                else:
+                    return BV
+            self.fragments[name] = (ast.parse(placeholder_regex.sub(replace, name), mode='eval').body, count[0])
+        return self.fragments[name]
+
+    def __call__(self, t, display="lambda x: %s"):
+        raise NotImplementedError
+
+
+class ASTCompiler(Compiler):
+    """ Compile a tree by building its Python ast (see the top of this file) """
+
+    def __call__(self, t, display="lambda x: %s"):
+        """ The function that display % str(t) evals to """
+        body = fill(self.fragment(display)[0], [self.to_ast(t, 0, dict())], None)
+        # every node has a location (from its fragment, or LOCATION), so we needn't fix_missing_locations
+        return eval(compile(ast.Expression(body), '<LOTlib>', 'eval'), self.env)
+
+    def name_ast(self, name, bvn):
+        """ The ast for a name with no %s's (shared, unless it has a <BV> to fill in) """
+        fragment = self.fragment(name)[0]
+        return fill(fragment, [], bvn) if '<BV>' in name else fragment
+
+    def to_ast(self, x, d, bv_names):
+        """ The ast for x, as pystring(x, d, bv_names) would write it """
+        if not isFunctionNode(x):
+            return self.fragment(x)[0]
+
+        bvn = None
+        if isinstance(x, BVAddFunctionNode):
+            bvn = x.added_rule.bv_prefix+str(d)
+            bv_names[x.added_rule.name] = bvn
+
+        if x.args is None: # terminal
+            if isinstance(x, BVUseFunctionNode):
+                ret = ast.Name(id=bv_names.get(x.name, x.name), ctx=ast.Load(), **LOCATION)
+            else:
+                ret = self.name_ast(x.name, bvn)
+        elif x.name == '':
+            assert len(x.args) == 1, "Null names must have exactly 1 argument"
+            ret = self.to_ast(x.args[0], d+1, bv_names)
+        elif x.name == 'lambda':
+            assert len(x.args) == 1
+            params = [] if bvn is None else [ast.Name(id=bvn, ctx=ast.Param(), **LOCATION)]
+            ret = ast.Lambda(args=ast.arguments(args=params, vararg=None, kwarg=None, defaults=[]),
+                             body=self.to_ast(x.args[0], d+1, bv_names), **LOCATION)
+        else:
+            args = [self.to_ast(a, d+1, bv_names) for a in x.args]
+            fragment, nargs = self.fragment(x.name)
+            if nargs > 0:
+                ret = fill(fragment, args, bvn)
+            else:
+                if isinstance(x, BVUseFunctionNode):
+                    f = ast.Name(id=bv_names.get(x.name, x.name), ctx=ast.Load(), **LOCATION)
+                else:
+                    f = self.name_ast(x.name, bvn)
+                ret = ast.Call(func=f, args=args, keywords=[], starargs=None, kwargs=None, **LOCATION)
+
+        if isinstance(x, BVAddFunctionNode):
+            del bv_names[x.added_rule.name]
+
+        return ret
+
+
+class CombinatorCompiler(Compiler):
+    """
+    Compile a tree into closures (see the top of this file). Each node becomes a function of an environment (a
+    dict from the display's arguments and the bound variables to their values) that computes its value.
+    """
+    def __init__(self, env=None):
+        Compiler.__init__(self, env=env)
+        self.closures = dict() # (rule name, the variables it uses) -> its compiled fragment
+
+    def __call__(self, t, display="lambda x: %s"):
+        fragment, nargs = self.fragment(display)
+        if not (isinstance(fragment, ast.Lambda) and isinstance(fragment.body, ast.Name) and nargs == 1 and
+                fragment.body.id == ARG % 0 and fragment.args.vararg is None and fragment.args.kwarg is None and
+                len(fragment.args.defaults) == 0):
+            raise NotImplementedError("*** CombinatorCompiler needs a display like 'lambda x: %s'")
+
+        names = tuple([a.id for a in fragment.args.args])
+        body = self.to_closure(t, 0, dict(), frozenset(names))
+        def f(*args):
+            return body(dict(zip(names, args)))
+        return f
+
+    def compiled(self, name, scope):
+        """ The fragment for name as a function of the environment and the closures for its %s's """
+        fragment, nargs = self.fragment(name)
+        uses = frozenset([n.id for n in ast.walk(fragment) if isinstance(n, ast.Name)]).intersection(scope)
+        key = (name, uses)
+        if key not in self.closures:
+            env_name = ast.Name(id='__env__', ctx=ast.Load())
+
+            class Rewrite(ast.NodeTransformer):
+                def visit_Name(self, node):
+                    if node.id == BV:
+                        raise NotImplementedError("*** CombinatorCompiler can't compile <BV> in %s" % name)
+                    elif node.id.startswith('__lotlib_arg'): # call its closure on the environment
+                        return ast.copy_location(ast.Call(func=ast.Name(id=node.id, ctx=ast.Load()), args=[env_name],
+                                                          keywords=[], starargs=None, kwargs=None), node)
+                    elif node.id in uses: # look it up in the environment
+                        return ast.copy_location(ast.Subscript(value=env_name, slice=ast.Index(value=ast.Str(s=node.id)),
+                                                               ctx=node.ctx), node)
+                    return node
+
+            params = [ast.Name(id=n, ctx=ast.Param()) for n in ['__env__'] + [ARG % i for i in xrange(nargs)]]
+            f = ast.Lambda(args=ast.arguments(args=params, vararg=None, kwarg=None, defaults=[]),
+                           body=Rewrite().visit(fill(fragment, [ast.Name(id=ARG % i, ctx=ast.Load()) for i in xrange(nargs)],
+                                                     None)))
+            expression = ast.fix_missing_locations(ast.Expression(f))
+            self.closures[key] = eval(compile(expression, '<LOTlib>', 'eval'), self.env)
+        return self.closures[key]
+
+    def variable(self, n, scope):
+        """ The closure for the bound variable n (which is a global if no lambda in scope binds it, as in eval) """
+        if n in scope:
+            return lambda env: env[n]
+        return self.compiled(n, scope)
+
+    def to_closure(self, x, d, bv_names, scope):
+        """ The closure for x, where scope is the names of the variables that will be in its environment """
+        if not isFunctionNode(x):
+            return self.compiled(x, scope)
+
+        if isinstance(x, BVAddFunctionNode):
+            bvn = x.added_rule.bv_prefix+str(d)
+            bv_names[x.added_rule.name] = bvn
+            scope = scope.union([bvn])
+        else:
+            bvn = None
+
+        if x.args is None: # terminal
+            ret = self.variable(bv_names.get(x.name, x.name), scope) if isinstance(x, BVUseFunctionNode) \
+                  else self.compiled(x.name, scope)
+        elif x.name == '':
+            assert len(x.args) == 1, "Null names must have exactly 1 argument"
+            ret = self.to_closure(x.args[0], d+1, bv_names, scope)
+        elif x.name == 'lambda':
+            assert len(x.args) == 1
+            body = self.to_closure(x.args[0], d+1, bv_names, scope)
+            if bvn is None: # a thunk
+                ret = lambda env: (lambda: body(env))
+            else:
+                def ret(env):
+                    def f(v):
+                        inner = dict(env)
+                        inner[bvn] = v
+                        return body(inner)
+                    return f
+        else:
+            kids = [self.to_closure(a, d+1, bv_names, scope) for a in x.args]
+            if self.fragment(x.name)[1] > 0:
+                g = self.compiled(x.name, scope)
+                ret = lambda env: g(env, *kids)
+            else:
+                g = self.variable(bv_names.get(x.name, x.name), scope) if isinstance(x, BVUseFunctionNode) \
+                    else self.compiled(x.name, scope)
+                ret = lambda env: g(env)(*[k(env) for k in kids])
+
+        if isinstance(x, BVAddFunctionNode):
+            del bv_names[x.added_rule.name]
+
+        return ret
+
+
+class MemoCompiler(CombinatorCompiler):
+    """
+    A CombinatorCompiler whose closures look up the values of subtrees in cache (a SubexpressionCache), keyed by
+    the subtree's text and the ids of the arguments it uses, and only compute them if they are not there. Since
+    the cache is shared, a proposal that keeps most of a hypothesis's tree (as regeneration proposals do) mostly
+    costs evaluating the part that changed, once the hypothesis has been called on the data.
+
+    Only subtrees that are worth it and safe to remember are looked up: those with at least min_size nodes, with
+    no lambdas or bound variables, and whose rule names use only pure functions (those in pure), the display's
+    arguments and constants.
+
+    Subtrees that are given to something impure (like set_add_, which changes its argument) aren't looked up,
+    since their values could be changed in the cache. The arguments are kept in the cache with each value, so
+    their ids aren't reused while it's there. But they, and what the function returns, must not be changed.
+
+    Looking a value up costs a few microseconds, so this only pays when subtrees are expensive (like operations
+    on big sets), not for cheap primitives like and_. It doesn't help inside recursive hypotheses either, since
+    their inner calls are on new arguments.
+    """
+    def __init__(self, env=None, cache=None, pure=PURE_PRIMITIVES, min_size=3):
+        CombinatorCompiler.__init__(self, env=env)
+        self.cache = SubexpressionCache() if cache is None else cache
+        self.pure = frozenset(pure).union(['True', 'False', 'None'])
+        self.min_size = min_size
+        self.uses = dict() # (rule name, the display's arguments) -> the arguments it uses, or None if it isn't pure
+        self.keys = None # while compiling: id of each subtree we look up -> its key, and the arguments it uses
+
+    def __call__(self, t, display="lambda x: %s"):
+        fragment, nargs = self.fragment(display)
+        names = tuple([a.id for a in fragment.args.args]) if isinstance(fragment, ast.Lambda) else ()
+
+        self.keys = dict()
+        try:
+            self.find_keys(t, display, frozenset(names))
+            return CombinatorCompiler.__call__(self, t, display)
+        finally:
+            self.keys = None
+
+    def pure_uses(self, name, names):
+        """ Which of names (the display's arguments) the rule name uses, or None if it uses anything not pure """
+        key = (name, names)
+        if key not in self.uses:
+            used = set()
+            for n in ast.walk(self.fragment(name)[0]):
+                if isinstance(n, ast.Name) and n.id in names:
+                    used.add(n.id)
+                elif isinstance(n, ast.Name) and not (n.id in self.pure or n.id.startswith('__lotlib_arg')):
+                    break
+                elif isinstance(n, ast.Call) and not isinstance(n.func, ast.Name):
+                    break
+                elif isinstance(n, (ast.Lambda, ast.GeneratorExp, ast.ListComp, ast.SetComp, ast.DictComp)):
+                    break
+            else:
+                self.uses[key] = frozenset(used)
+                return self.uses[key]
+            self.uses[key] = None
+        return self.uses[key]
+
+    def find_keys(self, x, display, names, safe=True):
+        """
+        Put the key for each subtree of x we look up in self.keys, and return the text of x (as pystring gives it)
+        if it could be looked up (or None), the arguments it uses, and the number of nodes in it.
+
+        safe is whether what x is given to is pure. If it isn't (e.g. set_add_, which changes its argument), x's
+        value could be changed after we cached it, so x isn't looked up.
+        """
+        if not isFunctionNode(x):
+            return x, self.pure_uses(x, names), 0
+
+        null = (x.name == '' and x.args is not None)
+        closed = not (isinstance(x, (BVAddFunctionNode, BVUseFunctionNode)) or x.name == 'lambda')
+        mine = self.pure_uses(x.name, names) if closed and not null else None
+
+        kid_safe = safe if null else (mine is not None)
+        kids = [self.find_keys(a, display, names, safe=kid_safe) for a in None2Empty(x.args)]
+        size = 1 + sum([k[2] for k in kids])
+        if not closed or (mine is None and not null) or any([k[1] is None for k in kids]):
+            return None, None, size
+
+        used = frozenset().union(*[k[1] for k in kids])
+        texts = [k[0] for k in kids]
+        if null:
+            text = texts[0]
+        else:
+            used = used.union(mine)
+            if x.args is None:
+                text = x.name
+            elif self.fragment(x.name)[1] > 0:
+                text = x.name % tuple(texts)
+            else:
+                text = x.name + '(' + ', '.join(texts) + ')'
+
+        if safe and x.args is not None and size >= self.min_size:
+            self.keys[id(x)] = (display % text, tuple(sorted(used)))
+        return text, used, size
+
+    def to_closure(self, x, d, bv_names, scope):
+        ret = CombinatorCompiler.to_closure(self, x, d, bv_names, scope)
+        if not isFunctionNode(x) or id(x) not in self.keys:
+            return ret
+
+        cache = self.cache
+        key, used = self.keys[id(x)]
+        def memoized(env):
+            values = tuple([env[n] for n in used])
+            k = (key, tuple(map(id, values)))
+            v = cache.get(k, MISSING)
+            if v is MISSING:
+                v = (values, ret(env))
+                cache.set(k, v)
+            return v[1]
+        return memoized
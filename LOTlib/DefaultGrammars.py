@@ -200,3 +200,16 @@ infiniteTestGrammar.add_rule('L', 'lambda', ['A'], 0.11, bv_p=0.07, bv_type='A')
 infiniteTestGrammar.add_rule('A', 'apply_', ['LF', 'A'], 0.10)
 infiniteTestGrammar.add_rule('LF', 'lambda', ['A'], 0.11, bv_p=0.07, bv_type='A', bv_args=['A'], bv_prefix='F')
 
+
+# Boolean functions of two inputs, for testing what hypotheses compile to: "lambda x: %s" of each tree can be
+# called on each of booleanTestInputs
+booleanTestGrammar = Grammar()
+
+booleanTestGrammar.add_rule('START', '', ['BOOL'], 1.0)
+
+booleanTestGrammar.add_rule('BOOL', 'and_', ['BOOL', 'BOOL'], 1.0)
+booleanTestGrammar.add_rule('BOOL', 'not_', ['BOOL'], 1.0)
+booleanTestGrammar.add_rule('BOOL', 'x[0]', None, 2.0)
+booleanTestGrammar.add_rule('BOOL', 'x[1]', None, 2.0)
+
+booleanTestInputs = [[a, b] for a in [True, False] for b in [True, False]]
@@ -0,0 +1,234 @@
+"""
+        Enumerate trees by depth, with dynamic programming.
+
+        Every tree of depth d is a rule applied to children of depth < d, at least one of which has depth d-1. So we
+        keep a table of the subtrees for each (nonterminal, depth) and build parents from the tables, instead of
+        re-enumerating each child for every combination of its siblings, as Grammar.enumerate_at_depth used to.
+
+        The subtrees in the tables are nested tuples (code, kids), where code is the index of the rule in
+        grammar.compile().rules (or, if negative, a use of the -code-1'th bound variable in scope) and kids
+        has a subtree (or, if we are not making leaves, a nonterminal) for each FunctionNode arg of the rule. Which
+        subtrees are possible depends on the bound variables in scope, so that is part of each table's key too.
+        Bound variables are numbered by position in scope rather than named, so that the tables can be shared
+        between lambdas. Subtrees are only made into FunctionNodes when we yield them.
+
+        Tables are kept in memory up to max_entries subtrees in total. Past that, they are written to files in
+        spill_dir if it is given, or else re-enumerated whenever they are needed.
+"""
+import os
+import cPickle
+from itertools import count
+
+from LOTlib.Miscellaneous import None2Empty, infrange
+
+
+def bv_scope_item(nt, to, p):
+    """ What a table needs to know about a bound variable in scope """
+    return (nt, None if to is None else tuple(to), p)
+
+
+def lazy_product(sources, prefix=()):
+    """
+    Yield the product of the iterables made by calling each of sources, without holding it in memory as
+    itertools.product does. The first varies slowest.
+    """
+    if len(sources) == 0:
+        yield prefix
+    else:
+        for x in sources[0]():
+            for rest in lazy_product(sources[1:], prefix + (x,)):
+                yield rest
+
+
+class TableEnumerator(object):
+    """
+    What DepthEnumerator and SizeEnumerator share: the tables of subtrees for each (nonterminal, index, scope),
+    where the index is a depth or a size, and making the subtrees into FunctionNodes. Subclasses say what the
+    index means by implementing expand.
+
+    Arguments
+    ---------
+    grammar : LOTlib.Grammar
+        The grammar to enumerate. If its version changes, the tables are thrown away.
+    max_entries : int
+        How many subtrees we may keep in memory
+    spill_dir : str
+        If not None, tables that don't fit in memory are written to files here
+
+    """
+    def __init__(self, grammar, max_entries=10**6, spill_dir=None):
+        self.grammar = grammar
+        self.max_entries = max_entries
+        self.spill_dir = spill_dir
+        self.clear()
+
+    def clear(self):
+        """ Throw away all of the tables """
+        self.table = self.grammar.compile()
+        self.tables = dict()   # (nt, index, scope) -> list of subtrees
+        self.spilled = dict()  # (nt, index, scope) -> the file its subtrees are in
+        self.too_big = set()   # keys we can neither keep nor spill, and so re-enumerate
+        self.entries = 0
+        self.spill_count = count()
+
+    def enumerate_at(self, d, nt=None):
+        """ Yield the trees at index d, as FunctionNodes """
+        if nt is None:
+            nt = self.grammar.start
+
+        # The bound variables that are in the grammar right now are in scope
+        scope_rules = list(self.grammar.bv_scope)
+        scope = tuple([bv_scope_item(r.nt, r.to, r.p) for r in scope_rules])
+
+        # The top level isn't stored, since no one will ask for it again
+        for s in self.expand(nt, d, scope):
+            yield self.to_FunctionNode(s, nt, scope_rules)
+
+    def expand(self, nt, d, scope):
+        """ Yield each subtree for nt at index d, with the bound variables in scope (not using nt's own table) """
+        raise NotImplementedError
+
+    # --------------------------------------------------------------------------------------------------------
+    # The tables
+    # --------------------------------------------------------------------------------------------------------
+
+    def subtrees(self, nt, d, scope):
+        """ An iterable of the subtrees for nt of depth d, with the bound variables in scope """
+        if self.table.version != self.grammar.version:
+            self.clear()
+
+        key = (nt, d, scope)
+        if key in self.tables:
+            return self.tables[key]
+        elif key in self.spilled:
+            return self.read_spilled(key)
+        elif key in self.too_big:
+            return self.expand(nt, d, scope)
+
+        entries = []
+        it = self.expand(nt, d, scope)
+        for s in it:
+            entries.append(s)
+            if self.entries + len(entries) > self.max_entries:
+                if self.spill_dir is None:
+                    self.too_big.add(key)
+                    return self.expand(nt, d, scope)
+                else:
+                    self.spill(key, entries, it)
+                    return self.read_spilled(key)
+
+        self.tables[key] = entries
+        self.entries += len(entries)
+        return entries
+
+    def spill(self, key, entries, rest):
+        """ Write entries, followed by everything left in the iterator rest, to a file for key """
+        path = os.path.join(self.spill_dir, 'enumeration-%s-%s.pkl' % (os.getpid(), next(self.spill_count)))
+        with open(path, 'wb') as f:
+            for s in entries:
+                cPickle.dump(s, f, cPickle.HIGHEST_PROTOCOL)
+            for s in rest:
+                cPickle.dump(s, f, cPickle.HIGHEST_PROTOCOL)
+        self.spilled[key] = path
+
+    def read_spilled(self, key):
+        with open(self.spilled[key], 'rb') as f:
+            while True:
+                try:
+                    yield cPickle.load(f)
+                except EOFError:
+                    break
+
+    def expansions(self, nt, scope):
+        """ Each way to expand nt, as (code, the nonterminals of its FunctionNode args, the scope they are in) """
+        table = self.table
+        expansions = []
+        for i in table.nt_rules.get(nt, []):
+            kid_scope = scope
+            if table.bv[i] is not None: # below a lambda, its variable is in scope too
+                bvnt, bvp, bvargs = table.bv[i]
+                kid_scope = scope + (bv_scope_item(bvnt, bvargs, bvp),)
+            expansions.append((i, [table.rules[i].to[c] for c in table.children[i]], kid_scope))
+        for k, (bvnt, to, _) in enumerate(scope):
+            if bvnt == nt:
+                expansions.append((-k-1, [a for a in None2Empty(to) if table.is_nonterminal(a)], scope))
+        return expansions
+
+    # --------------------------------------------------------------------------------------------------------
+    # Making FunctionNodes
+    # --------------------------------------------------------------------------------------------------------
+
+    def to_FunctionNode(self, s, nt, scope_rules, parent=None):
+        """ Make subtree s into a FunctionNode, where scope_rules are the bound variable rules in scope """
+        if isinstance(s, str): # a nonterminal left as a leaf
+            return s
+
+        code, kids = s
+        if code >= 0:
+            fn = self.table.rules[code].make_FunctionNodeStub(self.grammar, parent)
+        else:
+            fn = scope_rules[-code-1].make_FunctionNodeStub(self.grammar, parent)
+
+        if fn.added_rule is not None:
+            scope_rules = scope_rules + [fn.added_rule]
+
+        positions = [i for i, a in enumerate(None2Empty(fn.args)) if self.table.is_nonterminal(a)]
+        for i, k in zip(positions, kids):
+            fn.args[i] = self.to_FunctionNode(k, fn.args[i], scope_rules, parent=fn)
+
+        return fn
+
+
+class DepthEnumerator(TableEnumerator):
+    """
+    Enumerate the trees of a grammar by depth (see the top of this file).
+
+    Arguments
+    ---------
+    grammar : LOTlib.Grammar
+        The grammar to enumerate. If its version changes, the tables are thrown away.
+    leaves : bool
+        As in Grammar.enumerate_at_depth, if False, the nonterminals at depth 0 are left unexpanded
+    max_entries : int
+        How many subtrees we may keep in memory
+    spill_dir : str
+        If not None, tables that don't fit in memory are written to files here
+
+    """
+    def __init__(self, grammar, leaves=True, max_entries=10**6, spill_dir=None):
+        self.leaves = leaves
+        TableEnumerator.__init__(self, grammar, max_entries=max_entries, spill_dir=spill_dir)
+
+    def enumerate(self, d=20, nt=None):
+        """ Yield all trees up to depth d, as FunctionNodes """
+        for i in infrange(d):
+            for t in self.enumerate_at_depth(i, nt=nt):
+                yield t
+
+    def enumerate_at_depth(self, d, nt=None):
+        """ Yield the trees of depth exactly d, as FunctionNodes """
+        return self.enumerate_at(d, nt=nt)
+
+    def expand(self, nt, d, scope):
+        """ Yield each subtree for nt of depth d, with the bound variables in scope (not using nt's own table) """
+        expansions = self.expansions(nt, scope)
+
+        if d == 0:
+            if not self.leaves:
+                yield nt
+            else:
+                for code, kts, _ in expansions:
+                    if len(kts) == 0:
+                        yield (code, ())
+            return
+
+        for code, kts, kid_scope in expansions:
+            m = len(kts) # if 0, this is a terminal and won't be deep enough
+            # Exactly the depth combinations with at least one kid at d-1: the first such kid is at j, so those
+            # before it are shallower, and those after it can be anything
+            for j in xrange(m):
+                depths = [xrange(d-1)]*j + [[d-1]] + [xrange(d)]*(m-j-1)
+                for ds in lazy_product([(lambda ds=ds: ds) for ds in depths]):
+                    sources = [(lambda a=a, di=di: self.subtrees(a, di, kid_scope)) for a, di in zip(kts, ds)]
+                    for kids in lazy_product(sources):
+                        yield (code, kids)
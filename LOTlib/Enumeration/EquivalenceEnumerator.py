@@ -0,0 +1,172 @@
+"""
+        Enumerate trees by depth, keeping only one tree for each function they compute.
+
+        Most trees compute the same function as some smaller tree, as in and_(x, x). So as we fill in the tables of
+        a DepthEnumerator, we evaluate each subtree on a set of probe inputs (usually the inputs of the data), and
+        keep only the most probable subtree for each signature -- the tuple of outputs on the probes -- and
+        nonterminal. Parents are built only from the subtrees that are kept, so the savings multiply with depth.
+
+        The tables are filled in order of depth, so a subtree is dropped if it computes something a shallower one
+        already does, even if it is more probable. Within a depth, the most probable subtree is kept.
+
+        Subtrees are kept without being compared when they cannot be evaluated on their own: when they use bound
+        variables from outside, when they compute functions, or when they raise an exception other than an
+        EvaluationException (e.g. a NameError from recurse_). EvaluationExceptions count as outputs.
+
+        Since the signatures only tell subtrees apart on the probes, two subtrees that differ on other inputs
+        may be merged; and primitives must be deterministic.
+"""
+from math import log
+
+from LOTlib.Enumeration.DepthEnumerator import DepthEnumerator, bv_scope_item
+from LOTlib.Eval import EvaluationException
+from LOTlib.Miscellaneous import Infinity, None2Empty
+import LOTlib.Primitives # so that the primitives are defined when we evaluate subtrees
+
+
+def hashable(x):
+    """ A hashable version of output x, for signatures. Raises TypeError if there isn't one. """
+    if isinstance(x, (list, tuple)):
+        return tuple(map(hashable, x))
+    elif isinstance(x, (set, frozenset)):
+        return frozenset(map(hashable, x))
+    elif isinstance(x, dict):
+        return frozenset([(hashable(k), hashable(v)) for k, v in x.items()])
+    elif callable(x) and not isinstance(x, type): # exception classes are fine
+        raise TypeError("*** Functions cannot be compared")
+    hash(x)
+    return x
+
+
+class EquivalenceEnumerator(DepthEnumerator):
+    """
+    Enumerate the trees of a grammar by depth, one for each signature (see the top of this file).
+
+    Arguments
+    ---------
+    grammar : LOTlib.Grammar
+        The grammar to enumerate
+    inputs : list
+        The probes -- a list of the args to call each subtree with, as in FunctionData.input
+    display : str
+        How to make a subtree into a function, as in LOTHypothesis
+
+    Attributes
+    ----------
+    seen : dict
+        (nt, scope) -> the signatures we have kept a subtree for
+    pruned : int
+        How many subtrees we have dropped
+
+    """
+    def __init__(self, grammar, inputs, display="lambda x: %s"):
+        self.inputs = [tuple(i) for i in inputs]
+        self.display = display
+        # Pruned tables are always kept in memory: they can't be enumerated again, since what they keep depends
+        # on what was seen before them
+        DepthEnumerator.__init__(self, grammar, leaves=True, max_entries=Infinity)
+
+    def clear(self):
+        DepthEnumerator.clear(self)
+        self.seen = dict()
+        self.pruned = 0
+
+    def enumerate_at_depth(self, d, nt=None):
+        """ Yield the trees of depth exactly d, as FunctionNodes, other than those that compute the same thing
+            on the probes as a tree we have already yielded (at this or a lower depth) """
+        if nt is None:
+            nt = self.grammar.start
+
+        scope_rules = list(self.grammar.bv_scope)
+        scope = tuple([bv_scope_item(r.nt, r.to, r.p) for r in scope_rules])
+
+        for s in self.subtrees(nt, d, scope):
+            yield self.to_FunctionNode(s, nt, scope_rules)
+
+    def subtrees(self, nt, d, scope):
+        if self.table.version != self.grammar.version:
+            self.clear()
+
+        key = (nt, d, scope)
+        if key not in self.tables:
+            # Shallower tables first, so that their signatures are seen first
+            for di in xrange(d):
+                self.subtrees(nt, di, scope)
+            self.tables[key] = self.prune(nt, scope, self.expand(nt, d, scope))
+            self.entries += len(self.tables[key])
+        return self.tables[key]
+
+    def prune(self, nt, scope, subtrees):
+        """ The subtrees to keep: the most probable for each new signature, and those without one """
+        seen = self.seen.setdefault((nt, scope), set())
+
+        kept = [] # (order, subtree) for those without a signature
+        best = dict() # signature -> (lp, order, subtree)
+        compared = 0
+        for i, s in enumerate(subtrees):
+            sig = self.signature(s, nt, scope)
+            if sig is None:
+                kept.append((i, s))
+            elif sig in seen:
+                self.pruned += 1
+            else:
+                compared += 1
+                lp = self.log_probability(s, nt, scope)
+                if sig not in best or lp > best[sig][0]:
+                    best[sig] = (lp, i, s)
+
+        self.pruned += compared - len(best)
+        seen.update(best.keys())
+
+        kept.extend([(i, s) for _, i, s in best.values()])
+        kept.sort(key=lambda x: x[0]) # in the order DepthEnumerator would give them
+        return [s for _, s in kept]
+
+    def signature(self, s, nt, scope):
+        """ The outputs of subtree s on the probes, or None if it can't be evaluated on its own """
+        if self.uses_scope(s, len(scope)):
+            return None
+
+        try:
+            f = eval(self.display % str(self.to_FunctionNode(s, nt, [None]*len(scope))))
+        except Exception:
+            return None
+
+        outputs = []
+        for args in self.inputs:
+            try:
+                outputs.append(f(*args))
+            except EvaluationException as e:
+                outputs.append(type(e))
+            except Exception:
+                return None
+
+        try:
+            return hashable(outputs)
+        except TypeError:
+            return None
+
+    def uses_scope(self, s, n):
+        """ Does subtree s use any of the first n bound variables in scope? """
+        code, kids = s
+        return (code < 0 and -code-1 < n) or any([self.uses_scope(k, n) for k in kids])
+
+    def log_probability(self, s, nt, scope):
+        """ The log probability of subtree s of nt, with the bound variables in scope """
+        table = self.table
+        code, kids = s
+
+        Z = table.Z.get(nt, 0.0) + sum([p for bvnt, _, p in scope if bvnt == nt])
+        if code >= 0:
+            r = table.rules[code]
+            lp = log(r.p) - log(Z)
+            kid_nts = [r.to[c] for c in table.children[code]]
+            if table.bv[code] is not None:
+                bvnt, bvp, bvargs = table.bv[code]
+                scope = scope + (bv_scope_item(bvnt, bvargs, bvp),)
+        else:
+            _, to, p = scope[-code-1]
+            lp = log(p) - log(Z)
+            kid_nts = [a for a in None2Empty(to) if table.is_nonterminal(a)]
+
+        return lp + sum([self.log_probability(k, a, scope) for k, a in zip(kids, kid_nts)])
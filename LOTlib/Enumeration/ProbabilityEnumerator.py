@@ -0,0 +1,165 @@
+"""
+        Enumerate trees in order of decreasing prior probability.
+
+        This is a best-first (A*) search over partial trees. A partial tree is the rules chosen so far, in prefix
+        order (as in CompactTree), along with the nonterminals still to expand. Its priority is its log probability
+        so far plus, for each nonterminal still to expand, an upper bound on the log probability of any way to
+        complete it. Since that bound never underestimates, complete trees come off the queue most probable first.
+
+        The enumerator keeps its queue between calls to next, so it can be resumed, and it can be pickled. If the
+        queue grows past max_queue, its worse half is dropped; dropped_mass is an upper bound on the prior mass of
+        the trees we will never yield because of that.
+"""
+import heapq
+from math import log, exp
+
+try: import numpy as np
+except ImportError: import numpypy as np
+
+from LOTlib.CompactTree import CompactTree, BV_USE
+from LOTlib.Miscellaneous import Infinity, None2Empty
+
+
+def completion_bounds(table):
+    """
+    For each nonterminal in a CompiledGrammar, an upper bound on the log probability of any tree from it.
+
+    This is the best tree's log probability without bound variables. Bound variables in scope only lower the
+    probability of the other rules, and a bound variable rule has at most bv_p/(Z+bv_p), so we count each kind
+    of bound variable as if it were the only one in scope.
+    """
+    bound = dict()
+    def b(nt):
+        return bound.get(nt, -Infinity)
+
+    # (nt, log probability, kid nonterminals) for each way to expand something
+    expansions = [(r.nt, log(r.p) - log(table.Z[r.nt]), [r.to[c] for c in table.children[i]])
+                  for i, r in enumerate(table.rules)]
+    for bvnt, bvp, bvargs in [x for x in table.bv if x is not None]:
+        expansions.append((bvnt, log(bvp) - log(table.Z.get(bvnt, 0.0) + bvp),
+                           [a for a in None2Empty(bvargs) if table.is_nonterminal(a)]))
+
+    # Each round finds the best trees one level taller, so this stops after at most one round per nonterminal
+    changed = True
+    while changed:
+        changed = False
+        for nt, lp, kids in expansions:
+            v = lp + sum([b(k) for k in kids])
+            if v > b(nt):
+                bound[nt] = v
+                changed = True
+
+    return bound
+
+
+class ProbabilityEnumerator(object):
+    """
+    Yield the trees of a grammar, most probable first (see the top of this file).
+
+    Arguments
+    ---------
+    grammar : LOTlib.Grammar
+        The grammar; its rules must not change while we enumerate
+    nt : str
+        The nonterminal to start from -- None means grammar.start
+    max_queue : int
+        How many partial trees we may keep
+
+    Attributes
+    ----------
+    mass : float
+        The total prior probability of the trees yielded so far
+    dropped_mass : float
+        An upper bound on the prior probability of the trees we have dropped to stay within max_queue
+
+    """
+    def __init__(self, grammar, nt=None, max_queue=10**6):
+        self.grammar = grammar
+        self.table = grammar.compile()
+        self.bound = completion_bounds(self.table)
+        self.max_queue = max_queue
+
+        self.queue = []
+        self.pushed = 0 # so that ties are broken by order
+        self.mass = 0.0
+        self.dropped_mass = 0.0
+
+        if nt is None:
+            nt = grammar.start
+        # a partial tree is (log probability, bound for the rest, codes, bindings, nonterminals to expand (with
+        # the positions of the lambdas in scope for each))
+        self.push(0.0, self.bound.get(nt, -Infinity), (), (), ((nt, ()),))
+
+    def push(self, lp, h, codes, bindings, pending):
+        if h == -Infinity: # can't be completed
+            return
+        heapq.heappush(self.queue, (-(lp+h), self.pushed, lp, h, codes, bindings, pending))
+        self.pushed += 1
+
+        if len(self.queue) > self.max_queue:
+            keep = self.max_queue // 2
+            self.queue.sort()
+            for item in self.queue[keep:]:
+                # h only bounds the best completion, not all of them, but their total is at most 1
+                self.dropped_mass += exp(item[2])
+            self.queue = self.queue[:keep] # sorted, so still a heap
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        """ The next most probable tree, as a FunctionNode """
+        return self.next_compact().to_FunctionNode(self.grammar)
+
+    def next_compact(self):
+        """ The next most probable tree, as a CompactTree """
+        assert self.table.version == self.grammar.version, "*** The grammar changed during enumeration"
+        table, bound = self.table, self.bound
+
+        while self.queue:
+            _, _, lp, h, codes, bindings, pending = heapq.heappop(self.queue)
+
+            if len(pending) == 0:
+                self.mass += exp(lp)
+                return CompactTree(np.array(codes, dtype=np.int32),
+                                   np.array(bindings, dtype=np.int32) if len(bindings) > 0 else None)
+
+            # expand the leftmost nonterminal, so that codes stay in prefix order
+            (nt, scope), rest = pending[0], pending[1:]
+            bvs = [pos for pos in scope if table.bv[codes[pos]][0] == nt]
+            Z = table.Z.get(nt, 0.0) + sum([table.bv[codes[pos]][1] for pos in bvs])
+            h = h - bound[nt]
+
+            for i in table.nt_rules.get(nt, []):
+                r = table.rules[i]
+                kid_scope = scope + (len(codes),) if table.bv[i] is not None else scope
+                kids = tuple([(r.to[c], kid_scope) for c in table.children[i]])
+                self.push(lp + log(r.p) - log(Z), h + sum([bound.get(k, -Infinity) for k, _ in kids]),
+                          codes + (i,), bindings, kids + rest)
+
+            for pos in bvs:
+                _, bvp, bvargs = table.bv[codes[pos]]
+                kids = tuple([(a, scope) for a in None2Empty(bvargs) if table.is_nonterminal(a)])
+                self.push(lp + log(bvp) - log(Z), h + sum([bound.get(k, -Infinity) for k, _ in kids]),
+                          codes + (BV_USE,), bindings + (pos,), kids + rest)
+
+        raise StopIteration
+
+    def __getstate__(self):
+        # The table is rebuilt from the grammar when we are loaded, since its version only means something in
+        # this process. Its rules may come out in a different order then, so we keep their signatures to map
+        # the codes in the queue to the new indices.
+        state = dict(self.__dict__)
+        del state['table']
+        state['signatures'] = [r.get_rule_signature() for r in self.table.rules]
+        return state
+
+    def __setstate__(self, state):
+        signatures = state.pop('signatures')
+        self.__dict__.update(state)
+        self.table = self.grammar.compile()
+
+        new_code = [self.table.sig2idx[sig] for sig in signatures]
+        def remap(codes):
+            return tuple([c if c == BV_USE else new_code[c] for c in codes])
+        self.queue = [item[:4] + (remap(item[4]),) + item[5:] for item in self.queue]
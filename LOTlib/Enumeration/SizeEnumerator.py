@@ -0,0 +1,60 @@
+"""
+        Enumerate trees by size (number of nodes, as in FunctionNode.count_nodes), with dynamic programming.
+
+        This uses the same tables as DepthEnumerator (both are TableEnumerators), but indexed by size instead of
+        depth: a tree of size n is a rule applied to children whose sizes add up to n-1. So trees come out
+        smallest first, and an enumeration up to maxnodes makes exactly the trees within it, instead of making
+        trees by depth and throwing away the big ones. Bound variables are handled just as in DepthEnumerator.
+
+        Each size is enumerated on its own, so the work can be split between processes by giving each a range
+        of sizes (min_nodes to max_nodes). They each fill in the tables for smaller sizes as they need them.
+"""
+from LOTlib.Enumeration.DepthEnumerator import TableEnumerator, lazy_product
+
+
+def compositions(n, m):
+    """ Yield each tuple of m positive ints that add up to n """
+    if m == 1:
+        yield (n,)
+    else:
+        for first in xrange(1, n-m+2):
+            for rest in compositions(n-first, m-1):
+                yield (first,) + rest
+
+
+class SizeEnumerator(TableEnumerator):
+    """
+    Enumerate the trees of a grammar by size (see the top of this file).
+
+    Arguments
+    ---------
+    grammar : LOTlib.Grammar
+        The grammar to enumerate. If its version changes, the tables are thrown away.
+    max_entries : int
+        How many subtrees we may keep in memory
+    spill_dir : str
+        If not None, tables that don't fit in memory are written to files here
+
+    """
+    def enumerate(self, max_nodes=20, nt=None, min_nodes=1):
+        """ Yield all trees with min_nodes to max_nodes nodes, smallest first, as FunctionNodes """
+        for n in xrange(min_nodes, max_nodes+1):
+            for t in self.enumerate_at_size(n, nt=nt):
+                yield t
+
+    def enumerate_at_size(self, n, nt=None):
+        """ Yield the trees with exactly n nodes, as FunctionNodes """
+        return self.enumerate_at(n, nt=nt)
+
+    def expand(self, nt, n, scope):
+        """ Yield each subtree for nt with n nodes, with the bound variables in scope (not using nt's own table) """
+        for code, kts, kid_scope in self.expansions(nt, scope):
+            m = len(kts)
+            if m == 0:
+                if n == 1:
+                    yield (code, ())
+            elif n-1 >= m: # every kid has at least one node
+                for sizes in compositions(n-1, m):
+                    sources = [(lambda a=a, ni=ni: self.subtrees(a, ni, kid_scope)) for a, ni in zip(kts, sizes)]
+                    for kids in lazy_product(sources):
+                        yield (code, kids)
@@ -0,0 +1,4 @@
+from DepthEnumerator import DepthEnumerator
+from EquivalenceEnumerator import EquivalenceEnumerator
+from ProbabilityEnumerator import ProbabilityEnumerator
+from SizeEnumerator import SizeEnumerator
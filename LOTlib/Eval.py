@@ -1,7 +1,14 @@
 """
     Routines for evaling
 """
+import os
 import sys
+import warnings
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+from timeit import default_timer as timer
+from weakref import WeakSet
 
 """
     The exceptions we throw for all problems in Evaluation
@@ -17,31 +24,217 @@ class RecursionDepthException(EvaluationException):
     pass
 
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-# We define two variables, one for how many function calls have been
-# used in a single function/hypothesis, and one for how many have been
-# run over the entire course of the experiment
-# LOCAL_PRIMITIVE_OPS = 0
-# GLOBAL_PRIMITIVE_OPS = 0
+# Fuel
+#
+# Every call to a primitive uses one unit of fuel, and when it runs out, the primitive raises TooBigException
+# instead. So a program can be given a budget of steps, as in
+#
+#     with fuel_budget(10000):
+#         h(*datum.input)
+#
+# which Hypothesis.compute_likelihood does for each datum when the hypothesis has a fuel (see
+# Hypothesis.bounded_single_likelihood). Primitives whose work grows with what they make (like ones that build
+# big sets or strings) also use a unit for each element of what they return, if they are marked with
+# @fuel_cost(len) (below @primitive). Outside of any budget, the fuel is infinite.
+#
+# Like profiling (below), this is decided when each primitive is decorated. Wrapping makes calling a cheap
+# primitive (like and_) a few times slower, so it is off by default for them; set the environment variable
+# LOTLIB_PRIMITIVE_FUEL=1, or call fuel_primitives() before the primitives are imported. Primitives marked with
+# @fuel_cost always use fuel, since what they build costs far more than the wrapper, so budgets limit the sets
+# and strings a program makes either way. Setting a budget on a hypothesis warns (see check_fueled) if any
+# primitives were decorated without fuel.
 #  ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-def primitive(fn):
-    """A decocator for basic primitives that increments our counters. Used to be known as @LOTlib_primitive"""
+FUEL_PRIMITIVES = os.environ.get('LOTLIB_PRIMITIVE_FUEL', '') not in ('', '0')
 
-    """
-    def inside(*args, **kwargs):
+def fuel_primitives(on=True):
+    """ Whether primitives decorated from now on use fuel (ones already decorated are not changed) """
+    global FUEL_PRIMITIVES
+    FUEL_PRIMITIVES = on
 
-        global LOCAL_PRIMITIVE_OPS
-        LOCAL_PRIMITIVE_OPS += 1
+# How much fuel is left (in a list, so that it can be changed without a global statement)
+fuel = [float("inf")]
 
-        global GLOBAL_PRIMITIVE_OPS
-        GLOBAL_PRIMITIVE_OPS += 1
+def use_fuel(n):
+    """ Use n units of fuel, raising TooBigException if there isn't that much """
+    fuel[0] -= n
+    if fuel[0] < 0:
+        raise TooBigException
 
-        return fn(*args, **kwargs)
+# The names of the primitives decorated without fuel, which budgets can't limit
+unfueled_primitives = []
+
+def check_fueled():
+    """ Warn if some primitives don't use fuel, so that budgets won't limit them (called when one is set) """
+    if unfueled_primitives:
+        warnings.warn("*** A fuel budget was set, but %s primitives (e.g. %s) don't use fuel, so only those marked "
+                      "with fuel_cost count toward it; set LOTLIB_PRIMITIVE_FUEL=1 before importing them" %
+                      (len(unfueled_primitives), unfueled_primitives[0]), stacklevel=3)
+
+def fuel_cost(cost):
+    """
+    A decorator (to go below @primitive) for primitives that use cost(what they return) units of fuel, as well as
+    the one for the call. This marks fn, and @primitive then makes it use fuel, even if FUEL_PRIMITIVES is off.
+    """
+    def mark(fn):
+        fn.fuel_cost = cost
+        return fn
+    return mark
+
+def fueled(fn):
+    """ fn, wrapped to use one unit of fuel for each call, and fn.fuel_cost of what it returns (if it has one) """
+    cost = getattr(fn, 'fuel_cost', None)
+
+    if cost is None:
+        @wraps(fn)
+        def inside(*args, **kwargs):
+            fuel[0] -= 1
+            if fuel[0] < 0:
+                raise TooBigException
+            return fn(*args, **kwargs)
+    else:
+        @wraps(fn)
+        def inside(*args, **kwargs):
+            fuel[0] -= 1
+            if fuel[0] < 0:
+                raise TooBigException
+            out = fn(*args, **kwargs)
+            use_fuel(cost(out))
+            return out
 
     return inside
+
+@contextmanager
+def fuel_budget(n):
+    """
+    Run the with block with at most n units of fuel (or with no new limit, if n is None). Budgets nest: an inner
+    budget can't give more than the outer one has left, and what it uses is used from the outer one too.
+    """
+    saved = fuel[0]
+    start = saved if n is None else min(saved, n)
+    fuel[0] = start
+    try:
+        yield
+    finally:
+        fuel[0] = saved - (start - fuel[0])
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Profiling primitives
+#
+# @primitive can wrap each primitive so that it counts its calls and times them, globally (in global_profile)
+# and for whatever PrimitiveProfiles we are in, as in
+#
+#     with PrimitiveProfile() as p:
+#         h.compute_likelihood(data)
+#     print p.report()
+#
+# This is decided when each primitive is decorated: if PROFILE_PRIMITIVES is False (the default), @primitive
+# doesn't wrap the function for profiling, so there is no cost at all. To profile, set the environment variable
+# LOTLIB_PROFILE_PRIMITIVES=1, or call profile_primitives() before LOTlib.Primitives (or your own primitives)
+# are imported.
+#  ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+PROFILE_PRIMITIVES = os.environ.get('LOTLIB_PROFILE_PRIMITIVES', '') not in ('', '0')
+
+def profile_primitives(on=True):
+    """ Whether primitives decorated from now on are profiled (ones already decorated are not changed) """
+    global PROFILE_PRIMITIVES
+    PROFILE_PRIMITIVES = on
+
+
+class PrimitiveProfile(object):
     """
+        For each primitive name, how many times it was called, its total time (including the primitives it calls,
+        e.g. the function map_ is given) and its own time (not including them). A recursive primitive's total
+        time counts its inner calls again, as in cProfile.
+
+        Use it as a context manager to record the calls made inside the with block.
+    """
+    active = [] # the profiles being recorded into, besides global_profile
+
+    FIELDS = ['calls', 'time', 'own_time']
+
+    def __init__(self):
+        self.stats = dict() # name -> [calls, time, own_time]
+
+    def __enter__(self):
+        PrimitiveProfile.active.append(self)
+        return self
+
+    def __exit__(self, t, value, traceback):
+        PrimitiveProfile.active.remove(self)
+        return False
+
+    def record(self, name, time, own_time):
+        s = self.stats.get(name)
+        if s is None:
+            self.stats[name] = [1, time, own_time]
+        else:
+            s[0] += 1
+            s[1] += time
+            s[2] += own_time
+
+    def clear(self):
+        self.stats.clear()
+
+    def rows(self, sort='own_time'):
+        """ A list of (name, calls, time, own_time), biggest first on sort (one of FIELDS) """
+        i = PrimitiveProfile.FIELDS.index(sort)
+        return sorted([(name,) + tuple(s) for name, s in self.stats.items()], key=lambda r: r[i+1], reverse=True)
+
+    def report(self, sort='own_time', n=None):
+        """ A table of rows(sort), or of the first n """
+        lines = ["%-30s %10s %12s %12s" % ('primitive', 'calls', 'time', 'own_time')]
+        for r in self.rows(sort)[:n]:
+            lines.append("%-30s %10d %12.6f %12.6f" % r)
+        return '\n'.join(lines)
+
+    def write(self, path, sort='own_time'):
+        """ Write rows(sort) to path, tab separated with a header, for sorting and plotting elsewhere """
+        with open(path, 'w') as f:
+            print >>f, '\t'.join(['primitive'] + PrimitiveProfile.FIELDS)
+            for r in self.rows(sort):
+                print >>f, '\t'.join(map(str, r))
+
+# Every call to a profiled primitive
+global_profile = PrimitiveProfile()
+
+# The time spent in the primitives called by each profiled primitive that is running, innermost last
+child_times = []
+
+def profiled(fn, name=None):
+    """ fn, wrapped to record its calls in global_profile and the active PrimitiveProfiles """
+    if name is None:
+        name = fn.__name__
+
+    @wraps(fn)
+    def inside(*args, **kwargs):
+        child_times.append(0.0)
+        start = timer()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            elapsed = timer() - start
+            own = elapsed - child_times.pop()
+            if child_times:
+                child_times[-1] += elapsed
+            global_profile.record(name, elapsed, own)
+            for p in PrimitiveProfile.active:
+                p.record(name, elapsed, own)
+
+    return inside
+
+def primitive(fn):
+    """A decocator for basic primitives, which registers them, makes them use fuel (if FUEL_PRIMITIVES, or they have a fuel_cost) and profiles them (if PROFILE_PRIMITIVES). Used to be known as @LOTlib_primitive"""
+
+    if FUEL_PRIMITIVES or hasattr(fn, 'fuel_cost'):
+        fn = fueled(fn)
+    else:
+        unfueled_primitives.append(fn.__name__)
+
+    if PROFILE_PRIMITIVES:
+        fn = profiled(fn)
 
-    # Just register the primitive
     register_primitive(fn)
 
     return fn
@@ -89,3 +282,73 @@ def register_primitive(function, name=None):
 
     sys.modules['__builtin__'].__dict__[name] = function
 
+    # what programs compile to may have changed
+    for cache in FunctionCache.caches:
+        cache.clear()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+# Caching compiled functions
+#  ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class FunctionCache(object):
+    """
+        A least-recently-used cache from program text (e.g. str(h) for a LOTHypothesis) to what it evals to, so
+        that programs we see again (as MCMC does constantly, and as other chains do) are not compiled again.
+
+        hits and misses count the lookups, so you can see if it's worth it.
+    """
+    caches = WeakSet() # all of them, so that register_primitive can clear them
+
+    def __init__(self, maxsize=100000):
+        FunctionCache.caches.add(self)
+        self.maxsize = maxsize
+        self.functions = OrderedDict() # oldest first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, text, default=None):
+        """ The function for text, or default if we don't have it """
+        f = self.functions.pop(text, default)
+        if f is default:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.functions[text] = f # now the newest
+        return f
+
+    def set(self, text, f):
+        self.functions.pop(text, None)
+        self.functions[text] = f
+        while len(self.functions) > self.maxsize:
+            self.functions.popitem(last=False)
+
+    def clear(self):
+        self.functions.clear()
+
+    def hit_rate(self):
+        return float(self.hits) / max(1, self.hits + self.misses)
+
+    def __len__(self):
+        return len(self.functions)
+
+    def __str__(self):
+        return "<FunctionCache with %s functions, %s hits and %s misses>" % (len(self), self.hits, self.misses)
+
+# The cache shared by all LOTHypotheses (see LOTHypothesis.function_cache)
+function_cache = FunctionCache()
+
+class SubexpressionCache(FunctionCache):
+    """
+        The same, but from (a subexpression's text, the ids of the arguments it was called on) to its value, as
+        kept by LOTlib.Compilers.MemoCompiler. Values can be anything (including None), so use get with a default.
+
+        Cached values are kept alive, and Python's garbage collector goes through them all (and, for sets, all of
+        their elements) on each full collection. So a big cache of big values can cost more than it saves, and
+        the default size is small.
+    """
+    def __init__(self, maxsize=10000):
+        FunctionCache.__init__(self, maxsize=maxsize)
+
+    def __str__(self):
+        return "<SubexpressionCache with %s values, %s hits and %s misses>" % (len(self), self.hits, self.misses)
+
@@ -2,11 +2,12 @@
 
 import re
 from copy import copy, deepcopy
+from bisect import bisect_right
 from math import log
 from random import random
 
 from LOTlib.BVRuleContextManager import BVRuleContextManager
-from LOTlib.Miscellaneous import lambdaTrue, lambdaOne, self_update, nicelog
+from LOTlib.Miscellaneous import lambdaTrue, lambdaOne, nicelog, None2Empty
 
 
 # ------------------------------------------------------------------------------------------------------------
@@ -36,6 +37,32 @@ class NodeSamplingException(Exception):
 # ------------------------------------------------------------------------------------------------------------
 # FunctionNode main class
 
+def annotation(name):
+    """A property for an optional attribute of FunctionNodes, stored in their annotations dict.
+
+    Getting it raises AttributeError if it has not been set, just like an unset attribute.
+
+    """
+    def get(self):
+        if self.annotations is None or name not in self.annotations:
+            raise AttributeError(name)
+        return self.annotations[name]
+
+    def set(self, value):
+        if self.annotations is None:
+            self.annotations = dict()
+        self.annotations[name] = value
+        self.invalidate_weights() # resampleProbability may read these
+
+    def delete(self):
+        if self.annotations is None or name not in self.annotations:
+            raise AttributeError(name)
+        del self.annotations[name]
+        self.invalidate_weights()
+
+    return property(get, set, delete)
+
+
 class FunctionNode(object):
     """FunctionNode main class.
 
@@ -56,14 +83,39 @@ class FunctionNode(object):
     * Each FunctionNode used to store the rule that generated it. This caused problems when loading a FunctionNode from
       a pickle file and trying to compute its probability under a new grammar. Now, matching to rules is done on the fly
       using get_rule_signature()
+    * FunctionNodes have no __dict__, since they are copied on every proposal. Algorithms can still annotate
+      nodes with resample_p and p_propose (e.g. PartitionMCMC sets p_propose). These are unset by default, so
+      read them with getattr(n, 'p_propose', 1.0), and they are kept by copy and setto.
 
     """
-    NoCopy = {'self', 'parent', 'returntype', 'name', 'args', 'parent'}
+    # Subclasses must not add slots (use __slots__ = ()), since setto changes __class__ between them.
+    # lp_cache is (key, log probability of the tree below), set by Grammar.log_probability
+    # hash_cache is the structural hash of the tree below, set by __hash__
+    # size_cache is (number of nodes, depth) of the tree below, set by size_and_depth
+    # weight_cache is (resampleProbability, its sum over the tree below), set by sample_node_normalizer
+    # index_cache is (resampleProbability, nodes below, running totals of their weights), set by subnode_index
+    # annotations is None, or a dict holding resample_p and p_propose if they have been set
+    __slots__ = ('parent', 'returntype', 'name', 'args', 'added_rule', 'bv_prefix', 'lp_cache', 'hash_cache',
+                 'size_cache', 'weight_cache', 'index_cache', 'annotations')
+    Caches = ('lp_cache', 'hash_cache', 'size_cache', 'weight_cache', 'index_cache')
+
+    resample_p = annotation('resample_p')
+    p_propose = annotation('p_propose')
 
     def __init__(self, parent, returntype, name, args):
-        self_update(self,locals())
+        self.parent = parent
+        self.returntype = returntype
+        self.name = name
+        self.args = args
         self.added_rule = None
-        
+        self.bv_prefix = None
+        self.lp_cache = None
+        self.hash_cache = None
+        self.size_cache = None
+        self.weight_cache = None
+        self.index_cache = None
+        self.annotations = None
+
         assert self.name is None or isinstance(self.name, str)
 
     def setto(self, q):
@@ -73,14 +125,53 @@ class FunctionNode(object):
 
         """
         old_parent = self.parent        # preserve my parent
-        self.__dict__ = q.__dict__
         self.__class__ = q.__class__    # to update in case q is a different subtype of FunctionNode.
                                         # NOTE: Setting __class__ is not a recommended thing to do.
+        for k in FunctionNode.__slots__:
+            setattr(self, k, getattr(q, k))
         # and we must fix the kid refs. Everything else should be right.
         for a in self.argFunctionNodes():
             a.parent = self
         self.parent = old_parent
 
+        self.invalidate()
+
+    def invalidate(self):
+        """Clear what is cached (see Grammar.log_probability, __hash__, size_and_depth and
+        sample_node_normalizer) on this node and every node above it.
+
+        setto calls this; if you change a tree in some other way (e.g. assigning to args[i]), you must call it
+        on the changed node.
+
+        """
+        for x in self.up_to(to=None):
+            x.lp_cache = None
+            x.hash_cache = None
+            x.size_cache = None
+            x.weight_cache = None
+            x.index_cache = None
+
+    def invalidate_weights(self):
+        """Clear the cached resample weights on this node and every node above it (when annotations change)"""
+        for x in self.up_to(to=None):
+            x.weight_cache = None
+            x.index_cache = None
+
+    def __getstate__(self):
+        """lp_cache is keyed on grammar versions, which only mean something in this process, so don't pickle it"""
+        return dict([(k, getattr(self, k)) for k in FunctionNode.__slots__ if k not in FunctionNode.Caches])
+
+    def __setstate__(self, state):
+        """ Also loads nodes pickled when FunctionNodes had a __dict__; attributes we no longer have are dropped """
+        self.added_rule = None
+        self.bv_prefix = None
+        self.annotations = None
+        for k in FunctionNode.Caches:
+            setattr(self, k, None)
+        for k, v in state.items():
+            if k in ('resample_p', 'p_propose') or (k in FunctionNode.__slots__ and k not in FunctionNode.Caches):
+                setattr(self, k, v)
+
     def get_rule_signature(self):
         """ The rule signature is used to pair up FunctionNodes with GrammarRules in computing log probability
             So it needs to be synced to GrammarRule.get_rule_signature and provide a unique identifier
@@ -102,21 +193,35 @@ class FunctionNode(object):
         ----
         The rule is NOT deeply copied (regardless of shallow)
 
-        """
-        fn = FunctionNode(self.parent, self.returntype, self.name, None)
+        This is used for BVAddFunctionNodes and BVUseFunctionNodes too, since they have the same slots.
 
-        # And then then copy the rest -- needed for if we add info to FunctionNodes, like a resample_p
-        for k in set(self.__dict__.keys()).difference(FunctionNode.NoCopy): # None of these!
-            fn.__dict__[k] = copy(self.__dict__[k])
+        """
+        fn = object.__new__(self.__class__) # skip __init__ and its asserts; we set everything here
+        fn.parent = self.parent
+        fn.returntype = self.returntype
+        fn.name = self.name
+        fn.added_rule = None if self.added_rule is None else copy(self.added_rule) ## TODO: We should not need to copy added_rule
+        fn.bv_prefix = self.bv_prefix
+        fn.lp_cache = self.lp_cache
+        fn.hash_cache = self.hash_cache
+        fn.size_cache = self.size_cache
+        fn.weight_cache = self.weight_cache
+        fn.index_cache = None # this holds our nodes, not the copies
+        fn.annotations = None if self.annotations is None else dict(self.annotations)
 
-        if (not shallow) and self.args is not None:
-            fn.args = map(copy, self.args)
-        else:
+        if self.args is None:
+            fn.args = None
+        elif shallow:
             fn.args = self.args
-
-        # and update 
-        for a in fn.argFunctionNodes():
-            a.parent = fn 
+            for a in fn.argFunctionNodes():
+                a.parent = fn
+        else:
+            # args are FunctionNodes or strings, which don't need copying
+            fn.args = list(self.args)
+            for i, a in enumerate(fn.args):
+                if isinstance(a, FunctionNode):
+                    fn.args[i] = a.__copy__()
+                    fn.args[i].parent = fn
 
         return fn 
         
@@ -234,33 +339,42 @@ class FunctionNode(object):
 
         This is actually a little subtle due to bound variables.
 
-        In (lambda (x) x) and (lambda (y) y) will be equal (since they map to identical strings via
-        fullstring), even though the nodes below x and y will not themselves be equal. This is because
-        fullstring(x) and fullstring(y) will not know where these came from and will just compare the uuids.
+        In (lambda (x) x) and (lambda (y) y) will be equal (as they map to identical strings via fullstring),
+        even though the nodes below x and y will not themselves be equal, since their bound variables come from
+        different lambdas.
 
-        But fullstring on the lambda keeps track of where bound variables were introduced.
-
-        NOTE: We need to do thsi using fullstring instead of pystring in order to avoid the fact that pystring ignores
-        returntypes and nodes whose name is ''
+        We first compare the (cached) hashes, which are almost always different for different trees, and only
+        then walk the two trees together with structurally_equal. This gives the same answer as comparing
+        fullstrings (not pystrings, which ignore returntypes and nodes whose name is '').
 
         """
-        return fullstring(self) == fullstring(other)
+        if self is other:
+            return True
+        if not isFunctionNode(other) or hash(self) != hash(other):
+            return False
+        return structurally_equal(self, other)
 
-    # TODO: overwrite these with something faster
-    # hash trees. This just converts to string -- maybe too slow?
     def __hash__(self):
-        # # An attempt to speed things up -- not so great!
-        # hsh = self.ruleid
-        # if self.args is not None:
-        #     for a in filter(isFunctionNode, self.args):
-        #         hsh = hsh ^ hash(a)
-        # return hsh
-        #
-        # # use a quicker string hash
-        # return hash(self.quickstring())
+        """A structural hash, computed bottom-up and cached in hash_cache until the tree below changes.
 
-        # normal string hash -- faster?
-        return hash(str(self))
+        The names of bound variables are random, so uses of bound variables hash the same no matter which
+        lambda they come from. That way trees that are equal (up to renaming bound variables) hash the same.
+
+        """
+        if self.hash_cache is None:
+            if isinstance(self, BVUseFunctionNode):
+                mine = (BVUseFunctionNode, self.returntype)
+            elif isinstance(self, BVAddFunctionNode):
+                mine = (BVAddFunctionNode, self.returntype, self.name, self.added_rule.bv_prefix)
+            else:
+                mine = (FunctionNode, self.returntype, self.name)
+
+            if self.args is None:
+                self.hash_cache = hash(mine)
+            else:
+                self.hash_cache = hash((mine, tuple([hash(a) for a in self.args])))
+
+        return self.hash_cache
 
 
     def __cmp__(self, x):
@@ -340,22 +454,25 @@ class FunctionNode(object):
         ----
         * This will NOT work if you modify the tree. Then all goes to hell.
         * If the tree must be modified, use self.subnodes().
+        * This uses a stack rather than recursive generators, which would pass each node up through every
+          generator above it.
 
         """
-        yield self
-
-        for a in self.argFunctionNodes():
-            for ssn in a:
-                yield ssn
+        stack = [self]
+        while stack:
+            x = stack.pop()
+            yield x
+            if x.args is not None:
+                stack.extend([a for a in reversed(x.args) if isinstance(a, FunctionNode)])
 
     def iterdepth(self):
         """Iterates subnodes, yielding node and depth."""
-        yield (self, 0)
-
-        if self.args is not None:
-            for a in self.argFunctionNodes():
-                for ssn, dd in a.iterdepth():
-                    yield (ssn, dd+1)
+        stack = [(self, 0)]
+        while stack:
+            x, d = stack.pop()
+            yield (x, d)
+            if x.args is not None:
+                stack.extend([(a, d+1) for a in reversed(x.args) if isinstance(a, FunctionNode)])
 
     def all_leaves(self):
         """Returns a generator for all leaves of the subtree rooted at the instantiated FunctionNode."""
@@ -401,44 +518,102 @@ class FunctionNode(object):
 
     def count_subnodes(self, predicate=lambdaTrue):
         """Returns the subnode count."""
+        if predicate is lambdaTrue:
+            return self.size_and_depth()[0]
         return len(filter(predicate, self))
 
     def depth(self):
         """Returns the depth of the tree (how many embeddings below)."""
-        depths = [a.depth() for a in self.argFunctionNodes()]
-        depths.append(-1)  # for no function nodes (+1=0)
-        return max(depths)+1
+        return self.size_and_depth()[1]
+
+    def size_and_depth(self):
+        """The number of nodes and depth of the tree below, computed bottom-up and cached in size_cache until the
+        tree below changes (see invalidate)."""
+        if self.size_cache is None:
+            size, depth = 1, 0
+            for a in self.argFunctionNodes():
+                s, d = a.size_and_depth()
+                size += s
+                depth = max(depth, d+1)
+            self.size_cache = (size, depth)
+        return self.size_cache
 
     def sample_node_normalizer(self, resampleProbability=lambdaOne):
         """
         Compute Z to be the sum of all subnodes' value from resampleProbability.
         * resampleProbability -- a function that gives the resample probability (NOT log prob.) of each node.
         NOTE: We allow resampleProbability to return a boolean, for 0/1 probability.
+
+        The sums for each subtree are cached in weight_cache for the last resampleProbability used, until the tree
+        below changes, so this is cheap when called again with the same function (e.g. from sample_subnode and
+        sampling_log_probability). So resampleProbability(x) must only depend on x and the tree below it (or be
+        a new function each time).
         """
-        return sum([ 1.0*resampleProbability(x) for x in self])
+        if resampleProbability is lambdaOne:
+            return float(self.count_subnodes())
+        if self.index_cache is not None and self.index_cache[0] is resampleProbability:
+            return self.index_cache[2][-1]
+        if self.weight_cache is None or self.weight_cache[0] is not resampleProbability:
+            Z = 1.0*resampleProbability(self) + sum([a.sample_node_normalizer(resampleProbability)
+                                                     for a in self.argFunctionNodes()])
+            self.weight_cache = (resampleProbability, Z)
+        return self.weight_cache[1]
 
     def sampling_log_probability(self,node,resampleProbability=lambdaOne):
         return nicelog(1.0*resampleProbability(node)) - nicelog(self.sample_node_normalizer(resampleProbability=resampleProbability))
 
-    def sample_subnode(self, resampleProbability=lambdaOne):
-        """Sample a subnode at random.
+    def subnode_index(self, resampleProbability=lambdaOne):
+        """The subnodes (in the order of __iter__), and the running totals of their resampleProbability.
 
-        We return a sampled tree and the log probability of sampling it
+        These are made in one pass and cached in index_cache for the last resampleProbability used, until the
+        tree below changes (as in sample_node_normalizer), so sampling from a tree again is O(log n).
 
         """
-        Z = self.sample_node_normalizer(resampleProbability=resampleProbability) # the total probability
+        if self.index_cache is None or self.index_cache[0] is not resampleProbability:
+            nodes = list(self)
+            cumulative = []
+            total = 0.0
+            for x in nodes:
+                total += 1.0*resampleProbability(x)
+                cumulative.append(total)
+            self.index_cache = (resampleProbability, nodes, cumulative)
+        return self.index_cache[1], self.index_cache[2]
+
+    def subnode_at(self, i):
+        """The i'th subnode in the order of __iter__, found by skipping over subtrees by their sizes"""
+        assert 0 <= i < self.count_subnodes(), "*** No subnode %s in %s" % (i, self)
+        t = self
+        while i > 0:
+            i -= 1 # for t itself
+            for a in t.argFunctionNodes():
+                n = a.count_subnodes()
+                if i < n:
+                    t = a
+                    break
+                i -= n
+        return t
+
+    def sample_subnode_position(self, resampleProbability=lambdaOne):
+        """Like sample_subnode, but return the position of the sampled node in the order of __iter__ (so the
+        same node can be found in a copy with subnode_at)."""
+        nodes, cumulative = self.subnode_index(resampleProbability)
+        Z = cumulative[-1] # the total probability
         if not (Z > 0.0):
             raise NodeSamplingException
 
-        r = random() * Z # now select a random number (giving a random node)
+        i = bisect_right(cumulative, random() * Z) # the first node whose running total is past a random point
+        while i == len(nodes) or not (resampleProbability(nodes[i]) > 0): # only from rounding
+            i -= 1
+        return i, log(resampleProbability(nodes[i])) - log(Z)
+
+    def sample_subnode(self, resampleProbability=lambdaOne):
+        """Sample a subnode at random.
 
-        for t in self:
-            trp = float(resampleProbability(t))
-            r -= trp
-            if r <= 0:
-                return [t, log(trp) - log(Z)]
+        We return a sampled tree and the log probability of sampling it
 
-        assert False, "Should not get here"
+        """
+        i, lp = self.sample_subnode_position(resampleProbability=resampleProbability)
+        return [self.subnode_index(resampleProbability)[0][i], lp]
 
     # get a description of the input and output types
     # if collapse_terminal then we just map non-FunctionNodes to "TERMINAL"
@@ -587,6 +762,8 @@ class FunctionNode(object):
 
         ret = self.__copy__(shallow=True)  # don't copy kids
         ret.args = newargs
+        for k in FunctionNode.Caches: # these were copied, but the kids have changed
+            setattr(ret, k, None)
 
         return ret
 
@@ -668,6 +845,8 @@ class BVAddFunctionNode(FunctionNode):
 
     This should almost never need to be called, as it is defaultly handled by LOTlib.Grammar
     """
+    __slots__ = ()
+
     def __init__(self, parent, returntype, name, args,  added_rule=None):
         FunctionNode.__init__(self, parent, returntype, name, args)
         self.added_rule = added_rule
@@ -681,31 +860,6 @@ class BVAddFunctionNode(FunctionNode):
                     return True
         return False
 
-    def __copy__(self, shallow=False):
-        """Copy a function node.
-                
-        Note
-        ----
-        The rule is NOT deeply copied (regardless of shallow)
-
-        Arguments
-        ---------
-        shallow: if True, this does not copy the children (self.to points to the same as what we return)
-
-        """
-        fn = BVAddFunctionNode(self.parent, self.returntype, self.name, None,
-            added_rule=copy(self.added_rule)) ## TODO: We should not need to copy added_rule
-
-        if (not shallow) and self.args is not None:
-            fn.args = map(copy, self.args)
-        else:
-            fn.args = self.args
-
-        for a in fn.argFunctionNodes():
-            a.parent = fn
-
-        return fn
-
     def as_list(self, d=0, bv_names=None):
         """Returns a list representation of the FunctionNode with function/self.name as the first element.
 
@@ -744,6 +898,8 @@ class BVUseFunctionNode(FunctionNode):
     """
     A FunctionNode that uses a bound variable. As in, the use of "x" in lambda x: x+1
     """
+    __slots__ = ()
+
     def __init__(self, parent, returntype, name, args, bv_prefix=None):
         FunctionNode.__init__(self, parent, returntype, name, args)
         self.bv_prefix = bv_prefix
@@ -768,28 +924,6 @@ class BVUseFunctionNode(FunctionNode):
  
         return x
 
-    def __copy__(self, shallow=False):
-        """Copy a function node.
-                
-        Note:
-            The rule is NOT deeply copied (regardless of shallow)
-
-        Arguments
-            shallow: if True, this does not copy the children (self.to points to the same as what we return)
-
-        """
-        fn = BVUseFunctionNode(self.parent, self.returntype, self.name, None, bv_prefix=self.bv_prefix)
-        
-        if (not shallow) and self.args is not None:
-            fn.args = map(copy, self.args)
-        else:
-            fn.args = self.args
-
-        for a in fn.argFunctionNodes():
-            a.parent = fn
-
-        return fn
-
 
 
 
@@ -837,6 +971,53 @@ def schemestring(x, d=0, bv_names=None):
                 return "(%s %s)" % (name, map(lambda a: schemestring(a,d+1, bv_names=bv_names), x.args))
 
 
+def structurally_equal(x, y, bv_map=None):
+    """
+    Are x and y the same tree, up to renaming bound variables? This agrees with comparing fullstring(x) and
+    fullstring(y), without building the strings.
+
+    Arguments:
+        bv_map: A dictionary from the names of x's bound variables to the names of y's, for the lambdas we are under
+
+    """
+    if not (isFunctionNode(x) and isFunctionNode(y)):
+        return (not isFunctionNode(x)) and (not isFunctionNode(y)) and x == y
+
+    if bv_map is None:
+        bv_map = dict()
+
+    if x.returntype != y.returntype or x.nargs() != y.nargs():
+        return False
+
+    if isinstance(x, BVAddFunctionNode):
+        if not isinstance(y, BVAddFunctionNode) or x.name != y.name or \
+                x.added_rule.bv_prefix != y.added_rule.bv_prefix:
+            return False
+
+        bv_map[x.added_rule.name] = y.added_rule.name
+        ret = all([structurally_equal(a, b, bv_map) for a, b in zip(None2Empty(x.args), None2Empty(y.args))])
+        del bv_map[x.added_rule.name]
+        return ret
+
+    elif isinstance(y, BVAddFunctionNode):
+        return False
+
+    elif isinstance(x, BVUseFunctionNode) or isinstance(y, BVUseFunctionNode):
+        # Bound variables must come from corresponding lambdas; free ones must be the same
+        if x.name in bv_map:
+            if bv_map[x.name] != y.name:
+                return False
+        elif x.name != y.name or y.name in bv_map.values():
+            return False
+
+    elif x.name != y.name:
+        return False
+
+    if x.args is None:
+        return True
+    return all([structurally_equal(a, b, bv_map) for a, b in zip(x.args, y.args)])
+
+
 def fullstring(x, d=0, bv_names=None):
     """
     A string mapping function that is for equality checking. This is necessary because pystring silently ignores
@@ -5,28 +5,57 @@ except ImportError: import numpypy as np
 
 from copy import copy
 from collections import defaultdict
+from bisect import bisect_right
+from random import random
 import itertools
+import threading
 
 from LOTlib.Miscellaneous import *
 from LOTlib.GrammarRule import GrammarRule, BVAddGrammarRule
-from LOTlib.BVRuleContextManager import BVRuleContextManager
+from LOTlib.BVRuleContextManager import BVRuleContextManager, BVScope
 from LOTlib.FunctionNode import FunctionNode, BVAddFunctionNode
+from LOTlib.CompactTree import CompactTree, encode_varints, decode_varints
+from LOTlib.CompiledGrammar import CompiledGrammar
+from LOTlib.Enumeration import DepthEnumerator, EquivalenceEnumerator, ProbabilityEnumerator, SizeEnumerator
 
 
 # when we pack, we are allowed to use these characters, in this order
 import string
 pack_string = '0123456789'+string.ascii_lowercase+string.ascii_uppercase
 
+# Every change to any grammar gets a new number from here, so versions are never shared between grammars
+grammar_versions = itertools.count()
+
+
+class GenerationBudgetException(Exception):
+    """Raised by Grammar.generate when a tree would have more nodes, or be deeper, than we asked for."""
+    pass
+
 
 class Grammar(CommonEqualityMixin):
     """
     A PCFG-ish class that can handle rules that introduce bound variables
     """
+    # Attributes that are only caches or version numbers, and so are ignored by __eq__
+    NoCompare = {'grammar_version', 'sampling_tables', 'compiled_grammar', 'generation_retries', 'bv_env'}
+
     def __init__(self, BV_P=10.0, start='START'):
         self_update(self,locals())
         self.rules = defaultdict(list)  # A dict from nonterminals to lists of GrammarRules.
+        self.rule_index = dict()        # A dict from rule signatures to lists of GrammarRules (see get_matching_rule)
         self.rule_count = 0
         self.bv_count = 0   # How many rules in the grammar introduce bound variables?
+        self.bv_env = threading.local() # Each thread's BVScope of bound variable rules (see add_bv_rule)
+        self.sampling_tables = dict() # A dict from nonterminals to cumulative probabilities (see sample_rule)
+        self.generation_retries = 0   # How many times has generate had to start again to stay within budget?
+        self.new_version()
+
+    def __eq__(self, other):
+        """Grammars are equal if everything but their caches and versions is (see CommonEqualityMixin)."""
+        if not isinstance(other, self.__class__):
+            return False
+        keys = set(self.__dict__.keys()).union(other.__dict__.keys()).difference(Grammar.NoCompare)
+        return all([self.__dict__.get(k) == other.__dict__.get(k) for k in keys])
 
     def __str__(self):
         """Display a grammar."""
@@ -39,9 +68,11 @@ class Grammar(CommonEqualityMixin):
 
     def get_rules(self, nt):
         """
-        The possible rules for any nonterminal
+        The possible rules for any nonterminal, including the bound variable rules in scope
         """
-        return self.rules[nt]
+        if self.bv_frame is None:
+            return self.rules[nt]
+        return self.rules[nt] + self.bv_rules(nt)
 
     def get_all_rules(self):
         """
@@ -52,9 +83,9 @@ class Grammar(CommonEqualityMixin):
                 yield r
 
     def is_nonterminal(self, x):
-        """A nonterminal is just something that is a key for self.rules"""
+        """A nonterminal is just something that is a key for self.rules, or has bound variable rules in scope"""
         # if x is a string  &&  if x is a key
-        return isinstance(x, str) and (x in self.rules)
+        return isinstance(x, str) and (x in self.rules or any([r.nt == x for r in self.bv_scope]))
 
     def display_rules(self):
         """Prints all the rules to the console."""
@@ -81,31 +112,175 @@ class Grammar(CommonEqualityMixin):
 
     def get_matching_rule(self, t):
         """
-        Get the rule matching t's signature. Note: We could probably speed this up with a hash table if need be.
+        Get the rule matching t's signature.
+
+        This is a lookup in self.rule_index, which add_rule keeps in sync with self.rules, and in the bound
+        variable rules in scope. If the signature is missing (e.g. someone appended to self.rules directly), we
+        fall back to scanning the rules for t.returntype.
         """
-        rules = self.get_rules(t.returntype)
-        matching_rules = [r for r in rules if (r.get_rule_signature() == t.get_rule_signature())]
+        sig = t.get_rule_signature()
+
+        matching_rules = self.rule_index.get(sig)
+        if self.bv_frame is not None:
+            bv_matches = [r for r in self.bv_frame if r.name == t.name and r.get_rule_signature() == sig]
+            if bv_matches:
+                matching_rules = (matching_rules or []) + bv_matches
+        if not matching_rules:
+            matching_rules = [r for r in self.get_rules(t.returntype) if r.get_rule_signature() == sig]
+
         assert len(matching_rules) == 1, \
-            "Grammar Error: " + str(len(matching_rules)) + " matching rules for this FunctionNode! %s %s %s" % (t.get_rule_signature(), str(t), matching_rules)
+            "Grammar Error: " + str(len(matching_rules)) + " matching rules for this FunctionNode! %s %s %s" % (sig, str(t), matching_rules)
         return matching_rules[0]
 
+    def index_rule(self, r):
+        """ Add r to the signature index used by get_matching_rule """
+        self.rule_index.setdefault(r.get_rule_signature(), []).append(r)
+
+    def unindex_rule(self, r):
+        """ Remove r from the signature index used by get_matching_rule """
+        sig = r.get_rule_signature()
+        matching_rules = self.rule_index[sig]
+        matching_rules.remove(r)
+        if len(matching_rules) == 0:
+            del self.rule_index[sig]
+
+    def rebuild_rule_index(self):
+        """ Recompute self.rule_index from self.rules, e.g. after the rules were modified by hand """
+        self.rule_index = dict()
+        for r in self:
+            self.index_rule(r)
+
+    def __getstate__(self):
+        """ Caches are not pickled; they are rebuilt as needed """
+        state = dict(self.__dict__)
+        state.pop('sampling_tables', None)
+        state.pop('compiled_grammar', None)
+        del state['bv_env'] # bound variable scopes only exist while we are inside trees
+        return state
+
+    def __setstate__(self, state):
+        """ Grammars pickled before we kept a rule_index need to have it rebuilt when they are loaded """
+        self.__dict__.update(state)
+        if 'rule_index' not in state:
+            self.rebuild_rule_index()
+        self.__dict__.pop('bv_scope', None) # grammars used to keep bound variable rules in a list
+        self.bv_env = threading.local()
+        if 'sampling_tables' not in state:
+            self.sampling_tables = dict()
+        if 'generation_retries' not in state:
+            self.generation_retries = 0
+        self.new_version() # version numbers are only meaningful within one process
+
+    # --------------------------------------------------------------------------------------------------------
+    # Versions and bound variable scope
+    # --------------------------------------------------------------------------------------------------------
+
+    def new_version(self):
+        """
+        Mark the grammar as changed, so that anything cached from it is recomputed. add_rule and renormalize
+        call this, and changing a rule's p is tracked by GrammarRule.p_changes. Call it if you change
+        self.rules some other way.
+        """
+        self.grammar_version = next(grammar_versions)
+
+    @property
+    def version(self):
+        """ A value that changes whenever the grammar's rules or their probabilities do """
+        return (self.grammar_version, GrammarRule.p_changes)
+
+    def compile(self):
+        """
+        A frozen view of the grammar with integer ids for its rules and nonterminals, normalizing constants and
+        other tables (see LOTlib.CompiledGrammar). It is made again only when the grammar's version changes.
+        """
+        compiled = getattr(self, 'compiled_grammar', None)
+        if compiled is None or compiled.version != self.version:
+            compiled = CompiledGrammar(self)
+            self.compiled_grammar = compiled
+        return compiled
+
+    def log_Z(self, nt):
+        """ The log of the sum of the p of nt's rules, including the bound variable rules in scope """
+        compiled = self.compile()
+        bv_p = [r.p for r in self.bv_frame or [] if r.nt == nt]
+        if len(bv_p) == 0:
+            return compiled.log_Z[nt]
+        return log(compiled.Z.get(nt, 0.0) + sum(bv_p))
+
+    @property
+    def bv_frame(self):
+        """ The BVScope of bound variable rules in scope in this thread, or None if there are none """
+        return getattr(self.bv_env, 'frame', None)
+
+    def set_bv_frame(self, frame):
+        """ Go back to a scope returned by bv_frame """
+        self.bv_env.frame = frame
+
+    @property
+    def bv_scope(self):
+        """ The bound variable rules in scope, as a list, outermost first """
+        rules = list(self.bv_frame or [])
+        rules.reverse()
+        return rules
+
+    def bv_rules(self, nt):
+        """ The bound variable rules for nt in scope, outermost first """
+        return [r for r in self.bv_scope if r.nt == nt]
+
+    def add_bv_rule(self, r):
+        """
+        Add a bound variable rule (used by BVRuleContextManager). The rule is not added to self.rules, but to
+        a new BVScope frame, so this doesn't change anything shared with other threads.
+        """
+        self.set_bv_frame(BVScope(r, self.bv_frame))
+
+    def remove_bv_rule(self, r):
+        """ Remove a bound variable rule added by add_bv_rule """
+        frame = self.bv_frame
+        if frame is not None and frame.rule is r:
+            self.set_bv_frame(frame.parent)
+        else:
+            assert frame is not None and any([x is r for x in frame]), "*** %s is not in scope" % r
+            self.set_bv_frame(frame.without(r))
+
+    def bv_scope_key(self):
+        """
+        The names of the bound variable rules currently in the grammar. Together with version, this determines
+        the probability of any tree, so it is what FunctionNode.lp_cache is keyed on.
+        """
+        return frozenset([r.name for r in self.bv_frame or []])
+
     def single_probability(self, t):
         # in this tree, in its context (recursing up), what is the probability of this single expansion?
 
         with BVRuleContextManager(self, t, recurse_up=True):
-            z = log(sum([ r.p for r in self.get_rules(t.returntype) ]))
+            z = self.log_Z(t.returntype)
             r = self.get_matching_rule(t)
             return log(r.p)-z
 
     def log_probability(self, t):
         """
-        Returns the log probability of t, recomputing everything (as we do now)
+        Returns the log probability of t.
 
-        This is overall about half as fast, but it means we don't have to store generation_probability
+        Each node stores the log probability of the tree below it in lp_cache, along with the grammar version
+        and the bound variables in scope that it was computed with. Those stay correct unless the tree below
+        changes, and FunctionNode.setto clears them on the path to the root, so after a proposal we only
+        recompute the changed subtree and its parents.
         """
         assert isinstance(t, FunctionNode)
 
-        z = log(sum([ r.p for r in self.get_rules(t.returntype) ]))
+        return self.log_probability_in_scope(t, self.bv_scope_key())
+
+    def log_probability_in_scope(self, t, scope):
+        """
+        Compute log_probability, where scope is the bv_scope_key() at t. This lets us extend scope as we go
+        down through lambdas instead of recomputing it at every node.
+        """
+        key = (self.version, scope)
+        if t.lp_cache is not None and t.lp_cache[0] == key:
+            return t.lp_cache[1]
+
+        z = self.log_Z(t.returntype)
 
         # Find the one that matches. While it may seem like we should store this, that is hard to make work
         # with multiple grammar objects across loading/saving, because the objects will change. This way,
@@ -116,10 +291,14 @@ class Grammar(CommonEqualityMixin):
 
         lp = log(r.p) - z
 
+        if t.added_rule is not None:
+            scope = scope.union([t.added_rule.name])
+
         with BVRuleContextManager(self, t):
             for a in t.argFunctionNodes():
-                lp += self.log_probability(a)
+                lp += self.log_probability_in_scope(a, scope)
 
+        t.lp_cache = (key, lp)
         return lp
 
     def add_rule(self, nt, name, to, p, bv_type=None, bv_args=None, bv_prefix='y', bv_p=None):
@@ -142,6 +321,8 @@ class Grammar(CommonEqualityMixin):
             newrule = GrammarRule(nt, name, to, p=p)
 
         self.rules[nt].append(newrule)
+        self.index_rule(newrule)
+        self.new_version()
         return newrule
     
     def is_terminal_rule(self, r):
@@ -155,11 +336,55 @@ class Grammar(CommonEqualityMixin):
     # Generation
     # --------------------------------------------------------------------------------------------------------
 
-    def generate(self, x=None):
+    def sampling_table(self, nt):
+        """
+        The rules for nt that are not bound variable rules, with their cumulative probabilities as a list and as
+        a numpy array (see sample_rule and generate_many)
+        """
+        table = self.sampling_tables.get(nt)
+        if table is None or table[0] != self.version:
+            rules = list(self.rules[nt])
+            cumulative = np.cumsum([r.p for r in rules])
+            table = (self.version, rules, cumulative.tolist(), cumulative)
+            self.sampling_tables[nt] = table
+        return table[1:]
+
+    def sample_rule(self, nt):
+        """Sample one of nt's rules, including the bound variable rules in scope, in proportion to their p.
+
+        The rules in the grammar proper are sampled by bisecting an array of their cumulative probabilities,
+        which is kept in self.sampling_tables until the grammar's version changes. Bound variable rules come and
+        go during generation, so they are not in the table; there are only ever a few, so we scan them.
+
+        """
+        rules, cumulative, _ = self.sampling_table(nt)
+
+        Z = cumulative[-1] if len(cumulative) > 0 else 0.0
+        bv_rules = [r for r in self.bv_frame or [] if r.nt == nt]
+        u = random() * (Z + sum([r.p for r in bv_rules]))
+
+        if u < Z:
+            return rules[bisect_right(cumulative, u)]
+        u -= Z
+        for r in bv_rules:
+            u -= r.p
+            if u < 0.0:
+                return r
+        return bv_rules[-1] # in case of floating point error
+
+    def generate(self, x=None, max_nodes=Infinity, max_depth=Infinity, max_tries=1):
         """Generate from the grammar
 
         Arguments:
             x (string): What we start from -- can be None and then we use Grammar.start.
+            max_nodes (int): Give up (raising GenerationBudgetException) as soon as the tree has more nodes than this
+            max_depth (int): Give up as soon as the tree is deeper than this (the root is at depth 0)
+            max_tries (int): How many times to try to make a tree within budget before giving up. Each retry is
+                counted in self.generation_retries.
+
+        Note:
+            With a budget, we sample from the grammar's distribution restricted to trees within it. Proposals
+            should not use one, since their proposal probabilities are computed without it.
 
         """
         # print "# Calling Grammar.generate", type(x), x
@@ -171,40 +396,24 @@ class Grammar(CommonEqualityMixin):
                 "The default start symbol %s is not a defined nonterminal" % self.start
 
         # Dispatch different kinds of generation
-        if isinstance(x,list):            
-            return map(lambda xi: self.generate(x=xi), x)             # If we get a list, just map along it to generate.
+        if isinstance(x,list):
+            return map(lambda xi: self.generate(x=xi, max_nodes=max_nodes, max_depth=max_depth, max_tries=max_tries), x) # If we get a list, just map along it to generate.
         elif self.is_nonterminal(x):
 
-            # sample a grammar rule
-            rules = self.get_rules(x)
-            assert len(rules) > 0, "*** No rules in x=%s"%x
-
-            # sample the rule
-            r = weighted_sample(rules, probs=lambda x: x.p, log=False)
+            tries = 0
+            while True:
+                try:
+                    return self.generate_tree(x, max_nodes, max_depth)
+                except GenerationBudgetException:
+                    tries += 1
+                    if tries >= max_tries:
+                        raise
+                    self.generation_retries += 1
 
-            # Make a stub for this functionNode 
-            fn = r.make_FunctionNodeStub(self, None)
-
-            # Define a new context that is the grammar with the rule added
-            # Then, when we exit, it's still right.
-            with BVRuleContextManager(self, fn, recurse_up=False):      # not sure why we can't use with/as:
-                # Can't recurse on None or else we genreate from self.start
-                if fn.args is not None:
-                    # and generate below *in* this context (e.g. with the new rules added)
-                    try:
-                        fn.args = self.generate(fn.args)
-                    except RuntimeError as e:
-                        print "*** Runtime error in %s" % fn
-                        raise e
-
-                # and set the parents
-                for a in fn.argFunctionNodes():
-                    a.parent = fn
-
-            return fn
         elif isinstance(x, FunctionNode): # this will let us finish generation of a partial tree
 
-            x.args = [ self.generate(a) for a in x.args]
+            x.args = [ self.generate(a, max_nodes=max_nodes, max_depth=max_depth, max_tries=max_tries) for a in x.args]
+            x.invalidate()
 
             for a in x.argFunctionNodes():
                 a.parent = x
@@ -215,6 +424,181 @@ class Grammar(CommonEqualityMixin):
             assert isinstance(x, str), ("*** Terminal must be a string! x="+x)
             return x
 
+    def generate_tree(self, nt, max_nodes=Infinity, max_depth=Infinity):
+        """Generate a tree from the nonterminal nt, using a stack instead of recursion.
+
+        We raise GenerationBudgetException as soon as the tree has more than max_nodes nodes or a node deeper than
+        max_depth, rather than finishing a tree we will throw away.
+
+        """
+        root = None
+        nodes = 0
+
+        # Each item is a (parent, i, nonterminal, depth) to expand and store in parent.args[i], or the BVScope
+        # to go back to because we have finished the lambda whose rule we added.
+        stack = [(None, None, nt, 0)]
+        saved = self.bv_frame
+
+        try:
+            while stack:
+                item = stack.pop()
+
+                if not isinstance(item, tuple):
+                    self.set_bv_frame(item)
+                    continue
+
+                parent, i, x, depth = item
+
+                nodes += 1
+                if nodes > max_nodes or depth > max_depth:
+                    raise GenerationBudgetException
+
+                assert len(self.get_rules(x)) > 0, "*** No rules in x=%s"%x
+                fn = self.sample_rule(x).make_FunctionNodeStub(self, parent)
+
+                if parent is None:
+                    root = fn
+                else:
+                    parent.args[i] = fn
+
+                if fn.args is not None:
+                    # Generate below *in* the context with the new rule added, just like BVRuleContextManager
+                    if fn.added_rule is not None:
+                        stack.append(self.bv_frame)
+                        self.add_bv_rule(fn.added_rule)
+
+                    # push in reverse so that we expand left to right
+                    for j in reversed(xrange(len(fn.args))):
+                        if self.is_nonterminal(fn.args[j]):
+                            stack.append((fn, j, fn.args[j], depth+1))
+        finally:
+            # if we gave up, take out the rules of any lambdas we were in the middle of
+            self.set_bv_frame(saved)
+
+        return root
+
+    def generate_many(self, n, x=None, unique=False, compact=False, batch_size=1000, max_nodes=Infinity,
+                      max_depth=Infinity):
+        """Yield n trees from the grammar, generating batch_size of them at a time.
+
+        The trees in a batch are grown together a level at a time, and for each nonterminal, the rules for every
+        node on that level are drawn at once with numpy. Trees that go over max_nodes or max_depth are dropped
+        (and made up for in later batches), so this samples from the grammar restricted to trees within budget,
+        as generate does.
+
+        Arguments:
+            n (int): How many trees to yield
+            x (string): The nonterminal to start from -- None means Grammar.start
+            unique (bool): Only yield each tree once. We stop early if a whole batch has no new trees, since the
+                grammar may not have n trees.
+            compact (bool): Yield CompactTrees instead of FunctionNodes
+
+        """
+        if x is None:
+            x = self.start
+        assert self.is_nonterminal(x), "*** generate_many must start from a nonterminal, not %s" % x
+
+        seen = set()
+        yielded = 0
+        while yielded < n:
+            new = 0
+            for t in self.generate_batch(x, min(batch_size, n - yielded) if not unique else batch_size,
+                                         max_nodes, max_depth):
+                if compact:
+                    t = CompactTree.from_FunctionNode(self, t)
+
+                if unique:
+                    if t in seen:
+                        continue
+                    seen.add(t)
+
+                new += 1
+                yielded += 1
+                yield t
+
+                if yielded >= n:
+                    return
+
+            if unique and new == 0:
+                return
+
+    def generate_batch(self, x, n, max_nodes=Infinity, max_depth=Infinity):
+        """Generate n trees from the nonterminal x, a level at a time, returning those within budget (see
+        generate_many).
+        """
+        roots = [None] * n
+        sizes = [0] * n
+        ok = [True] * n
+
+        # Bound variable types are nonterminals, even if the grammar has no other rules for them
+        nonterminals = set(self.nonterminals()).union([r.bv_type for r in self if isinstance(r, BVAddGrammarRule)])
+        kids = dict() # id of each rule we use -> (the rule, so the id stays its own, [(i, nonterminal)] to expand)
+
+        # Each node to expand is (tree, parent, i, nonterminal, the bound variable rules in scope)
+        level = [(k, None, None, x, tuple(self.bv_scope)) for k in xrange(n)]
+        depth = 0
+        while level:
+            if depth > max_depth:
+                for item in level:
+                    ok[item[0]] = False
+                break
+
+            # Draw the rules for each nonterminal on this level together
+            chosen = [None] * len(level)
+            bynt = defaultdict(list)
+            for j, item in enumerate(level):
+                bynt[item[3]].append(j)
+
+            for nt, js in bynt.items():
+                rules, _, cumulative = self.sampling_table(nt)
+                Z = cumulative[-1] if len(cumulative) > 0 else 0.0
+
+                bvZ = np.array([sum([r.p for r in level[j][4] if r.nt == nt]) if level[j][4] else 0.0 for j in js])
+                u = np.random.random(len(js)) * (Z + bvZ)
+                ks = np.searchsorted(cumulative, u, side='right')
+
+                for j, k, uj in zip(js, ks.tolist(), u.tolist()):
+                    if k < len(rules):
+                        chosen[j] = rules[k]
+                    else: # one of the bound variable rules
+                        bv_rules = [r for r in level[j][4] if r.nt == nt]
+                        uj -= Z
+                        for r in bv_rules:
+                            uj -= r.p
+                            if uj < 0.0:
+                                break
+                        chosen[j] = r
+
+            # Now make the nodes, and find what to expand on the next level
+            nextlevel = []
+            for (tree, parent, i, nt, scope), r in zip(level, chosen):
+                if not ok[tree]:
+                    continue
+
+                sizes[tree] += 1
+                if sizes[tree] > max_nodes:
+                    ok[tree] = False
+                    continue
+
+                fn = r.make_FunctionNodeStub(self, parent)
+                if parent is None:
+                    roots[tree] = fn
+                else:
+                    parent.args[i] = fn
+
+                if fn.added_rule is not None:
+                    scope = scope + (fn.added_rule,)
+
+                if id(r) not in kids:
+                    kids[id(r)] = (r, [(j, a) for j, a in enumerate(None2Empty(r.to)) if a in nonterminals])
+                for j, a in kids[id(r)][1]:
+                    nextlevel.append((tree, fn, j, a, scope))
+
+            level = nextlevel
+            depth += 1
+
+        return [t for t, good in zip(roots, ok) if good]
+
     def enumerate(self, d=20, nt=None, leaves=True):
         """Enumerate all trees up to depth n.
 
@@ -225,11 +609,48 @@ class Grammar(CommonEqualityMixin):
               PartitionMCMC
 
         """
+        # One DepthEnumerator for all depths, so the shallower trees are only enumerated once
+        enumerator = DepthEnumerator(self, leaves=leaves)
         for i in infrange(d):
-            for t in self.enumerate_at_depth(i, nt=nt, leaves=leaves):
+            for t in self.enumerate_at_depth(i, nt=nt, leaves=leaves, enumerator=enumerator):
                 yield t
 
-    def enumerate_at_depth(self, d, nt=None, leaves=True):
+    def enumerate_by_size(self, max_nodes=20, nt=None, min_nodes=1):
+        """Enumerate all trees with min_nodes to max_nodes nodes, smallest first.
+
+        Parameters:
+            max_nodes (int): the most nodes a tree may have, as in LOTHypothesis.maxnodes
+            nt (str): the nonterminal type
+            min_nodes (int): the fewest nodes a tree may have. Splitting the sizes into ranges splits the work
+              (see LOTlib.Enumeration.SizeEnumerator).
+
+        """
+        if nt is None:
+            nt = self.start
+
+        for t in SizeEnumerator(self).enumerate(max_nodes, nt=nt, min_nodes=min_nodes):
+            yield t
+
+    def enumerate_pruned(self, inputs, d=20, nt=None, display="lambda x: %s"):
+        """Enumerate trees up to depth d, skipping those that compute the same thing on inputs as one we have
+        already yielded.
+
+        Parameters:
+            inputs (list): the args to probe each subtree with, as in FunctionData.input -- usually those of
+              the data
+            d (int): how deep to go
+            nt (str): the nonterminal type
+            display (str): how to make a tree into a function, as in LOTHypothesis
+
+        See LOTlib.Enumeration.EquivalenceEnumerator for which trees are kept.
+
+        """
+        enumerator = EquivalenceEnumerator(self, inputs, display=display)
+        for i in infrange(d):
+            for t in self.enumerate_at_depth(i, nt=nt, enumerator=enumerator):
+                yield t
+
+    def enumerate_at_depth(self, d, nt=None, leaves=True, enumerator=None):
         """Generate trees at depth d, no deeper or shallower.
 
         Parameters
@@ -237,6 +658,8 @@ class Grammar(CommonEqualityMixin):
             nt (str): the type of the nonterminal you want to return (None reverts to self.start)
             leaves (bool): do we put terminals in the leaves or leave nonterminal types? This is useful in
               PartitionMCMC. This returns trees of depth d-1!
+            enumerator (DepthEnumerator): keeps the subtrees of each depth, so that they are not re-enumerated
+              for each parent (see LOTlib.Enumeration.DepthEnumerator). Pass one in to share it between calls.
 
         Return:
             yields the ...
@@ -250,60 +673,32 @@ class Grammar(CommonEqualityMixin):
             yield nt
             raise StopIteration
 
-        if d == 0:
-            if leaves:
-                # Note: can NOT use filter here, or else it doesn't include added rules
-                for r in self.rules[nt]:
-                    if self.is_terminal_rule(r):
-                        yield r.make_FunctionNodeStub(self, None)
-            else:
-                # If not leaves, we just put the nonterminal type in the leaves
-                yield nt
-        else:
-            # Note: can NOT use filter here, or else it doesn't include added rules. No sorting either!
-            for r in self.rules[nt]:
-
-                # No good since it won't be deep enough
-                if self.is_terminal_rule(r):
-                    continue
-
+        if enumerator is None:
+            enumerator = DepthEnumerator(self, leaves=leaves)
+        assert enumerator.leaves == leaves
 
-                fn = r.make_FunctionNodeStub(self, None)
+        for t in enumerator.enumerate_at_depth(d, nt=nt):
+            yield t
 
-                # The possible depths for the i'th child
-                # Here we just ensure that nonterminals vary up to d, and otherwise
-                child_i_depths = lambda i: xrange(d) if self.is_nonterminal(fn.args[i]) else [0]
+    def enumerate_by_probability(self, nt=None, mass=1.0, max_queue=10**6, compact=False):
+        """Enumerate trees, most probable first, until we have yielded a total prior probability of mass.
 
-                # The depths of each kid
-                for cd in lazyproduct(map(child_i_depths, xrange(len(fn.args))), child_i_depths):
+        Parameters:
+            nt (str): the nonterminal type (None reverts to self.start)
+            mass (float): stop once the trees yielded have this much prior probability in total. With the default,
+              this runs forever on infinite grammars.
+            max_queue (int): how many partial trees to keep (see LOTlib.Enumeration.ProbabilityEnumerator, which
+              can be used directly to pause and resume enumeration)
+            compact (bool): yield CompactTrees instead of FunctionNodes
 
-                    # One must be equal to d-1
-                    # TODO: can be made more efficient via permutations. Also can skip terminals in args.
-                    if max(cd) < d-1:
-                        continue
-                    assert max(cd) == d-1
-
-                    myiter = lazyproduct(
-                        [self.enumerate_at_depth(di, nt=a, leaves=leaves) for di, a in zip(cd, fn.args)],
-                        lambda i: self.enumerate_at_depth(cd[i], nt=fn.args[i], leaves=leaves))
-                    try:
-                        while True:
-                            # Make a copy so we don't modify anything
-                            yieldfn = copy(fn)
-
-                            # BVRuleContextManager here makes us remove the rule BEFORE yielding,
-                            # or else this will be incorrect. Wasteful but necessary.
-                            with BVRuleContextManager(self, fn, recurse_up=False):
-                                yieldfn.args = myiter.next()
-                                for a in yieldfn.argFunctionNodes():
-                                    # Update parents
-                                    a.parent = yieldfn
-
-                            yield copy(yieldfn)
-
-                    except StopIteration:
-                        # Catch this here so we continue in this loop over rules
-                        pass
+        """
+        enumerator = ProbabilityEnumerator(self, nt=nt, max_queue=max_queue)
+        while enumerator.mass < mass:
+            try:
+                ct = enumerator.next_compact()
+            except StopIteration:
+                break
+            yield ct if compact else ct.to_FunctionNode(self)
 
     def depth_to_terminal(self, x, openset=None, current_d=None):
         """
@@ -345,11 +740,14 @@ class Grammar(CommonEqualityMixin):
     def renormalize(self):
         """ go through each rule in each nonterminal, and renormalize the probabilities """
 
+        Z = self.compile().Z # before we change any p
         for nt in self.nonterminals():
-            z = sum([r.p for r in self.get_rules(nt)])
+            z = Z.get(nt, 0.0) + sum([r.p for r in self.bv_rules(nt)])
             for r in self.get_rules(nt):
                 r.p = r.p / z
 
+        self.new_version()
+
 
     # --------------------------------------------------------------------------------------------------------
     # Packing and unpacking trees
@@ -362,7 +760,7 @@ class Grammar(CommonEqualityMixin):
         Compute a dictionary from signatures to rule indices
         this is so that when we add rules for bound variables, we don't
         change all the rule indices.
-        NOTE: This step is slow and should be cached for a grammar
+        NOTE: This is recomputed on every call; compile().sig2idx is cached
         """
         d = dict()
         idx = 0 # store the rule index, making each unique. NOTE: we could make it unique for each nt, but that may mess with LZPrior
@@ -388,92 +786,44 @@ class Grammar(CommonEqualityMixin):
 
         return d
 
-    def pack_ascii(self, t, sig2idx=None):
+    def pack(self, t):
         """
-        Pack a tree into a simple ascii string, using grammar.
-        Not particularly optimized, but simple
+        Pack a tree into a binary string: one varint for each node (see LOTlib.CompactTree). This works for
+        grammars of any size, and trees packed one after another can be unpacked with unpack_many.
         """
+        return encode_varints(CompactTree.from_FunctionNode(self, t).to_codes(self))
+
+    def unpack(self, s):
+        """ Unpack a tree that was packed with pack """
+        codes = decode_varints(s)
+        ct, end = CompactTree.from_codes(self, codes)
+        assert end == len(codes), "*** %s is not exactly one packed tree" % repr(s)
+        return ct.to_FunctionNode(self)
+
+    def unpack_many(self, s):
+        """ Yield each of the trees packed one after another in s """
+        codes = decode_varints(s)
+        pos = 0
+        while pos < len(codes):
+            ct, pos = CompactTree.from_codes(self, codes, pos)
+            yield ct.to_FunctionNode(self)
 
-        if sig2idx is None:
-            sig2idx = self.sig2idx()
-
-
-        # the output string (starts empty)
-        s = ''
-
-        # compute the node's index (i.e. packed name)
-        # pack_string is a string, not a function
-        s = s + pack_string[sig2idx[t.get_rule_signature()]]
-
-        # add rule if we're adding a bound variable (i.e. a lambda)
-        if isinstance(t, BVAddFunctionNode):
-            r = t.added_rule
-            idx =  max(sig2idx.values())+1
-            sig2idx[r.get_rule_signature()] = idx
-
-        # recurse
-        for a in t.argFunctionNodes():
-            s = s+self.pack_ascii(a, sig2idx=sig2idx)
-
-        # remove bound variable rule after recursing
-        if isinstance(t, BVAddFunctionNode):
-            r = t.added_rule
-            del sig2idx[r.get_rule_signature()]
-            
-        return s
-
-    def unpack_ascii(self, s):
-        # we must convert to list(s) so that it will support pop, delete
-        s = list(s)
-
-        return self.unpack_ascii_rec(s, self.start, self.idx2rule())
-
-    def unpack_ascii_rec(self, s, x, idx2rule):
-        """
-        Unpack a string into a tree. Follows the format of Grammar.generate, but indexes
-        the choices with s
+    def pack_ascii(self, t, sig2idx=None):
         """
-        assert x is not None  # should have been given by unpack_ascii
-
-        # Dispatch different kinds of generation
-        if isinstance(x, list):
-            return map(lambda xi: self.unpack_ascii_rec(s, xi, idx2rule), x)
-
-        elif self.is_nonterminal(x):
-            
-            rules = self.get_rules(x)
-
-            # index
-            # instead of sampling a rule, get it from the string
-            i = pack_string.index(s[0])
-            del s[0]  # remove (works since s is a list)
-            r = idx2rule[i]
-
-            # Make a stub for this functionNode
-            fn = r.make_FunctionNodeStub(self, None)
-            with BVRuleContextManager(self, fn, recurse_up=False):
+        Pack a tree into a simple ascii string, one character per node, using grammar. This only works for
+        grammars with fewer than len(pack_string) rules and bound variables in scope; use pack for others.
 
-                # add rule (to idx2rule)
-                if isinstance(r, BVAddGrammarRule):
-                    idx = max(idx2rule.keys()) + 1
-                    idx2rule[idx] = fn.added_rule
-
-                # recurse
-                if fn.args is not None:
-                    fn.args = self.unpack_ascii_rec(s, fn.args, idx2rule)
-
-                # remove rule (as we now do in packing, too)
-                if isinstance(r, BVAddGrammarRule):
-                    idx = max(idx2rule.keys())
-                    del idx2rule[idx]
-            
-                for a in fn.argFunctionNodes():
-                    a.parent = fn
-
-            return fn
+        sig2idx is no longer used: the rule indices are those of compile(), which is cached.
+        """
+        codes = CompactTree.from_FunctionNode(self, t).to_codes(self)
+        assert max(codes) < len(pack_string), "*** Too many rules to pack_ascii; use pack instead"
+        return ''.join([pack_string[c] for c in codes])
 
-        else: # must be a terminal
-            return x
+    def unpack_ascii(self, s):
+        """ Unpack a tree that was packed with pack_ascii """
+        ct, end = CompactTree.from_codes(self, map(pack_string.index, s))
+        assert end == len(s), "*** %s is not exactly one packed tree" % s
+        return ct.to_FunctionNode(self)
 
     #def pack_test(self,n=1000):
     #    """a quick test for packing and unpacking"""
@@ -22,6 +22,8 @@ def create_counts(grammar, hypotheses, which_rules=None, log=None):
             prior_offset[trees] - how much the prior should be offset for each hypothesis (incorporating the rules not in which_rules)
 
         which_rules -- optionally specify a subset of rules to include. If None, all are used.
+
+        hypotheses may also be a LOTlib.HypothesisStore, which is read one tree at a time.
     """
 
     grammar_rules = [r for r in grammar] # all of the rules
@@ -40,7 +42,7 @@ def create_counts(grammar, hypotheses, which_rules=None, log=None):
     # convert rules to signatures for checking below
     which_signatures = { r.get_rule_signature() for r in which_rules }
 
-    prior_offset = [0.0 for _ in hypotheses] # the log probability of all rules NOT in grammar_rules
+    prior_offset = [0.0] * len(hypotheses) # the log probability of all rules NOT in grammar_rules
 
     # First set up the mapping between signatures and indexes
     sig2idx = dict() # map each signature to a unique index in its nonterminal
@@ -1,6 +1,6 @@
 from FunctionNode import FunctionNode, BVAddFunctionNode, BVUseFunctionNode
 from copy import copy
-from LOTlib.Miscellaneous import None2Empty,self_update
+from LOTlib.Miscellaneous import None2Empty
 from uuid import uuid4
 
 class GrammarRule(object):
@@ -36,11 +36,23 @@ class GrammarRule(object):
     The rule id (rid) is very important -- it's what we use expansion determine equality
 
     """
+    # How many times has any rule's probability been changed? This is part of Grammar.version, so that
+    # anything computed from rule probabilities (e.g. FunctionNode.lp_cache) can tell when it is stale.
+    p_changes = 0
+
+    # Each lambda in a tree has its own rule (see BVAddGrammarRule.make_bv_rule), so keep these small.
+    # Subclasses list only the slots they add.
+    __slots__ = ('nt', 'name', 'to', '_p', 'bv_prefix')
+
     def __init__(self, nt, name, to, p=1.0, bv_prefix=None):
         p = float(p)
         assert p>0.0, "*** p=0 in rule %s %s %s. What are you thinking?" %(nt,name,to)
 
-        self_update(self, locals())
+        self.nt = nt
+        self.name = name
+        self.to = to
+        self._p = p # not self.p, since creating a rule doesn't change any existing probabilities
+        self.bv_prefix = bv_prefix
 
         assert to is None or isinstance(to, list) or isinstance(to, tuple), "*** 'to' in a GrammarRule must be a list!"
 
@@ -50,6 +62,35 @@ class GrammarRule(object):
             assert (to is None) or (len(to) == 1), \
                 "*** GrammarRules with empty names must have only 1 argument"
 
+    @property
+    def p(self):
+        return self._p
+
+    @p.setter
+    def p(self, value):
+        self._p = value
+        GrammarRule.p_changes += 1
+
+    def all_slots(self):
+        """ The slots of this rule, including those of the classes it inherits from """
+        return [k for c in type(self).__mro__ for k in getattr(c, '__slots__', ())]
+
+    def __copy__(self):
+        r = object.__new__(self.__class__)
+        for k in self.all_slots():
+            setattr(r, k, getattr(self, k))
+        return r
+
+    def __getstate__(self):
+        return dict([(k, getattr(self, k)) for k in self.all_slots()])
+
+    def __setstate__(self, state):
+        """ Rules pickled before p was a property store it as 'p' """
+        if 'p' in state:
+            state['_p'] = state.pop('p')
+        for k, v in state.items():
+            setattr(self, k, v)
+
     def __repr__(self):
         """Print string in format: 'NT -> [TO]   w/ p=1.0'."""
         return str(self.nt) + " -> " + self.name + (str(self.to) if self.to is not None else '') + \
@@ -73,10 +114,13 @@ class GrammarRule(object):
             sig.extend(self.to)
         return tuple(sig)
 
+    def copy_to(self):
+        """ A new list of what we expand to (or None), for the args of a FunctionNode we make """
+        return None if self.to is None else list(self.to)
+
     def make_FunctionNodeStub(self, grammar, parent):
         # NOTE: It is VERY important to copy to, or else we end up with big problems!
-        fn = FunctionNode(parent, returntype=self.nt, name=self.name, args=copy(self.to))
-        assert fn.get_rule_signature() == self.get_rule_signature() # potentially not needed
+        fn = FunctionNode(parent, returntype=self.nt, name=self.name, args=self.copy_to())
         return fn
 
 
@@ -106,9 +150,13 @@ class BVAddGrammarRule(GrammarRule):
     If we use this, we should have BV (i.e. argument `bv_type` should be specified).
 
     """
+    __slots__ = ('bv_type', 'bv_args', 'bv_p')
+
     def __init__(self, nt, name, to, p=1.0, bv_prefix="y", bv_type=None, bv_args=None, bv_p=None):
-        p = float(p)
-        self_update(self, locals())
+        GrammarRule.__init__(self, nt, name, to, p, bv_prefix)
+        self.bv_type = bv_type
+        self.bv_args = bv_args
+        self.bv_p = bv_p
         assert bv_type is not None, "Did you mean to use a GrammarRule instead of a BVGrammarRule?"
         assert isinstance(bv_type, str), "bv_type must be a string! Make sure it's not a tuple or list."
         
@@ -147,8 +195,7 @@ class BVAddGrammarRule(GrammarRule):
         * It is VERY important to copy to, or else we end up with garbage
 
         """
-        fn = BVAddFunctionNode(parent, returntype=self.nt, name=self.name, args=copy(self.to), added_rule=self.make_bv_rule(grammar))
-        assert fn.get_rule_signature() == self.get_rule_signature() # potentially not needed
+        fn = BVAddFunctionNode(parent, returntype=self.nt, name=self.name, args=self.copy_to(), added_rule=self.make_bv_rule(grammar))
         return fn
 
 
@@ -160,10 +207,11 @@ class BVUseGrammarRule(GrammarRule):
     Each of these has a unique name via uuid.
 
     """
+    __slots__ = ()
+
     def __init__(self, nt, to, p=1.0, bv_prefix=None):
         GrammarRule.__init__(self, nt, 'bv__'+uuid4().hex, to, p, bv_prefix)
 
     def make_FunctionNodeStub(self, grammar, parent):
-        fn = BVUseFunctionNode(parent, returntype=self.nt, name=self.name, args=copy(self.to))
-        assert fn.get_rule_signature() == self.get_rule_signature() # potentially not needed
+        fn = BVUseFunctionNode(parent, returntype=self.nt, name=self.name, args=self.copy_to())
         return fn
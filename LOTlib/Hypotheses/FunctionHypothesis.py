@@ -1,6 +1,6 @@
 """
         A special type of hypothesis whose value is a function.
-        The function is automatically eval-ed when we set_value, and is automatically hidden and unhidden when we pickle
+        The function is automatically eval-ed the first time it is needed after set_value, and is automatically hidden and unhidden when we pickle
         This can also be called like a function, as in fh(data)!
 """
 
@@ -10,9 +10,16 @@ from copy import copy
 class FunctionHypothesis(Hypothesis):
     """
             A special type of hypothesis whose value is a function.
-            The function is automatically eval-ed when we set_value, and is automatically hidden and unhidden when we pickle
+            The function is automatically eval-ed the first time it is needed after set_value, and is automatically hidden and unhidden when we pickle
             This can also be called like a function, as in fh(data)!
+
+            fvalue is compiled (by compile_function) when it is first used, not in set_value, so hypotheses whose
+            functions are never called (e.g. proposals rejected because of their prior) are never compiled.
+            FunctionHypothesis.values_set and FunctionHypothesis.functions_compiled count how often this happens
+            over all hypotheses (see uncompiled_fraction). Unpickling doesn't count as setting a value.
     """
+    values_set = 0
+    functions_compiled = 0
 
     def __init__(self, value=None, f=None, display="lambda x: %s", **kwargs):
         """
@@ -40,7 +47,8 @@ class FunctionHypothesis(Hypothesis):
 
     def compile_function(self):
         """
-        Takes my value and returns what function I compute. Internally cached by set_value
+        Takes my value and returns what function I compute. Called by the fvalue property when the function is
+        first needed, and cached until the value is set again
 
         NOTE: This must be overwritten by subclasses to something useful--see LOTHypothesis
         """
@@ -55,12 +63,31 @@ class FunctionHypothesis(Hypothesis):
 
         Hypothesis.set_value(self, value)
 
-        if f is not None:
-            self.fvalue = f
-        elif value is None:
-            self.fvalue = None
-        else:
-            self.fvalue =  self.compile_function() # now that the value is set
+        self.fvalue_cache = f # if None, the fvalue property will compile it
+        self.fvalue_counted = f is None and value is not None # whether compiling it counts in functions_compiled
+        if self.fvalue_counted:
+            FunctionHypothesis.values_set += 1
+
+    @property
+    def fvalue(self):
+        """ The function, compiled now if it hasn't been since set_value """
+        if self.fvalue_cache is None and self.value is not None:
+            self.fvalue_cache = self.compile_function()
+            if self.fvalue_counted:
+                FunctionHypothesis.functions_compiled += 1
+                self.fvalue_counted = False
+        return self.fvalue_cache
+
+    @fvalue.setter
+    def fvalue(self, f):
+        self.fvalue_cache = f
+
+    @staticmethod
+    def uncompiled_fraction():
+        """ What fraction of the values set (without a function) never needed their function compiled """
+        if FunctionHypothesis.values_set == 0:
+            return float("nan")
+        return 1.0 - float(FunctionHypothesis.functions_compiled) / FunctionHypothesis.values_set
 
     def force_function(self, f):
         """
@@ -83,7 +110,7 @@ class FunctionHypothesis(Hypothesis):
     def __getstate__(self):
         """ We copy the current dict so that when we pickle, we destroy the function"""
         dd = copy(self.__dict__)
-        dd['fvalue'] = None # clear the function out
+        dd['fvalue_cache'] = None # clear the function out
         return dd
 
     def __setstate__(self, state):
@@ -91,4 +118,6 @@ class FunctionHypothesis(Hypothesis):
                 sets the state of the hypothesis (when we unpickle)
         """
         self.__dict__.update(state)
-        self.set_value(self.value) # just re-set the value so that we re-compute the function
+        self.__dict__.pop('fvalue', None) # from when fvalue was compiled in set_value
+        self.fvalue_cache = None # re-computed when it's needed, but not counted, since this isn't a new value
+        self.fvalue_counted = False
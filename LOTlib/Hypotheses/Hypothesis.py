@@ -1,3 +1,4 @@
+from LOTlib.Eval import TooBigException, check_fueled, fuel_budget
 from LOTlib.Miscellaneous import Infinity, attrmem
 from copy import copy, deepcopy
 import numpy
@@ -18,7 +19,14 @@ class Hypothesis(object):
         prior_temperature: Temperature used when running compute_prior.
         likelihood_temperature: Temperature used when running compute_likelihood.
 
+    Attributes:
+        fuel: How many primitive calls compute_single_likelihood may make for each datum (None for no limit). A
+          datum that takes more has likelihood -Infinity. See bounded_single_likelihood and LOTlib.Eval. Setting
+          it warns if some primitives don't use fuel.
+
     """
+    _fuel = None
+
     def __init__(self, value=None, prior_temperature=1.0, likelihood_temperature=1.0, display="%s", **kwargs):
         """
         :param value:  - the value of teh hypothesis
@@ -29,6 +37,8 @@ class Hypothesis(object):
         :return:
         """
         self.display = display
+        if 'fuel' in kwargs:
+            self.fuel = kwargs.pop('fuel')
         self.__dict__.update(kwargs)
 
         self.set_value(value)
@@ -99,7 +109,7 @@ class Hypothesis(object):
 
         ll = 0.0
         for datum in data:
-            ll += self.compute_single_likelihood(datum, **kwargs) / self.likelihood_temperature
+            ll += self.bounded_single_likelihood(datum, **kwargs) / self.likelihood_temperature
             if ll < shortcut:
                 # print "** Shortcut", self
                 return -Infinity
@@ -114,10 +124,34 @@ class Hypothesis(object):
         """
 
         # all but the last data point unless include_last
-        lls = [0.0] + [self.compute_single_likelihood(datum, **kwargs) for datum in data[:(None if include_last else -1)]]
+        lls = [0.0] + [self.bounded_single_likelihood(datum, **kwargs) for datum in data[:(None if include_last else -1)]]
 
         return numpy.cumsum(lls)
 
+    @property
+    def fuel(self):
+        return self._fuel
+
+    @fuel.setter
+    def fuel(self, n):
+        if n is not None:
+            check_fueled() # once here, not for each datum
+        self._fuel = n
+
+    def bounded_single_likelihood(self, datum, **kwargs):
+        """compute_single_likelihood, with self.fuel primitive calls at most.
+
+        Anything that raises TooBigException (running out of fuel, or being too big to compile) has likelihood
+        -Infinity, whatever the likelihood class, so no datum can take much more than self.fuel steps.
+        """
+        try:
+            if self._fuel is None:
+                return self.compute_single_likelihood(datum, **kwargs)
+            with fuel_budget(self._fuel):
+                return self.compute_single_likelihood(datum, **kwargs)
+        except TooBigException:
+            return -Infinity
+
     # ========================================================================================================
     #  Methods for accessing likelihoods etc. on a big arrays of data
 
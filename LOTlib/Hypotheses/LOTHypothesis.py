@@ -1,4 +1,5 @@
 from LOTlib.Eval import * # Necessary for compile_function eval below
+from LOTlib.Grammar import GenerationBudgetException
 from LOTlib.Hypotheses.FunctionHypothesis import FunctionHypothesis
 from LOTlib.Hypotheses.Proposers import regeneration_proposal, ProposalFailedException
 from LOTlib.Miscellaneous import self_update
@@ -15,7 +16,8 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
     value : FunctionNode
         The value for the hypothesis.
     maxnodes : int
-        The maximum amount of nodes that the grammar can have
+        The maximum amount of nodes that the grammar can have. Trees bigger than this get a prior of -Infinity,
+        so when we generate our initial value, we try to stay within it.
     args : list
         The arguments to the function.
 
@@ -26,6 +28,18 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
     prior_vector : np.ndarray
 
     """
+    # How many times we'll try to generate an initial value within maxnodes, before settling for a bigger one
+    GENERATE_TRIES = 1000
+
+    # Where compile_function keeps the functions it has made, by program text; shared by every hypothesis that
+    # uses it. Set this to None in a subclass whose functions can't be shared (e.g. if they refer to the
+    # hypothesis), or to a FunctionCache of its own.
+    function_cache = function_cache
+
+    # If not None, what compile_function uses instead of eval(str(self)): something called with our value and
+    # display that returns the function (e.g. LOTlib.Compilers.ASTCompiler()). Its functions aren't put in
+    # function_cache, which is keyed only on text, since they may differ from what the text evals to.
+    compiler = None
 
     def __init__(self, grammar=None, value=None, f=None, maxnodes=25, **kwargs):
 
@@ -35,7 +49,10 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
         # Save all of our keywords
         self_update(self, locals())
         if value is None and grammar is not None:
-            value = grammar.generate()
+            try:
+                value = grammar.generate(max_nodes=maxnodes, max_tries=LOTHypothesis.GENERATE_TRIES)
+            except GenerationBudgetException:
+                value = grammar.generate()
 
         FunctionHypothesis.__init__(self, value=value, f=f, **kwargs)
 
@@ -57,16 +74,30 @@ class LOTHypothesis(PCFGPrior, FunctionHypothesis):
         return self.value.type()
 
     def compile_function(self):
-        """Called in set_value to compile into a function."""
+        """Compile into a function; called by fvalue when the function is first needed after set_value."""
         if self.value.count_nodes() > self.maxnodes:
             return lambda *args: raise_exception(TooBigException)
         else:
-            try:
-                return eval(str(self)) # evaluate_expression(str(self))
-            except Exception as e:
-                print "# Warning: failed to execute evaluate_expression on " + str(self)
-                print "# ", e
-                return lambda *args: raise_exception(EvaluationException)
+            if self.compiler is not None:
+                try:
+                    return self.compiler(self.value, self.display)
+                except Exception as e:
+                    print "# Warning: failed to compile " + str(self)
+                    print "# ", e
+                    return lambda *args: raise_exception(EvaluationException)
+
+            text = str(self)
+            f = self.function_cache.get(text) if self.function_cache is not None else None
+            if f is None:
+                try:
+                    f = eval(text)
+                except Exception as e:
+                    print "# Warning: failed to execute evaluate_expression on " + text
+                    print "# ", e
+                    return lambda *args: raise_exception(EvaluationException)
+                if self.function_cache is not None:
+                    self.function_cache.set(text, f)
+            return f
 
     def compute_single_likelihood(self, datum):
         raise NotImplementedError
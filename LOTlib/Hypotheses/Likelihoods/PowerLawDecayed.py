@@ -62,6 +62,6 @@ class PowerLawDecayed(object):
 
         ## NOTE: Shortcut is not yet implemented here
 
-        self.stored_likelihood = [self.compute_single_likelihood(datum, **kwargs) for datum in data]
+        self.stored_likelihood = [self.bounded_single_likelihood(datum, **kwargs) for datum in data]
 
         return self.get_cumulative_likelihoods()[-1]/self.likelihood_temperature
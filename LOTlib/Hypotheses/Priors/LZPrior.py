@@ -1,5 +1,5 @@
 from LOTlib.Miscellaneous import attrmem,Infinity
-from LOTlib.Grammar import pack_string
+from LOTlib.CompactTree import CompactTree
 from LZutil.IntegerCodes import to_fibonacci as integer2bits # Use Mackay's Fibonacci code
 from LZutil.LZ2 import encode
 
@@ -15,9 +15,10 @@ class LZPrior(object):
 
             return -Infinity
 
-        s = self.grammar.pack_ascii(self.value)
+        # the codes pack_ascii would use, without its limit on the number of rules
+        codes = CompactTree.from_FunctionNode(self.grammar, self.value).to_codes(self.grammar)
         # 1+ since it must be positive
-        bits = ''.join([ integer2bits(1+pack_string.index(x)) for x in s ])
+        bits = ''.join([ integer2bits(1+c) for c in codes ])
         c = encode(bits, pretty=0)
 
         return -len(c)
@@ -22,7 +22,7 @@ class InsertProposer(Proposer):
             raise ProposalFailedException
 
         # is there a rule that expands from ni.returntype to some ni.returntype?
-        replicating_rules = filter(can_insert_GrammarRule, grammar.rules[ni.returntype])
+        replicating_rules = filter(can_insert_GrammarRule, grammar.get_rules(ni.returntype))
         if len(replicating_rules) == 0:
             raise ProposalFailedException
 
@@ -57,7 +57,7 @@ class InsertProposer(Proposer):
 
             lp_choosing_node_1 =  t1.sampling_log_probability(node_1,resampleProbability=lambda t: can_insert_FunctionNode(t, grammar)*resampleProbability(t))
 
-            lp_choosing_rule = -nicelog(len(filter(can_insert_GrammarRule, grammar.rules[node_1.returntype])))
+            lp_choosing_rule = -nicelog(len(filter(can_insert_GrammarRule, grammar.get_rules(node_1.returntype))))
             lp_choosing_replacement = -nicelog(len(filter( lambda i: node_2.args[i].returntype == node_1.returntype, xrange(len(node_2.args)))))
 
             lp_generation = []
@@ -8,7 +8,7 @@
 from LOTlib.BVRuleContextManager import BVRuleContextManager
 from LOTlib.FunctionNode import NodeSamplingException
 from LOTlib.Hypotheses.Proposers.Proposer import *
-from LOTlib.Miscellaneous import lambdaOne, logsumexp
+from LOTlib.Miscellaneous import lambdaOne, logsumexp, nicelog
 from LOTlib.Subtrees import least_common_difference
 from copy import copy
 from math import log
@@ -17,12 +17,13 @@ class RegenerationProposer(Proposer):
 
     def propose_tree(self, grammar, t, resampleProbability=lambdaOne):
         """Propose, returning the new tree"""
-        new_t = copy(t)
-    
-        try: # to sample a subnode
-            n, lp = new_t.sample_subnode(resampleProbability=resampleProbability)
+        try: # to sample a subnode -- in t, whose index is kept for the next proposal from it
+            i, lp = t.sample_subnode_position(resampleProbability=resampleProbability)
         except NodeSamplingException: # when no nodes can be sampled
             raise ProposalFailedException
+
+        new_t = copy(t)
+        n = new_t.subnode_at(i)
     
         # In the context of the parent, resample n according to the
         # grammar. recurse_up in order to add all the parent's rules
@@ -39,8 +40,9 @@ class RegenerationProposer(Proposer):
 
         lps = []
         if chosen_node1 is None: # any node in the tree could have been regenerated
-            for node in t1:
-                lp_of_choosing_node = t1.sampling_log_probability(node,resampleProbability=resampleProbability)
+            nodes, cumulative = t1.subnode_index(resampleProbability)
+            for node in nodes:
+                lp_of_choosing_node = nicelog(1.0*resampleProbability(node)) - nicelog(cumulative[-1])
                 with BVRuleContextManager(grammar, node.parent, recurse_up=True):
                     lp_of_generating_tree = grammar.log_probability(node)
                 lps += [lp_of_choosing_node + lp_of_generating_tree]
@@ -88,7 +88,7 @@ class InverseInlineProposer(object):
 
         assert (not isinstance(l.added_rule, BVUseFunctionNode)) or l.added_rule.bv_args is None # NOTE: l.added_rule.name checks if the bound variable is actually used, but only works for bv_args=None
 
-        return (l.rule.bv_args is None or len(l.rule.bv_args) == 0) and l.args[0].contains_function(l.added_rule.name) and (l.args[0].returntype == n.returntype) and self.is_valid_argument(l.args[0], a) and self.can_abstract_at(l.args[0])
+        return (l.added_rule.to is None or len(l.added_rule.to) == 0) and l.args[0].contains_function(l.added_rule.name) and (l.args[0].returntype == n.returntype) and self.is_valid_argument(l.args[0], a) and self.can_abstract_at(l.args[0])
 
 
     def propose_tree(self, t):
@@ -173,11 +173,9 @@ class InverseInlineProposer(object):
             assert self.can_abstract_at(n) # this had better be true
 
             # figure out which rule we are supposed to use
-            possible_rules = [r for r in self.grammar.rules[n.returntype] if r.name==n.name and tuple(r.to) == tuple(n.argTypes()) ]
+            possible_rules = [r for r in self.grammar.get_rules(n.returntype) if r.name==n.name and tuple(r.to) == tuple(n.argTypes()) ]
             assert len(possible_rules) == 1 # for now?
 
-            n.rule = possible_rules[0]
-
             ir = self.insertable_rules[n.returntype] # for the backward probability
             f = np # just the probability of choosing this apply
 
@@ -17,7 +17,7 @@ def can_insert_FunctionNode(x, grammar):
     """
     We can insert ot a function node if the grammar contains a rule from its NT to itself
     """
-    return any([can_insert_GrammarRule(r) for r in grammar.rules[x.returntype]])
+    return any([can_insert_GrammarRule(r) for r in grammar.get_rules(x.returntype)])
 
 def list_replicating_children(node):
     return [arg for arg in node.args if (isinstance(arg,FunctionNode)
@@ -32,11 +32,13 @@ def nodes_are_roughly_equal(n1,n2):
             n1.args == n2.args)
 
 def give_grammar(grammar,node):
+    # The bound variable rules in scope at node; with the grammar's own rules,
+    # these are the rules that could be used there.
     # BVRuleContextManager gives the grammar used inside a node, not
     # at the node itself, so we consider the node's parent
     with BVRuleContextManager(grammar, node.parent, recurse_up=True):
-        g = deepcopy(grammar)
-    return g
+        scope = grammar.bv_scope
+    return scope
 
 def nodes_equal_except_parents(grammar,n1,n2):
     return ((n1.name == n2.name) and
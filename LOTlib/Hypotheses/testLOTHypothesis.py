@@ -0,0 +1,41 @@
+import unittest
+
+class LazyCompileTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing lazy compilation"
+        from copy import deepcopy
+        from LOTlib.DefaultGrammars import booleanTestGrammar as grammar, booleanTestInputs
+        from LOTlib.Hypotheses.FunctionHypothesis import FunctionHypothesis
+        from LOTlib.Hypotheses.LOTHypothesis import LOTHypothesis
+
+        class CountingHypothesis(LOTHypothesis):
+            function_cache = None
+            def compute_single_likelihood(self, datum):
+                return 0.0 if self(*datum) else -1.0
+
+        t = grammar.generate()
+        while t.count_nodes() <= 3:
+            t = grammar.generate()
+        h = CountingHypothesis(grammar, value=t, display="lambda x: %s", maxnodes=3)
+
+        # too big, so the prior rules it out and we never compile
+        compiled = FunctionHypothesis.functions_compiled
+        h.compute_posterior([([True, False],)])
+        self.assertEqual(FunctionHypothesis.functions_compiled, compiled)
+
+        # but we do when it is called, and only once
+        h.maxnodes = 100
+        h.compute_posterior([([True, False],)])
+        h([True, True])
+        self.assertEqual(FunctionHypothesis.functions_compiled, compiled+1)
+
+        # pickling drops the function, and it's compiled again when needed
+        values_set = FunctionHypothesis.values_set
+        h2 = deepcopy(h) # pickles, with __getstate__ and __setstate__
+        self.assertIsNone(h2.fvalue_cache)
+        for x in booleanTestInputs:
+            self.assertEqual(h2(x), h(x))
+        # but that isn't a new value, so neither it nor compiling it again is counted
+        self.assertEqual(FunctionHypothesis.values_set, values_set)
+        self.assertEqual(FunctionHypothesis.functions_compiled, compiled+1)
+        self.assertTrue(0.0 <= FunctionHypothesis.uncompiled_fraction() <= 1.0)
@@ -0,0 +1,182 @@
+"""
+        An on-disk store of hypotheses' trees and scores, for hypothesis spaces too big to keep as pickled lists.
+
+        A store is a directory of flat files:
+
+            trees.bin             each tree packed with Grammar.pack, one after another
+            offsets.bin           int64: where each tree starts in trees.bin (with one more for the end)
+            prior.bin, likelihood.bin, posterior_score.bin
+                                  float64: a column for each score (nan if it wasn't given)
+
+        All are opened with numpy.memmap, so the columns can be used as arrays, and trees can be read by index or
+        scanned in order without loading or unpickling everything. Stores can only be appended to. Writes are
+        buffered; they are flushed when we read, or on flush() or close().
+
+        offsets.bin is written last when we flush, so it says what is in the store: if a flush is interrupted,
+        what the other files have past it is cut off when the store is next opened.
+
+            with HypothesisStore('hypotheses', grammar) as store:
+                for h in hypotheses:
+                    store.add(h)
+
+            store = HypothesisStore('hypotheses', grammar)
+            best = store[numpy.argmax(store.posterior_score)]
+
+        Only trees are stored, not hypotheses (so not Lexicons), and they must be read with the same grammar (or
+        one with the same rules added in the same order). A store can be given to
+        GrammarInference.Precompute.create_counts like a list of trees.
+"""
+import os
+
+import numpy
+
+from LOTlib.FunctionNode import isFunctionNode
+
+
+class HypothesisStore(object):
+    """
+    The trees and scores stored in the directory path (see the top of this file), which is made if need be.
+
+    Arguments
+    ---------
+    path : str
+        The directory
+    grammar : LOTlib.Grammar
+        The grammar to pack and unpack trees with
+    buffer_size : int
+        How many hypotheses to hold before writing them out
+
+    """
+    COLUMNS = ['prior', 'likelihood', 'posterior_score']
+
+    def __init__(self, path, grammar, buffer_size=10000):
+        self.path = path
+        self.grammar = grammar
+        self.buffer_size = buffer_size
+
+        if not os.path.exists(self.filename('offsets')):
+            if not os.path.isdir(path):
+                os.makedirs(path)
+            for name in ['trees'] + HypothesisStore.COLUMNS:
+                open(self.filename(name), 'wb').close()
+            numpy.zeros(1, dtype=numpy.int64).tofile(self.filename('offsets'))
+        else:
+            self.check()
+
+        self.buffer = [] # (packed tree, prior, likelihood, posterior_score) not yet written
+        self.maps = None # name -> memmap, opened when we first read after a write
+
+    def filename(self, name):
+        return os.path.join(self.path, name + '.bin')
+
+    def check(self):
+        """ Make the other files agree with offsets.bin, cutting off what an interrupted flush left """
+        offsets = numpy.fromfile(self.filename('offsets'), dtype=numpy.int64)
+        n = len(offsets) - 1
+        sizes = [('offsets', 8*(n+1)), ('trees', int(offsets[-1]))] + \
+                [(c, 8*n) for c in HypothesisStore.COLUMNS] # all are 8 byte numbers, except trees
+        for name, size in sizes:
+            actual = os.path.getsize(self.filename(name))
+            if actual < size:
+                raise IOError("*** %s is too short for the %s hypotheses in %s" % (self.filename(name), n, self.path))
+            elif actual > size:
+                with open(self.filename(name), 'r+b') as f:
+                    f.truncate(size)
+
+    # --------------------------------------------------------------------------------------------------------
+    # Writing
+    # --------------------------------------------------------------------------------------------------------
+
+    def add(self, h, prior=None, likelihood=None, posterior_score=None):
+        """
+        Append h, which is either a hypothesis with a FunctionNode value (whose scores are stored, unless they
+        are given) or a FunctionNode.
+        """
+        if isFunctionNode(h):
+            t = h
+        else:
+            t = h.value
+            prior = h.prior if prior is None else prior
+            likelihood = h.likelihood if likelihood is None else likelihood
+            posterior_score = h.posterior_score if posterior_score is None else posterior_score
+
+        self.buffer.append((self.grammar.pack(t), prior, likelihood, posterior_score))
+        if len(self.buffer) >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        """ Write out everything that has been added """
+        if len(self.buffer) == 0:
+            return
+
+        packed = [b[0] for b in self.buffer]
+        ends = os.path.getsize(self.filename('trees')) + numpy.cumsum(map(len, packed), dtype=numpy.int64)
+
+        with open(self.filename('trees'), 'ab') as f:
+            f.write(''.join(packed))
+        for i, name in enumerate(HypothesisStore.COLUMNS):
+            with open(self.filename(name), 'ab') as f:
+                numpy.array([numpy.nan if b[i+1] is None else b[i+1] for b in self.buffer],
+                            dtype=numpy.float64).tofile(f)
+        with open(self.filename('offsets'), 'ab') as f: # last, since it says what is stored
+            ends.tofile(f)
+
+        self.buffer = []
+        self.maps = None
+
+    def close(self):
+        self.flush()
+        self.maps = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    # --------------------------------------------------------------------------------------------------------
+    # Reading
+    # --------------------------------------------------------------------------------------------------------
+
+    def mapped(self, name):
+        """ The memmap for the file name, after flushing any writes """
+        self.flush()
+        if self.maps is None:
+            self.maps = dict()
+            for n, dtype in [('trees', numpy.uint8), ('offsets', numpy.int64)] + \
+                            [(c, numpy.float64) for c in HypothesisStore.COLUMNS]:
+                if os.path.getsize(self.filename(n)) == 0: # memmap can't map empty files
+                    self.maps[n] = numpy.zeros(0, dtype=dtype)
+                else:
+                    self.maps[n] = numpy.memmap(self.filename(n), dtype=dtype, mode='r')
+        return self.maps[name]
+
+    def column(self, name):
+        """ The array of a score for all hypotheses """
+        assert name in HypothesisStore.COLUMNS, "*** No column %s" % name
+        return self.mapped(name)
+
+    prior = property(lambda self: self.column('prior'))
+    likelihood = property(lambda self: self.column('likelihood'))
+    posterior_score = property(lambda self: self.column('posterior_score'))
+
+    def __len__(self):
+        return len(self.mapped('offsets')) - 1
+
+    def __getitem__(self, i):
+        """ The i'th tree """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("*** No hypothesis %s in a store of %s" % (i, len(self)))
+
+        offsets = self.mapped('offsets')
+        return self.grammar.unpack(self.mapped('trees')[offsets[i]:offsets[i+1]].tostring())
+
+    def __iter__(self, chunk=10000):
+        """ Yield the trees in order, reading chunk of them at a time """
+        offsets, trees = self.mapped('offsets'), self.mapped('trees')
+        for start in xrange(0, len(offsets)-1, chunk):
+            end = min(start + chunk, len(offsets)-1)
+            for t in self.grammar.unpack_many(trees[offsets[start]:offsets[end]].tostring()):
+                yield t
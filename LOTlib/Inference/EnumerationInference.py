@@ -1,16 +1,31 @@
 """
     A simple class to do inference via enumeration
+
+    With prune=True, trees that compute the same thing on the data's inputs as a tree we have already seen are
+    skipped (see LOTlib.Enumeration.EquivalenceEnumerator). display must then say how make_h makes trees into
+    functions.
+
+    With max_nodes, we enumerate the trees with at most that many nodes, smallest first, instead of by depth.
 """
 
 from LOTlib.Miscellaneous import Infinity, self_update
 
 class EnumerationInference(object):
     
-    def __init__(self, grammar, make_h, data, steps=Infinity):
+    def __init__(self, grammar, make_h, data, steps=Infinity, prune=False, display="lambda x: %s",
+                 max_nodes=None):
+        assert not (prune and max_nodes is not None), "*** Pruning is only done by depth"
         self_update(self, locals())
         
     def __iter__(self):
-        for i, t in enumerate(self.grammar.enumerate()):
+        if self.prune:
+            trees = self.grammar.enumerate_pruned([di.input for di in self.data], display=self.display)
+        elif self.max_nodes is not None:
+            trees = self.grammar.enumerate_by_size(self.max_nodes)
+        else:
+            trees = self.grammar.enumerate()
+
+        for i, t in enumerate(trees):
 
             if i >= self.steps:
                 raise StopIteration
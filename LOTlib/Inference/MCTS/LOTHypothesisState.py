@@ -143,6 +143,7 @@ class LOTHypothesisState(MaxScoreState):
 
             for r in rules:
                 fn.args[argi] = r.make_FunctionNodeStub(self.grammar, fn)
+                fn.invalidate()
 
                 # copy the type in self.value
                 newh = self.value.__copy__(value=None)
@@ -2,6 +2,7 @@
 
 from LOTlib.Miscellaneous import q, qq, Infinity, self_update
 from LOTlib.Inference.Samplers.Sampler import Sampler, MH_acceptance
+from LOTlib.Hypotheses.FunctionHypothesis import FunctionHypothesis
 
 from math import log, exp
 from random import random
@@ -16,6 +17,7 @@ class MHSampler(Sampler):
         sampler = MHSampler(h0, data, 10000)
         for h in sampler:
             print sampler.acceptance_ratio(), h
+        print sampler.summary()
 
     Or implicitly::
         from LOTlib.Examples.Number.Shared import generate_data, NumberExpression, grammar
@@ -53,7 +55,7 @@ class MHSampler(Sampler):
     acceptance_temperature : float
         This weights the probability of accepting proposals.
     trace : bool
-        If true, print stuff as we sample.
+        If true, print stuff as we sample, and the summary() when we are done.
     shortcut_likelihood : bool
         If true, we allow for short-cut evaluation of the likelihood, rejecting when we can if the ll
         drops below the acceptance value
@@ -121,9 +123,20 @@ class MHSampler(Sampler):
         else:
             return float("nan")
 
+    def summary(self):
+        """
+        Returns a line about the run so far: the proposals, the acceptance ratio, and (over all FunctionHypotheses)
+        the fraction of values set that were never compiled, since they were rejected without being called.
+
+        """
+        return "# Proposals: %s\tAcceptance ratio: %.3f\tUncompiled fraction: %.3f" % \
+               (self.proposal_count, self.acceptance_ratio(), FunctionHypothesis.uncompiled_fraction())
+
     def next(self):
         """Generate another sample."""
         if self.samples_yielded >= self.steps:
+            if self.trace:
+                print self.summary()
             raise StopIteration
         else:
             for _ in xrange(self.skip+1):
@@ -172,5 +185,6 @@ if __name__ == "__main__":
     sampler = MHSampler(h0, data, steps=100000)
     for h in break_ctrlc(sampler):
         print h.posterior_score, h.prior, h.likelihood, h.compute_likelihood(data), h
+    print sampler.summary()
 
 
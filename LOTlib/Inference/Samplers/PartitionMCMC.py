@@ -10,6 +10,7 @@
 from copy import copy
 
 from LOTlib import break_ctrlc
+from LOTlib.Enumeration import DepthEnumerator
 from LOTlib.Miscellaneous import Infinity, infrange
 from LOTlib.Subtrees import trim_leaves
 from LOTlib.Miscellaneous import None2Empty, lambdaNone
@@ -43,11 +44,12 @@ class PartitionMCMC(MultipleChainMCMC):
 
         # first figure out the depth we can go to without exceeding max_N
         partitions = []
+        enumerator = DepthEnumerator(grammar, leaves=False) # shared, so each depth builds on the last
         try:
             for d in infrange():
                 #print "# trying ", d
                 tmp = []
-                for i, t in enumerate(grammar.enumerate_at_depth(d, leaves=False)):
+                for i, t in enumerate(grammar.enumerate_at_depth(d, leaves=False, enumerator=enumerator)):
                     tmp.append(t)
                     if i > max_N:
                         raise BreakException
@@ -77,6 +79,7 @@ class PartitionMCMC(MultipleChainMCMC):
                 for i, a in enumerate(n.args):
                     if grammar.is_nonterminal(a):
                         n.args[i] = grammar.generate(a)
+                n.invalidate()
         print "# Initialized %s partitions" % len(partitions)
 
         # initialize each chain
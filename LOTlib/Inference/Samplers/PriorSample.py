@@ -15,6 +15,9 @@ class PriorSampler(object):
         assert isinstance(h0, LOTHypothesis) # only implemented for LOTHypothesis
         self.samples_yielded = 0
 
+        # draw the trees in batches
+        self.values = h0.grammar.generate_many(steps, x=h0.value.returntype, max_nodes=getattr(h0, 'maxnodes', Infinity))
+
     def __iter__(self):
         return self
 
@@ -23,7 +26,7 @@ class PriorSampler(object):
             raise StopIteration
         else:
             self.samples_yielded += 1
-            h = type(self.h0)(self.h0.grammar, start=self.h0.value.returntype)
+            h = type(self.h0)(self.h0.grammar, value=next(self.values))
             h.compute_posterior(self.data)
 
             return h
@@ -0,0 +1,223 @@
+"""
+        The inside algorithm for grammars: how much prior mass (or how many trees) each nonterminal has at each
+        size (number of nodes) and depth, and sampling trees of an exact size.
+
+            inside = Inside(grammar)
+            sum(inside.mass_by_size(25))  # the prior mass of the trees within maxnodes=25
+            inside.count_by_depth(4)      # how many trees there are of depth 0, 1, ..., 4
+            inside.sample(12)             # a tree of exactly 12 nodes, drawn from the prior given its size
+
+        The tables are computed by dynamic programming over (nonterminal, size or depth, bound variables in
+        scope), with the same expansions of each nonterminal as LOTlib.Enumeration.DepthEnumerator, so bound
+        variables are counted as in Grammar.log_probability. Counts are Python ints, so they don't overflow.
+        Each nonterminal and scope has one table for all sizes, filled in from small sizes up.
+
+        sample draws each rule in proportion to its probability times the mass of the ways to finish the tree at
+        the right size, so it needs no rejection: its trees have exactly the prior's probabilities, renormalized
+        over the trees of that size.
+"""
+from LOTlib.Enumeration.DepthEnumerator import DepthEnumerator, bv_scope_item
+from LOTlib.Miscellaneous import weighted_sample
+
+
+class Inside(object):
+    """
+    Mass and counts by size and depth, and sampling by size, for a grammar (see the top of this file).
+
+    Arguments
+    ---------
+    grammar : LOTlib.Grammar
+        The grammar. If its version changes, the tables are thrown away.
+
+    """
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.enumerator = DepthEnumerator(grammar) # for the expansions of each nonterminal, and making trees
+        self.clear()
+
+    def clear(self):
+        """ Throw away all of the tables """
+        self.enumerator.clear()
+        self.tables = dict()
+
+    def check_version(self):
+        if self.enumerator.table.version != self.grammar.version:
+            self.clear()
+
+    def top(self, nt):
+        """ The nonterminal to start from, the bound variables in scope there, and their rules """
+        if nt is None:
+            nt = self.grammar.start
+        scope_rules = list(self.grammar.bv_scope)
+        return nt, tuple([bv_scope_item(r.nt, r.to, r.p) for r in scope_rules]), scope_rules
+
+    # --------------------------------------------------------------------------------------------------------
+    # What to call
+    # --------------------------------------------------------------------------------------------------------
+
+    def mass_by_size(self, max_nodes, nt=None):
+        """ A list whose n'th entry is the prior mass of the trees of nt with exactly n nodes, up to max_nodes """
+        nt, scope, _ = self.top(nt)
+        return self.by_size(nt, max_nodes, scope, False)
+
+    def count_by_size(self, max_nodes, nt=None):
+        """ A list whose n'th entry is the number of trees of nt with exactly n nodes, up to max_nodes """
+        nt, scope, _ = self.top(nt)
+        return self.by_size(nt, max_nodes, scope, True)
+
+    def mass_by_depth(self, max_depth, nt=None):
+        """ A list whose d'th entry is the prior mass of the trees of nt of depth exactly d, up to max_depth """
+        nt, scope, _ = self.top(nt)
+        within = self.by_depth(nt, max_depth, scope, False)
+        return within[:1] + [b - a for a, b in zip(within, within[1:])]
+
+    def count_by_depth(self, max_depth, nt=None):
+        """ A list whose d'th entry is the number of trees of nt of depth exactly d, up to max_depth """
+        nt, scope, _ = self.top(nt)
+        within = self.by_depth(nt, max_depth, scope, True)
+        return within[:1] + [b - a for a, b in zip(within, within[1:])]
+
+    def sample(self, n, nt=None):
+        """ Draw a tree of nt with exactly n nodes, with probability proportional to its prior """
+        nt, scope, scope_rules = self.top(nt)
+        assert self.by_size(nt, n, scope, False)[n] > 0, "*** There are no trees of %s with %s nodes" % (nt, n)
+        return self.enumerator.to_FunctionNode(self.sample_subtree(nt, n, scope), nt, scope_rules)
+
+    # --------------------------------------------------------------------------------------------------------
+    # The tables
+    # --------------------------------------------------------------------------------------------------------
+
+    def weight(self, nt, code, scope, counts):
+        """ What the expansion code of nt counts for: 1, or its probability with the bound variables in scope """
+        if counts:
+            return 1
+        table = self.enumerator.table
+        Z = table.Z.get(nt, 0.0) + sum([p for bvnt, _, p in scope if bvnt == nt])
+        p = table.rules[code].p if code >= 0 else scope[-code-1][2]
+        return p / Z
+
+    def by_size(self, nt, max_nodes, scope, counts):
+        """ For each n up to max_nodes, the total weight of the trees of nt with n nodes """
+        self.check_version()
+        self.fill_sizes(nt, max_nodes, scope, counts)
+        return self.tables[('size', nt, scope, counts)][:max_nodes+1]
+
+    def fill_sizes(self, nt, max_nodes, scope, counts):
+        """
+        Make sure the table of nt's weights by size goes up to max_nodes.
+
+        There is one table for each (nt, scope, counts), for all sizes, and each is filled in from small sizes
+        up, so that asking for a bigger size only computes the new entries. A tree with n nodes has kids with
+        at most n-1 nodes, so before filling in size n of a table, we fill in its kids' tables up to n-1. We keep
+        what still needs filling on a stack, rather than recursing, so that big sizes don't recurse deeply.
+        """
+        stack = [(nt, scope, max_nodes)]
+        while stack:
+            x, x_scope, n = stack[-1]
+            v = self.size_table(x, x_scope, counts)
+            if len(v) > n:
+                stack.pop()
+                continue
+
+            size = len(v) # the next one to fill in
+            expansions = self.enumerator.expansions(x, x_scope)
+            missing = [(k, kid_scope, size-1) for _, kts, kid_scope in expansions for k in set(kts)
+                       if len(self.size_table(k, kid_scope, counts)) < size]
+            if missing:
+                stack.extend(missing)
+                continue
+
+            total = 0 if counts else 0.0
+            for code, kts, kid_scope in expansions:
+                w = self.weight(x, code, x_scope, counts)
+                if len(kts) == 0:
+                    if size == 1:
+                        total += w
+                elif size-1 >= len(kts):
+                    total += w * self.kids_table(tuple(kts), kid_scope, size-1, counts)[size-1]
+            v.append(total)
+
+    def size_table(self, nt, scope, counts):
+        """ The weights of nt's trees by size, as far as they are filled in (size 0 has none) """
+        key = ('size', nt, scope, counts)
+        if key not in self.tables:
+            self.tables[key] = [0 if counts else 0.0]
+        return self.tables[key]
+
+    def kids_table(self, kts, scope, max_nodes, counts):
+        """
+        The weights of the ways to give the nonterminals kts each number of nodes, up to (at least) max_nodes.
+        Their own tables must already go up to max_nodes.
+        """
+        key = ('kids', kts, scope, counts)
+        if key not in self.tables:
+            self.tables[key] = []
+        v = self.tables[key]
+
+        zero = 0 if counts else 0.0
+        if len(kts) == 0:
+            while len(v) <= max_nodes:
+                v.append(zero if v else (1 if counts else 1.0))
+        else:
+            first = self.tables[('size', kts[0], scope, counts)]
+            rest = self.kids_table(kts[1:], scope, max_nodes, counts)
+            while len(v) <= max_nodes:
+                n = len(v)
+                v.append(sum([first[i] * rest[n-i] for i in xrange(1, n+1)]) if n > 0 else zero)
+        return v
+
+    def by_depth(self, nt, max_depth, scope, counts):
+        """ For each d up to max_depth, the total weight of the trees of nt of depth at most d """
+        self.check_version()
+        key = ('depth', nt, max_depth, scope, counts)
+        if key not in self.tables:
+            v = [0 if counts else 0.0] * (max_depth+1)
+            for code, kts, kid_scope in self.enumerator.expansions(nt, scope):
+                w = self.weight(nt, code, scope, counts)
+                if len(kts) == 0: # a terminal has depth 0
+                    for d in xrange(max_depth+1):
+                        v[d] += w
+                elif max_depth >= 1: # all the kids are at most one shallower
+                    kids = [self.by_depth(a, max_depth-1, kid_scope, counts) for a in kts]
+                    for d in xrange(1, max_depth+1):
+                        x = w
+                        for k in kids:
+                            x *= k[d-1]
+                        v[d] += x
+            self.tables[key] = v
+        return self.tables[key]
+
+    # --------------------------------------------------------------------------------------------------------
+    # Sampling
+    # --------------------------------------------------------------------------------------------------------
+
+    # These use the tables as sample left them: by_size(nt, n) filled in everything its trees can need
+
+    def sample_subtree(self, nt, n, scope):
+        """ Draw a subtree (as in DepthEnumerator) of nt with n nodes """
+        options, probs = [], []
+        for code, kts, kid_scope in self.enumerator.expansions(nt, scope):
+            w = self.weight(nt, code, scope, False)
+            if len(kts) == 0:
+                p = w if n == 1 else 0.0
+            else:
+                p = w * self.kids_table(tuple(kts), kid_scope, n-1, False)[n-1] if n-1 >= len(kts) else 0.0
+            if p > 0:
+                options.append((code, kts, kid_scope))
+                probs.append(p)
+
+        code, kts, kid_scope = weighted_sample(options, probs=probs)
+        return (code, tuple(self.sample_kids(tuple(kts), n-1, kid_scope)))
+
+    def sample_kids(self, kts, n, scope):
+        """ Draw subtrees for the nonterminals kts, with n nodes between them """
+        if len(kts) == 0:
+            return []
+
+        # The size of the first, in proportion to the mass of it and the rest at that split
+        first = self.size_table(kts[0], scope, False)
+        rest = self.kids_table(kts[1:], scope, n, False)
+        sizes = [i for i in xrange(1, n+1) if first[i] * rest[n-i] > 0]
+        i = weighted_sample(sizes, probs=[first[i] * rest[n-i] for i in sizes])
+
+        return [self.sample_subtree(kts[0], i, scope)] + self.sample_kids(kts[1:], n-i, scope)
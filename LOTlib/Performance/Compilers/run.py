@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+        Compare the ways of compiling trees to functions: eval of their strings (what LOTHypothesis does), the
+        ASTCompiler, the CombinatorCompiler and the MemoCompiler (see LOTlib.Compilers). For each model, we time
+        compiling its hypotheses' values, calling the compiled functions on the model's data, and then compiling and
+        calling a regeneration proposal from each hypothesis (which is where the MemoCompiler should help).
+"""
+
+import imp
+from time import time
+from optparse import OptionParser
+
+from LOTlib.Compilers import ASTCompiler, CombinatorCompiler, MemoCompiler, default_environment
+
+parser = OptionParser()
+parser.add_option("--models", dest="MODELS", type="str", default="Number,RationalRules", help="Examples to compile the hypotheses of")
+parser.add_option("--trees", dest="TREES", type="int", default=1000, help="Number of trees to compile")
+parser.add_option("--repeats", dest="REPEATS", type="int", default=5, help="Number of times to compile each tree")
+parser.add_option("--inputs", dest="INPUTS", type="int", default=50, help="Number of data points to call each function on")
+options, _ = parser.parse_args()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def load_model(name):
+    # Some Examples packages import more than their Model needs, so we load just the Model
+    return imp.load_source('LOTlib_Performance_%s' % name, 'LOTlib/Examples/%s/Model.py' % name)
+
+env = default_environment()
+eval_compiler = lambda t, display: eval(display % str(t), env)
+memo_compiler = MemoCompiler(env)
+compilers = [('eval', eval_compiler), ('ast', ASTCompiler(env)), ('combinator', CombinatorCompiler(env)),
+             ('memo', memo_compiler)]
+
+for name in options.MODELS.split(','):
+    model = load_model(name)
+    hypotheses = [model.make_hypothesis() for _ in xrange(options.TREES)]
+    proposals = [h.propose()[0] for h in hypotheses]
+    inputs = [d.input for d in model.make_data()][:options.INPUTS]
+
+    for cname, compiler in compilers:
+        start = time()
+        for _ in xrange(options.REPEATS):
+            functions = [compiler(h.value, h.display) for h in hypotheses]
+        compile_time = time() - start
+
+        start = time()
+        for h, f in zip(hypotheses, functions):
+            h.fvalue = f
+            for i in inputs:
+                try:
+                    h(*i)
+                except Exception:
+                    pass
+        call_time = time() - start
+
+        start = time()
+        for p in proposals:
+            p.fvalue = compiler(p.value, p.display)
+            for i in inputs:
+                try:
+                    p(*i)
+                except Exception:
+                    pass
+        propose_time = time() - start
+
+        print "%s\t%s\tcompile=%.3fs\tcall=%.3fs\tpropose=%.3fs" % (name, cname, compile_time, call_time, propose_time)
+    print memo_compiler.cache
+    memo_compiler.cache.clear()
+    memo_compiler.cache.hits = memo_compiler.cache.misses = 0
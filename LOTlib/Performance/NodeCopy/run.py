@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+        Compare the memory use and copy time of (slotted) FunctionNodes to nodes that work the way FunctionNodes
+        used to, with a __dict__ per node that __copy__ reflects over.
+"""
+
+import sys
+from copy import copy
+from time import time
+from optparse import OptionParser
+
+from LOTlib.FunctionNode import FunctionNode, isFunctionNode
+from LOTlib.Miscellaneous import self_update
+
+parser = OptionParser()
+parser.add_option("--grammar", dest="GRAMMAR", type="str", default="LOTlib.Examples.Number.Model", help="Module with a grammar")
+parser.add_option("--trees", dest="TREES", type="int", default=1000, help="Number of trees to copy")
+parser.add_option("--copies", dest="COPIES", type="int", default=20, help="Number of times to copy each tree")
+options, _ = parser.parse_args()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+class DictFunctionNode(object):
+    """ What FunctionNode used to be, as far as copying goes """
+    NoCopy = {'self', 'parent', 'returntype', 'name', 'args', 'parent'}
+
+    def __init__(self, parent, returntype, name, args):
+        self_update(self, locals())
+        self.added_rule = None
+        self.lp_cache = None
+        self.hash_cache = None
+
+    def __copy__(self):
+        fn = DictFunctionNode(self.parent, self.returntype, self.name, None)
+        for k in set(self.__dict__.keys()).difference(DictFunctionNode.NoCopy):
+            fn.__dict__[k] = copy(self.__dict__[k])
+
+        if self.args is not None:
+            fn.args = map(copy, self.args)
+            for a in fn.args:
+                if isinstance(a, DictFunctionNode):
+                    a.parent = fn
+        return fn
+
+def to_dict_nodes(t, parent=None):
+    fn = DictFunctionNode(parent, t.returntype, t.name, None)
+    fn.added_rule = t.added_rule
+    if t.args is not None:
+        fn.args = [to_dict_nodes(a, fn) if isFunctionNode(a) else a for a in t.args]
+    return fn
+
+def node_bytes(n):
+    return sys.getsizeof(n) + (sys.getsizeof(n.__dict__) if hasattr(n, '__dict__') else 0)
+
+def mean_node_bytes(trees, subnodes):
+    nodes = [n for t in trees for n in subnodes(t)]
+    return float(sum(map(node_bytes, nodes))) / len(nodes)
+
+def time_copy(trees):
+    start = time()
+    for _ in xrange(options.COPIES):
+        for t in trees:
+            copy(t)
+    return time() - start
+
+def dict_subnodes(t):
+    yield t
+    for a in t.args or []:
+        if isinstance(a, DictFunctionNode):
+            for n in dict_subnodes(a):
+                yield n
+
+grammar = __import__(options.GRAMMAR, fromlist=['grammar']).grammar
+trees = [grammar.generate() for _ in xrange(options.TREES)]
+dict_trees = map(to_dict_nodes, trees)
+
+print "# %s nodes in %s trees" % (sum([t.count_nodes() for t in trees]), len(trees))
+print "bytes/node\tslots=%.1f\tdict=%.1f" % (mean_node_bytes(trees, iter), mean_node_bytes(dict_trees, dict_subnodes))
+
+slotted, dicted = time_copy(trees), time_copy(dict_trees)
+print "copy time\tslots=%.3fs\tdict=%.3fs\tspeedup=%.1fx" % (slotted, dicted, dicted/slotted)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+"""
+        Compare Grammar.get_matching_rule (a lookup in Grammar.rule_index) to the old linear scan over
+        the rules for a nonterminal, on grammars with lots of rules.
+"""
+
+from time import time
+from optparse import OptionParser
+
+from LOTlib.Grammar import Grammar
+
+parser = OptionParser()
+parser.add_option("--rules", dest="RULES", type="str", default="10,100,500,1000", help="Number of rules per nonterminal")
+parser.add_option("--trees", dest="TREES", type="int", default=1000, help="Number of trees to look up rules in")
+options, _ = parser.parse_args()
+
+# ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+def make_grammar(nrules):
+    """ A grammar with nrules terminals and nrules/10 functions in EXPR, plus a lambda """
+    grammar = Grammar()
+    grammar.add_rule('START', '', ['EXPR'], 1.0)
+    grammar.add_rule('EXPR', 'apply_', ['FUNCTION', 'EXPR'], 1.0)
+    grammar.add_rule('FUNCTION', 'lambda', ['EXPR'], 1.0, bv_type='EXPR')
+
+    for i in xrange(max(1, nrules/10)):
+        grammar.add_rule('EXPR', 'f%s_'%i, ['EXPR', 'EXPR'], 1.0)
+    for i in xrange(nrules):
+        grammar.add_rule('EXPR', 'x%s'%i, None, 10.0)
+
+    return grammar
+
+def linear_matching_rule(grammar, t):
+    """ What get_matching_rule used to do """
+    matching_rules = [r for r in grammar.get_rules(t.returntype) if r.get_rule_signature() == t.get_rule_signature()]
+    assert len(matching_rules) == 1
+    return matching_rules[0]
+
+def time_lookup(grammar, trees, f):
+    start = time()
+    for t in trees:
+        for n in t.iterate_subnodes(grammar):
+            f(grammar, n)
+    return time() - start
+
+for nrules in map(int, options.RULES.split(',')):
+    grammar = make_grammar(nrules)
+    trees = [grammar.generate() for _ in xrange(options.TREES)]
+
+    indexed = time_lookup(grammar, trees, Grammar.get_matching_rule)
+    linear  = time_lookup(grammar, trees, linear_matching_rule)
+
+    print "%s rules\tindexed=%.3fs\tlinear=%.3fs\tspeedup=%.1fx" % (grammar.nrules(), indexed, linear, linear/indexed)
@@ -1,4 +1,4 @@
-from LOTlib.Eval import primitive
+from LOTlib.Eval import primitive, fuel_cost
 from LOTlib.Miscellaneous import Infinity
 from math import isnan, isinf
 
@@ -6,6 +6,7 @@ from math import isnan, isinf
 # Set-theoretic primitives
 # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 @primitive
+@fuel_cost(len)
 def set_(*args):
     """
     NOTE: This makes a set from args, but it has the property that when called with a string, it doesn't break
@@ -22,12 +23,15 @@ def set_add_(x,s):
     return s
 
 @primitive
+@fuel_cost(len)
 def union_(A,B): return A.union(B)
 
 @primitive
+@fuel_cost(len)
 def intersection_(A,B): return A.intersection(B)
 
 @primitive
+@fuel_cost(len)
 def setdifference_(A,B): return A.difference(B)
 
 @primitive
@@ -122,6 +126,7 @@ def is_in_(x,S):
     return (x in S)
 
 @primitive
+@fuel_cost(len)
 def diff_(S, p):
     """
     takes a set and an element of that set and
@@ -130,6 +135,7 @@ def diff_(S, p):
     return S.difference(set(p))
 
 @primitive
+@fuel_cost(len)
 def range_set_(x, y, bound=Infinity):
     if y < x or y-x > bound or isnan(x) or isnan(y) or isinf(x) or isinf(y):
         return set()
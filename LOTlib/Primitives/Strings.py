@@ -1,7 +1,7 @@
 """
 String operations that are a little safer than defaults, and which mimic cons/cdr/car (for doing grammar induction)
 """
-from LOTlib.Eval import primitive, RecursionDepthException
+from LOTlib.Eval import primitive, fuel_cost, RecursionDepthException
 MAX_STRING_LENGTH = 256
 
 class StringLengthException(Exception):
@@ -10,6 +10,7 @@ class StringLengthException(Exception):
     pass
 
 @primitive
+@fuel_cost(len)
 def strcons_(*x, **kwargs):
     for xi in x:
         if len(xi) > StringLengthException.MAX_LENGTH:
@@ -11,6 +11,7 @@ parser.add_option("--steps", dest="STEPS", type="int", default=100000, help="Num
 parser.add_option("--top", dest="TOP_COUNT", type="int", default=100, help="Top number of hypotheses to store")
 parser.add_option("--chains", dest="CHAINS", type="int", default=1, help="Number of chains to run (new data set for each chain)")
 parser.add_option("--grammar", dest="GRAMMAR", type="str", default="lot_grammar", help="The grammar we use (defined in Model)")
+parser.add_option("--store", dest="STORE_PATH", type="string", default=None, help="If given, write the hypotheses to a HypothesisStore in this directory instead of pickling them")
 
 (options, args) = parser.parse_args()
 
@@ -72,7 +73,13 @@ if __name__ == "__main__":
     for s in MPI_unorderedmap(myrun, [ [s] for s in observed_sets ]*options.CHAINS ):
         hypotheses.update(s)
 
-    import pickle
-    with open(options.OUT_PATH, 'w') as f:
-        pickle.dump(hypotheses, f)
+    if options.STORE_PATH is not None:
+        from LOTlib.HypothesisStore import HypothesisStore
+        with HypothesisStore(options.STORE_PATH, grammar) as store:
+            for h in hypotheses:
+                store.add(h)
+    else:
+        import pickle
+        with open(options.OUT_PATH, 'w') as f:
+            pickle.dump(hypotheses, f)
 
@@ -21,8 +21,7 @@ def generate_unique_trees(grammar, start='START', N=1000):
     """
             Yield a bunch of unique trees, produced from the grammar
     """
-    for _ in break_ctrlc(xrange(N)):
-        t = grammar.generate(start)
+    for t in break_ctrlc(grammar.generate_many(N, x=start)):
         yield t
 
 @UniquifyFunction
@@ -122,6 +121,7 @@ def trim_leaves_(t):
     
     if isFunctionNode(t) and t.args is not None:
         t.args = [ x.returntype if (isFunctionNode(x) and x.is_terminal()) else trim_leaves_(x) for x in t.args]
+        t.invalidate()
     return t
                 
 
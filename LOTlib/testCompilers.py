@@ -0,0 +1,62 @@
+import unittest
+
+class CompilersTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing compilers"
+        from LOTlib.Grammar import Grammar
+        from LOTlib.Compilers import ASTCompiler, CombinatorCompiler, MemoCompiler, default_environment
+        from LOTlib.FunctionNode import FunctionNode
+
+        grammar = Grammar()
+        grammar.add_rule('START', '', ['EXPR'], 1.0)
+        grammar.add_rule('EXPR', 'plus_', ['EXPR', 'EXPR'], 1.0)
+        grammar.add_rule('EXPR', 'x', None, 3.0)
+        grammar.add_rule('EXPR', '1', None, 3.0)
+        grammar.add_rule('EXPR', '(%s if %s > 2 else %s)', ['EXPR', 'EXPR', 'EXPR'], 1.0)
+        grammar.add_rule('EXPR', '(%s)(%s)', ['FUNC', 'EXPR'], 1.0)
+        grammar.add_rule('FUNC', 'lambda', ['EXPR'], 1.0, bv_type='EXPR', bv_p=2.0)
+        grammar.add_rule('EXPR', 'apply_', ['FUNC2', 'EXPR'], 1.0)
+        grammar.add_rule('FUNC2', 'lambda', ['EXPR'], 1.0, bv_type='EXPR', bv_args=['EXPR'], bv_p=1.0)
+
+        env = default_environment()
+        memo = MemoCompiler(env, pure=['plus_'], min_size=2)
+        compilers = [ASTCompiler(env), CombinatorCompiler(env), memo]
+        inputs = [0, 1, 3]
+        for _ in xrange(1000):
+            t = grammar.generate()
+            f = eval("lambda x: %s" % t, env)
+            for compiler in compilers:
+                g = compiler(t, "lambda x: %s")
+                for x in inputs + inputs: # the memo's values are right too
+                    try:
+                        y = f(x)
+                    except Exception as e:
+                        self.assertRaises(type(e), g, x)
+                    else:
+                        self.assertEqual(g(x), y)
+
+        # a tree with a subtree we've called looks its value up, but only with the same display
+        t = grammar.generate('EXPR')
+        while t.count_nodes() < 2 or 'lambda' in str(t):
+            t = grammar.generate('EXPR')
+        memo(t, "lambda x: %s")(3)
+        hits = memo.cache.hits
+        memo(t, "lambda y, x: %s")(3, 3)
+        self.assertEqual(memo.cache.hits, hits)
+        bigger = FunctionNode(None, 'EXPR', 'plus_', [t, FunctionNode(None, 'EXPR', '1', None)])
+        self.assertEqual(memo(bigger, "lambda x: %s")(3), eval("lambda x: %s" % t, env)(3) + 1)
+        self.assertEqual(memo.cache.hits, hits + 1)
+
+class MemoPurityTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing MemoCompiler with impure primitives"
+        from LOTlib.Compilers import MemoCompiler, default_environment
+        from LOTlib.FunctionNode import FunctionNode
+
+        # values given to primitives that change them aren't cached, so they can't be changed in the cache
+        memo = MemoCompiler(default_environment(), min_size=2)
+        union = FunctionNode(None, 'SET', 'union_', [FunctionNode(None, 'SET', 'x', None) for _ in xrange(2)])
+        add = FunctionNode(None, 'SET', 'set_add_', ["'a'", union])
+        x = set([1])
+        self.assertEqual(memo(add, "lambda x: %s")(x), set(['a', 1]))
+        self.assertEqual(memo(union, "lambda x: %s")(x), set([1]))
@@ -0,0 +1,156 @@
+import unittest
+
+class FunctionCacheTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing the compiled function cache"
+        from copy import deepcopy
+        from LOTlib.DefaultGrammars import booleanTestGrammar as grammar, booleanTestInputs
+        from LOTlib.Eval import FunctionCache, register_primitive
+        from LOTlib.Hypotheses.LOTHypothesis import LOTHypothesis
+
+        class CachedHypothesis(LOTHypothesis):
+            function_cache = FunctionCache(maxsize=5)
+
+        cache = CachedHypothesis.function_cache
+        h = CachedHypothesis(grammar, display="lambda x: %s")
+        h.fvalue # compiled when first needed
+        self.assertEqual((cache.hits, cache.misses), (0, 1))
+
+        # the same program, even in another hypothesis, gets the same function
+        h2 = CachedHypothesis(grammar, value=deepcopy(h.value), display="lambda x: %s")
+        self.assertIs(h2.fvalue, h.fvalue)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+        for x in booleanTestInputs:
+            self.assertEqual(h2(x), eval(str(h))(x))
+
+        # which are kept until they're the least recently used
+        for _ in xrange(100):
+            CachedHypothesis(grammar, display="lambda x: %s").fvalue
+        self.assertTrue(len(cache) <= 5)
+
+        # hypotheses can opt out
+        class UncachedHypothesis(LOTHypothesis):
+            function_cache = None
+        h3 = UncachedHypothesis(grammar, value=deepcopy(h.value), display="lambda x: %s")
+        self.assertIsNot(h3.fvalue, h.fvalue)
+
+        # functions from a compiler aren't mixed up with eval's
+        from LOTlib.Compilers import ASTCompiler
+        class CompiledHypothesis(CachedHypothesis):
+            compiler = ASTCompiler()
+        counts = (cache.hits, cache.misses)
+        h4 = CompiledHypothesis(grammar, value=deepcopy(h.value), display="lambda x: %s")
+        self.assertIsNot(h4.fvalue, h.fvalue)
+        self.assertEqual((cache.hits, cache.misses), counts)
+        for x in booleanTestInputs:
+            self.assertEqual(h4(x), h(x))
+
+        # and new primitives may change what programs mean
+        register_primitive(lambda x: x, name='identity_')
+        self.assertEqual(len(cache), 0)
+
+class PrimitiveProfileTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing profiling primitives"
+        import LOTlib.Eval
+        from LOTlib.Eval import primitive, profiled, PrimitiveProfile, global_profile
+
+        # whether we profile is decided when we decorate
+        def plain_(x): return x
+        if not (LOTlib.Eval.PROFILE_PRIMITIVES or LOTlib.Eval.FUEL_PRIMITIVES):
+            self.assertIs(primitive(plain_), plain_)
+
+        @profiled
+        def inc_(x): return x+1
+
+        @profiled
+        def twice_(f, x): return f(f(x))
+
+        calls = dict((r[0], r[1]) for r in global_profile.rows()).get('inc_', 0)
+        with PrimitiveProfile() as outer:
+            with PrimitiveProfile() as inner:
+                self.assertEqual(twice_(inc_, 1), 3)
+            inc_(0)
+
+        self.assertEqual(inner.stats['inc_'][0], 2)
+        self.assertEqual(inner.stats['twice_'][0], 1)
+        self.assertEqual(outer.stats['inc_'][0], 3)
+        self.assertEqual(dict((r[0], r[1]) for r in global_profile.rows())['inc_'], calls+3)
+        self.assertEqual(PrimitiveProfile.active, [])
+
+        # twice_'s own time doesn't count the inc_ calls it makes
+        n, time, own_time = inner.stats['twice_']
+        self.assertTrue(own_time <= time)
+
+        for sort in PrimitiveProfile.FIELDS:
+            i = PrimitiveProfile.FIELDS.index(sort)+1
+            values = [r[i] for r in outer.rows(sort)]
+            self.assertEqual(values, sorted(values, reverse=True))
+        self.assertEqual(len(outer.report(n=1).split('\n')), 2)
+
+class FuelTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing fuel"
+        import warnings
+        import LOTlib.Eval
+        from LOTlib.Eval import fueled, fuel_budget, fuel, TooBigException
+        from LOTlib.Hypotheses.Hypothesis import Hypothesis
+        from LOTlib.Miscellaneous import Infinity
+
+        @fueled
+        def count_(n): return 0 if n == 0 else 1 + count_(n-1)
+
+        self.assertEqual(count_(100), 100) # no budget, no limit
+        with fuel_budget(10):
+            self.assertEqual(count_(9), 9) # 10 calls
+            self.assertRaises(TooBigException, count_, 0)
+        self.assertEqual(fuel[0], float("inf"))
+
+        # nested budgets use the outer one's fuel
+        with fuel_budget(10):
+            with fuel_budget(100):
+                count_(4)
+            self.assertEqual(fuel[0], 5)
+
+        class CountHypothesis(Hypothesis):
+            def compute_single_likelihood(self, datum):
+                return -count_(datum)
+
+        h = CountHypothesis()
+        self.assertEqual(h.compute_likelihood([5, 50]), -55)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            h.fuel = 10
+            self.assertEqual(h.compute_likelihood([5, 5]), -10) # fuel is per datum
+        # we're warned once, when it is set, if any primitives (like and_) were imported without fuel
+        self.assertEqual(len(caught), 1 if LOTlib.Eval.unfueled_primitives else 0)
+        self.assertEqual(h.compute_likelihood([5, 50]), -Infinity)
+        self.assertEqual(list(h.compute_predictive_likelihood([5, 50, 0], include_last=True)), [0, -5, -Infinity, -Infinity])
+
+        # the real set and string primitives that build big things use fuel, even without LOTLIB_PRIMITIVE_FUEL
+        from LOTlib.Primitives import SetTheory, Strings
+        env = dict(vars(SetTheory))
+        env.update(vars(Strings))
+        for name in ['union_', 'range_set_', 'strcons_']:
+            self.assertNotIn(name, LOTlib.Eval.unfueled_primitives)
+
+        f = eval("lambda x: union_(range_set_(1, x), range_set_(x+1, 2*x))", env)
+        with fuel_budget(10000):
+            self.assertEqual(len(f(1000)), 2000)
+            self.assertEqual(fuel[0], 10000 - 3 - 1000 - 1000 - 2000) # a unit a call, and one for each element
+        with fuel_budget(1000):
+            self.assertRaises(TooBigException, f, 1000)
+
+        # doubling a string uses fuel for each character, so a few calls can't make a huge one
+        g = eval("lambda x: strcons_(strcons_(x, x), strcons_(x, x))", env)
+        with fuel_budget(100):
+            self.assertEqual(g('ab'), 'abababab')
+            self.assertRaises(TooBigException, g, 'a'*50)
+
+        class SetHypothesis(Hypothesis):
+            def compute_single_likelihood(self, datum):
+                return -len(f(datum))
+
+        h = SetHypothesis(fuel=1000)
+        self.assertEqual(h.compute_likelihood([10]), -20)
+        self.assertEqual(h.compute_likelihood([10, 1000]), -Infinity)
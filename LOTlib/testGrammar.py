@@ -53,18 +53,59 @@ class GrammarTreeTest(unittest.TestCase):
 
                         # NOTE: We cannot use "in" here since that uses rule "is", but we've created
                         # a new thing that is equivalent to the rule. So instead, we check the bv name
-                        self.assertTrue(r.name in [r.name for r in grammar.rules[ti.returntype]])
+                        self.assertTrue(r.name in [r.name for r in grammar.get_rules(ti.returntype)])
                         added_rules.append(r)
 
                     if re.match(r'lambda', ti.name):
                         self.assertTrue(isinstance(ti, BVAddFunctionNode))
 
                         # assert that this rule isn't already there
-                        self.assertTrue(ti.added_rule.name not in [r.name for r in grammar.rules[ti.returntype]])
+                        self.assertTrue(ti.added_rule.name not in [r.name for r in grammar.get_rules(ti.returntype)])
 
                 # Then assert that none of the rules are still in the grammar
                 for therule in added_rules:
-                    self.assertTrue(therule.name not in [r.name for r in grammar.rules[ti.returntype]])
+                    self.assertTrue(therule.name not in [r.name for r in grammar.get_rules(ti.returntype)])
+
+
+class BVScopeTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing bound variable scopes"
+        import threading
+        from LOTlib.BVRuleContextManager import BVRuleContextManager
+
+        grammar = infiniteTestGrammar
+        rules = dict([(nt, list(grammar.rules[nt])) for nt in grammar.nonterminals()])
+
+        for _ in xrange(500):
+            t = grammar.generate()
+            lambdas = [x for x in t if isinstance(x, BVAddFunctionNode)]
+            for x in t.iterate_subnodes(grammar):
+                # the grammar's own rules are never changed, only the scope
+                self.assertEqual(rules, dict([(nt, grammar.rules[nt]) for nt in grammar.nonterminals()]))
+            self.assertEqual(grammar.bv_scope, [])
+
+            # nested and interleaved contexts
+            if len(lambdas) >= 2:
+                a, b = lambdas[0], lambdas[-1]
+                ca, cb = BVRuleContextManager(grammar, a), BVRuleContextManager(grammar, b)
+                ca.__enter__()
+                cb.__enter__()
+                self.assertEqual(grammar.bv_scope, [a.added_rule, b.added_rule])
+                ca.__exit__(None, None, None) # out of order
+                self.assertEqual(grammar.bv_scope, [b.added_rule])
+                cb.__exit__(None, None, None)
+                self.assertEqual(grammar.bv_scope, [])
+
+            # a scope is only seen by the thread that entered it
+            if lambdas:
+                seen = []
+                with BVRuleContextManager(grammar, lambdas[0]):
+                    self.assertTrue(lambdas[0].added_rule in grammar.get_rules(lambdas[0].added_rule.nt))
+                    th = threading.Thread(target=lambda: seen.append(grammar.bv_scope))
+                    th.start()
+                    th.join()
+                self.assertEqual(seen, [[]])
+
 
 
 class FinitePackTest(unittest.TestCase):
@@ -88,3 +129,483 @@ class InfinitePackTest(unittest.TestCase):
 
             self.assertTrue(t==t2)
 
+
+
+class BinaryPackTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing binary packing"
+        from LOTlib.Grammar import Grammar
+
+        # more rules than pack_ascii has characters, and nested lambdas
+        grammar = Grammar()
+        grammar.add_rule('START', '', ['EXPR'], 1.0)
+        grammar.add_rule('EXPR', 'apply_', ['FUNCTION', 'EXPR'], 1.0)
+        grammar.add_rule('FUNCTION', 'lambda', ['EXPR'], 1.0, bv_type='EXPR', bv_p=5.0)
+        for i in xrange(200):
+            grammar.add_rule('EXPR', 'f%s_' % i, ['EXPR'], 0.05)
+            grammar.add_rule('EXPR', 'c%s' % i, None, 1.0)
+
+        for g in [infiniteTestGrammar, grammar]:
+            trees = [g.generate() for _ in xrange(1000)]
+            for t in trees:
+                self.assertEqual(g.unpack(g.pack(t)), t)
+            self.assertEqual(list(g.unpack_many(''.join(map(g.pack, trees)))), trees)
+
+        self.assertTrue(any([max(map(ord, grammar.pack(t))) > 127 for t in trees])) # some codes take two bytes
+        big = [t for t in trees if max(map(ord, grammar.pack(t))) >= 62][0]
+        self.assertRaises(AssertionError, grammar.pack_ascii, big)
+
+class RuleIndexTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing the rule index"
+        for grammar in [finiteTestGrammar, infiniteTestGrammar]:
+            for _ in xrange(1000):
+                t = grammar.generate()
+
+                for ti in t.iterate_subnodes(grammar):
+                    # the index must agree with a scan of the rules, including bound variable rules
+                    matches = [r for r in grammar.get_rules(ti.returntype) if r.get_rule_signature() == ti.get_rule_signature()]
+                    self.assertEqual(len(matches), 1)
+                    self.assertTrue(grammar.get_matching_rule(ti) is matches[0])
+
+            # And the bound variables must all have been removed
+            self.assertEqual(sorted(grammar.rule_index.keys()), sorted([r.get_rule_signature() for r in grammar]))
+
+
+class CachedLogProbabilityTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing cached log probabilities"
+        from copy import deepcopy
+        from LOTlib.Hypotheses.Proposers import regeneration_proposal, ProposalFailedException
+
+        for grammar in [finiteTestGrammar, infiniteTestGrammar]:
+            t = grammar.generate()
+            for _ in xrange(1000):
+                try:
+                    t, _ = regeneration_proposal(grammar, t)
+                except ProposalFailedException:
+                    continue
+
+                # deepcopy does not keep lp_cache, so this recomputes everything
+                self.assertAlmostEqual(grammar.log_probability(t), grammar.log_probability(deepcopy(t)))
+
+            # changing a rule's probability must not leave stale values
+            r = grammar.rules[grammar.start][0]
+            lp = grammar.log_probability(t)
+            r.p = r.p * 2.0
+            self.assertAlmostEqual(grammar.log_probability(t), grammar.log_probability(deepcopy(t)))
+            r.p = r.p / 2.0
+            self.assertAlmostEqual(grammar.log_probability(t), lp)
+
+
+class CachedMetricsTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing cached node metrics"
+        from collections import Counter
+        from math import log
+        from LOTlib.Hypotheses.Proposers import regeneration_proposal, ProposalFailedException
+
+        def depth(x): # without the cache
+            return max([-1] + [depth(a) for a in x.argFunctionNodes()]) + 1
+
+        def preorder(x):
+            return [x] + [y for a in x.argFunctionNodes() for y in preorder(a)]
+
+        weight = lambda x: 2.0 if x.name == '' else 0.5
+        for grammar in [finiteTestGrammar, infiniteTestGrammar]:
+            t = grammar.generate()
+            for _ in xrange(1000):
+                try:
+                    t, _ = regeneration_proposal(grammar, t)
+                except ProposalFailedException:
+                    continue
+
+                nodes, cumulative = t.subnode_index(weight)
+                self.assertEqual(nodes, preorder(t))
+                self.assertAlmostEqual(cumulative[-1], sum([weight(y) for y in t]))
+                for i, x in enumerate(t):
+                    self.assertTrue(t.subnode_at(i) is x)
+                    self.assertEqual(x.count_nodes(), len(list(x)))
+                    self.assertEqual(x.depth(), depth(x))
+                    self.assertAlmostEqual(x.sample_node_normalizer(weight), sum([weight(y) for y in x]))
+
+        # sampling walks down by the cached totals, but must pick nodes as often as before
+        t = infiniteTestGrammar.generate()
+        while t.count_nodes() < 5:
+            t = infiniteTestGrammar.generate()
+        N = 20000
+        counts = Counter()
+        for _ in xrange(N):
+            n, lp = t.sample_subnode(weight)
+            counts[id(n)] += 1
+            self.assertAlmostEqual(lp, log(weight(n)) - log(t.sample_node_normalizer(weight)))
+        for x in t:
+            self.assertAlmostEqual(counts[id(x)] / float(N), weight(x) / t.sample_node_normalizer(weight), delta=0.02)
+
+
+class HashEqualityTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing FunctionNode hashing and equality"
+        from random import choice
+        from copy import deepcopy
+        from LOTlib.FunctionNode import fullstring
+        from LOTlib.Hypotheses.Proposers import regeneration_proposal, ProposalFailedException
+
+        for grammar in [finiteTestGrammar, infiniteTestGrammar]:
+            trees = [grammar.generate() for _ in xrange(1000)]
+            subtrees = [n for t in trees for n in t]
+
+            # equality must agree with fullstring, and equal trees must hash the same
+            for _ in xrange(10000):
+                x, y = choice(subtrees), choice(subtrees)
+                self.assertEqual(x == y, fullstring(x) == fullstring(y))
+                if x == y:
+                    self.assertEqual(hash(x), hash(y))
+
+            # cached hashes must not survive changes to the tree
+            t = trees[0]
+            for _ in xrange(1000):
+                try:
+                    t, _ = regeneration_proposal(grammar, t)
+                except ProposalFailedException:
+                    continue
+                t2 = deepcopy(t)
+                self.assertEqual(hash(t), hash(t2))
+                self.assertEqual(t, t2)
+
+class CompactTreeTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing CompactTree"
+        import pickle
+        from LOTlib.CompactTree import CompactTree
+
+        for grammar in [finiteTestGrammar, infiniteTestGrammar]:
+            for _ in xrange(1000):
+                t = grammar.generate()
+                ct = CompactTree.from_FunctionNode(grammar, t)
+
+                self.assertEqual(ct.to_FunctionNode(grammar), t)
+                self.assertEqual(ct.pystring(grammar), str(t))
+                self.assertAlmostEqual(ct.log_probability(grammar), grammar.log_probability(t))
+                self.assertEqual(len(ct), t.count_nodes())
+
+                ct2 = pickle.loads(pickle.dumps(ct))
+                self.assertEqual(ct, ct2)
+                self.assertEqual(hash(ct), hash(ct2))
+
+class SlottedNodeTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing copying, pickling and annotating slotted FunctionNodes"
+        import pickle
+        from copy import copy, deepcopy
+
+        for grammar in [finiteTestGrammar, infiniteTestGrammar]:
+            for _ in xrange(1000):
+                t = grammar.generate()
+                self.assertEqual(getattr(t, 'p_propose', 1.0), 1.0)
+                for n in t:
+                    n.p_propose = 0.5
+
+                for t2 in [copy(t), deepcopy(t), pickle.loads(pickle.dumps(t)), pickle.loads(pickle.dumps(t, 2))]:
+                    self.assertEqual(str(t2), str(t))
+                    self.assertTrue(t2.check_parent_refs())
+                    self.assertTrue(all([n.p_propose == 0.5 for n in t2]))
+
+                # setto takes q's annotations (or lack of them) and class
+                q = grammar.generate()
+                t.setto(q)
+                self.assertEqual(str(t), str(q))
+                self.assertIs(type(t), type(q))
+                self.assertEqual(getattr(t, 'p_propose', 1.0), 1.0)
+
+class SampleRuleTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing Grammar.sample_rule"
+        from collections import Counter
+        from LOTlib.BVRuleContextManager import BVRuleContextManager
+
+        def check_frequencies(grammar, nt, N=20000):
+            rules = grammar.get_rules(nt)
+            Z = sum([r.p for r in rules])
+            counts = Counter([id(grammar.sample_rule(nt)) for _ in xrange(N)])
+            for r in rules:
+                self.assertAlmostEqual(counts[id(r)] / float(N), r.p / Z, delta=0.02)
+
+        grammar = infiniteTestGrammar
+        check_frequencies(grammar, 'A')
+
+        # bound variable rules in scope are sampled too
+        t = [n for t in (grammar.generate() for _ in xrange(1000)) for n in t if isinstance(n, BVAddFunctionNode)][0]
+        with BVRuleContextManager(grammar, t, recurse_up=False):
+            check_frequencies(grammar, t.added_rule.nt)
+        check_frequencies(grammar, t.added_rule.nt)
+
+        # changing a rule's p must update the table
+        r = grammar.get_rules('A')[0]
+        old_p = r.p
+        r.p = old_p * 5
+        check_frequencies(grammar, 'A')
+        r.p = old_p
+
+class GenerationBudgetTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing generation with max_nodes and max_depth"
+        from collections import Counter
+        from math import exp
+        from LOTlib.Grammar import GenerationBudgetException
+
+        grammar = infiniteTestGrammar
+        N = 20000
+        counts = Counter()
+        failures = 0
+        for _ in xrange(N):
+            try:
+                t = grammar.generate(max_nodes=6, max_depth=3)
+            except GenerationBudgetException:
+                failures += 1
+                continue
+            finally:
+                self.assertEqual(grammar.bv_scope, []) # lambdas we gave up in must not leave rules behind
+
+            self.assertTrue(t.count_nodes() <= 6 and t.depth() <= 3)
+            counts[t] += 1
+
+        # within budget, trees should have their usual probabilities
+        for t, c in counts.most_common(5):
+            self.assertAlmostEqual(c / float(N), exp(grammar.log_probability(t)), delta=0.01)
+
+        # with enough tries, we get a tree
+        for _ in xrange(100):
+            self.assertTrue(grammar.generate(max_nodes=3, max_tries=1000).count_nodes() <= 3)
+
+class GenerateManyTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing Grammar.generate_many"
+        from collections import Counter
+        from math import exp
+        from LOTlib.CompactTree import CompactTree
+        from LOTlib.FunctionNode import BVUseFunctionNode
+
+        for grammar in [finiteTestGrammar, infiniteTestGrammar]:
+            N = 20000
+            trees = list(grammar.generate_many(N))
+            self.assertEqual(len(trees), N)
+
+            # including trees that use bound variables, trees should have their usual probabilities
+            counts = Counter(trees)
+            bv_trees = [t for t in counts if any([isinstance(n, BVUseFunctionNode) for n in t])]
+            for t in [t for t, _ in counts.most_common(5)] + bv_trees[:5]:
+                self.assertAlmostEqual(counts[t] / float(N), exp(grammar.log_probability(t)), delta=0.01)
+
+            for t in trees[:100]:
+                self.assertTrue(t.check_parent_refs())
+                self.assertIsNone(t.parent)
+
+            unique = list(grammar.generate_many(100, unique=True))
+            self.assertEqual(len(unique), len(set(unique)))
+
+            for ct in grammar.generate_many(100, compact=True, max_nodes=5, max_depth=2):
+                self.assertIsInstance(ct, CompactTree)
+                t = ct.to_FunctionNode(grammar)
+                self.assertTrue(t.count_nodes() <= 5 and t.depth() <= 2)
+
+        # when there aren't enough unique trees, we stop. The rarest tree has probability 0.001, so the batches
+        # must be big enough that one without new trees really means we have them all
+        self.assertEqual(len(list(finiteTestGrammar.generate_many(1000, unique=True, batch_size=20000))), 27)
+
+class DepthEnumeratorTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing DepthEnumerator"
+        import shutil, tempfile
+        from LOTlib.Enumeration import DepthEnumerator
+
+        grammar = infiniteTestGrammar
+        trees = dict([(d, list(grammar.enumerate_at_depth(d))) for d in xrange(5)])
+
+        for d, ts in trees.items():
+            self.assertEqual(len(ts), len(set(ts)))
+            for t in ts:
+                self.assertEqual(t.depth(), d)
+                self.assertTrue(t.check_parent_refs())
+
+        # everything we can generate within the depth is enumerated
+        enumerated = set([t for ts in trees.values() for t in ts])
+        for t in grammar.generate_many(2000, max_depth=3):
+            self.assertIn(t, enumerated)
+
+        # tables that don't fit give the same trees, whether spilled to disk or enumerated again
+        spill_dir = tempfile.mkdtemp()
+        try:
+            for enumerator in [DepthEnumerator(grammar, max_entries=10),
+                               DepthEnumerator(grammar, max_entries=10, spill_dir=spill_dir)]:
+                for d in xrange(5):
+                    self.assertEqual(map(str, enumerator.enumerate_at_depth(d)), map(str, trees[d]))
+        finally:
+            shutil.rmtree(spill_dir)
+
+class ProbabilityEnumeratorTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing ProbabilityEnumerator"
+        import pickle
+        from math import exp
+        from LOTlib.Enumeration import ProbabilityEnumerator
+
+        # all of a finite grammar, and all of its mass
+        trees = list(finiteTestGrammar.enumerate_by_probability())
+        self.assertEqual(len(trees), 27)
+        self.assertEqual(set(trees), set(finiteTestGrammar.enumerate()))
+        self.assertAlmostEqual(sum([exp(finiteTestGrammar.log_probability(t)) for t in trees]), 1.0)
+
+        # most probable first, on a grammar with bound variables
+        grammar = infiniteTestGrammar
+        enumerator = ProbabilityEnumerator(grammar)
+        trees = [enumerator.next() for _ in xrange(500)]
+        self.assertEqual(len(trees), len(set(trees)))
+        lps = map(grammar.log_probability, trees)
+        for a, b in zip(lps, lps[1:]):
+            self.assertGreaterEqual(a, b - 1e-9)
+        self.assertAlmostEqual(enumerator.mass, sum(map(exp, lps)))
+
+        # stopping at a mass
+        mass = sum([exp(grammar.log_probability(t)) for t in grammar.enumerate_by_probability(mass=0.5)])
+        self.assertGreaterEqual(mass, 0.5)
+
+        # resuming after pickling
+        resumed = pickle.loads(pickle.dumps(enumerator))
+        self.assertEqual(map(str, [resumed.next() for _ in xrange(50)]),
+                         map(str, [enumerator.next() for _ in xrange(50)]))
+
+        # dropped_mass bounds what we never yield, compared to enumerating everything
+        from LOTlib.Grammar import Grammar
+        grammar = Grammar()
+        grammar.add_rule('START', '', ['A'], 1.0)
+        grammar.add_rule('A', 'f_', ['B', 'B', 'B'], 1.0)
+        for b in ['a', 'b', 'c', 'd']:
+            grammar.add_rule('B', b, None, 1.0)
+        enumerator = ProbabilityEnumerator(grammar, max_queue=3)
+        yielded = list(enumerator)
+        missed = sum([exp(grammar.log_probability(t)) for t in grammar.enumerate() if t not in set(yielded)])
+        self.assertAlmostEqual(enumerator.mass + missed, 1.0)
+        self.assertGreaterEqual(enumerator.dropped_mass, missed - 1e-9)
+
+class EquivalenceEnumeratorTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing EquivalenceEnumerator"
+        from LOTlib.Grammar import Grammar
+
+        grammar = Grammar()
+        grammar.add_rule('START', '', ['BOOL'], 1.0)
+        grammar.add_rule('BOOL', 'and_', ['BOOL', 'BOOL'], 1.0)
+        grammar.add_rule('BOOL', 'or_', ['BOOL', 'BOOL'], 1.0)
+        grammar.add_rule('BOOL', 'not_', ['BOOL'], 1.0)
+        grammar.add_rule('BOOL', 'x[0]', None, 2.0)
+        grammar.add_rule('BOOL', 'x[1]', None, 2.0)
+
+        inputs = [([a, b],) for a in [True, False] for b in [True, False]]
+        def signature(t):
+            f = eval("lambda x: %s" % t)
+            return tuple([f(*i) for i in inputs])
+
+        # one tree for each function, and every function of the unpruned trees is found
+        pruned = list(grammar.enumerate_pruned(inputs, d=6))
+        self.assertEqual(len(pruned), len(set(map(signature, pruned))))
+        self.assertTrue(set(map(signature, grammar.enumerate(d=4))) <= set(map(signature, pruned)))
+        self.assertEqual(len(pruned), 16) # all functions of two booleans
+
+class SizeEnumeratorTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing SizeEnumerator"
+        from LOTlib.Enumeration import SizeEnumerator
+
+        # the same trees as by depth, smallest first
+        trees = list(finiteTestGrammar.enumerate_by_size(max_nodes=100))
+        self.assertEqual(set(trees), set(finiteTestGrammar.enumerate()))
+        self.assertEqual(len(trees), 27)
+        sizes = [t.count_nodes() for t in trees]
+        self.assertEqual(sizes, sorted(sizes))
+
+        # with bound variables, every tree we can generate within the size is enumerated once
+        grammar = infiniteTestGrammar
+        trees = list(grammar.enumerate_by_size(max_nodes=7))
+        self.assertEqual(len(trees), len(set(trees)))
+        for t in trees:
+            self.assertTrue(t.count_nodes() <= 7)
+            self.assertTrue(t.check_parent_refs())
+        enumerated = set(trees)
+        for t in grammar.generate_many(2000, max_nodes=7):
+            self.assertIn(t, enumerated)
+
+        # ranges of sizes split the work
+        enumerator = SizeEnumerator(grammar, max_entries=10)
+        self.assertEqual(map(str, enumerator.enumerate(max_nodes=4)) + map(str, enumerator.enumerate(7, min_nodes=5)),
+                         map(str, trees))
+
+class InsideTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing Inside"
+        from collections import Counter
+        from math import exp
+        from LOTlib.Inside import Inside
+
+        grammar = infiniteTestGrammar
+        inside = Inside(grammar)
+
+        # the same counts and mass as enumerating, with bound variables
+        by_size = [[] for _ in xrange(8)]
+        for t in grammar.enumerate_by_size(7):
+            by_size[t.count_nodes()].append(t)
+        self.assertEqual(inside.count_by_size(7), map(len, by_size))
+        for m, ts in zip(inside.mass_by_size(7), by_size):
+            self.assertAlmostEqual(m, sum([exp(grammar.log_probability(t)) for t in ts]))
+
+        by_depth = [list(grammar.enumerate_at_depth(d)) for d in xrange(4)]
+        self.assertEqual(inside.count_by_depth(3), map(len, by_depth))
+        for m, ts in zip(inside.mass_by_depth(3), by_depth):
+            self.assertAlmostEqual(m, sum([exp(grammar.log_probability(t)) for t in ts]))
+
+        # samples have the size we asked for, and the prior's probabilities given that size
+        N = 10000
+        counts = Counter([inside.sample(5) for _ in xrange(N)])
+        for t in by_size[5]:
+            self.assertAlmostEqual(counts[t] / float(N), exp(grammar.log_probability(t)) / inside.mass_by_size(5)[5],
+                                   delta=0.02)
+        self.assertEqual(sum([counts[t] for t in by_size[5]]), N)
+
+class CompiledGrammarTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing Grammar.compile"
+        from math import exp
+        from copy import deepcopy
+
+        compiled = infiniteTestGrammar.compile()
+        self.assertIs(infiniteTestGrammar.compile(), compiled) # cached until the version changes
+        self.assertEqual(compiled.version, infiniteTestGrammar.version)
+
+        self.assertEqual(set(compiled.rules), set(infiniteTestGrammar))
+        for i, r in enumerate(compiled.rules):
+            self.assertEqual(compiled.sig2idx[r.get_rule_signature()], i)
+            self.assertEqual(compiled.nonterminals[compiled.rule_nt[i]], r.nt)
+            self.assertEqual(compiled.is_terminal_rule[i], infiniteTestGrammar.is_terminal_rule(r))
+            self.assertEqual(list(compiled.child_types[i]), [a for a in r.to or [] if compiled.is_nonterminal(a)])
+        for nt, ids in compiled.nt_rules.items():
+            self.assertAlmostEqual(sum([exp(compiled.log_p[i]) for i in ids]), 1.0)
+
+        self.assertRaises(AttributeError, setattr, compiled, 'Z', dict())
+        self.assertRaises(AttributeError, compiled.Z.__setitem__, 'A', 0.0)
+        self.assertRaises(AttributeError, compiled.log_Z.update, {'A': 0.0})
+        self.assertRaises(AttributeError, compiled.sig2idx.clear)
+        self.assertRaises(AttributeError, compiled.nt_rules.pop, 'A')
+        self.assertIsInstance(compiled.nt_rules['A'], tuple)
+
+        # changing the grammar makes a new one
+        grammar = deepcopy(infiniteTestGrammar)
+        before = grammar.compile()
+        grammar.add_rule('A', 'new', None, 1.0)
+        self.assertIsNot(grammar.compile(), before)
+        self.assertEqual(len(grammar.compile().rules), len(before.rules)+1)
+
+        after = grammar.compile()
+        r = grammar.get_rules('A')[0]
+        r.p = r.p * 2
+        self.assertNotEqual(grammar.compile().version, after.version)
+        self.assertAlmostEqual(grammar.compile().Z['A'], after.Z['A'] + r.p / 2)
@@ -0,0 +1,57 @@
+import unittest
+
+from LOTlib.DefaultGrammars import infiniteTestGrammar
+
+class HypothesisStoreTest(unittest.TestCase):
+    def runTest(self):
+        print "# Testing HypothesisStore"
+        import os, shutil, tempfile
+        import numpy
+        from LOTlib.HypothesisStore import HypothesisStore
+
+        grammar = infiniteTestGrammar
+        trees = [grammar.generate() for _ in xrange(2500)]
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'store')
+            with HypothesisStore(path, grammar, buffer_size=1000) as store:
+                for i, t in enumerate(trees):
+                    store.add(t, prior=grammar.log_probability(t), likelihood=float(i))
+                self.assertEqual(len(store), len(trees)) # reading flushes what is buffered
+
+            # reopened, with random access, iteration and columns
+            store = HypothesisStore(path, grammar)
+            self.assertEqual(len(store), len(trees))
+            for i in [0, 1, 1234, len(trees)-1, -1]:
+                self.assertEqual(store[i], trees[i])
+            self.assertRaises(IndexError, store.__getitem__, len(trees))
+            self.assertEqual(list(store), trees)
+            self.assertTrue(numpy.allclose(store.prior, map(grammar.log_probability, trees)))
+            self.assertTrue(numpy.array_equal(store.likelihood, numpy.arange(len(trees))))
+            self.assertTrue(numpy.all(numpy.isnan(store.posterior_score)))
+
+            # appending after reading
+            store.add(trees[0], prior=1.0)
+            self.assertEqual(len(store), len(trees)+1)
+            self.assertEqual(store[-1], trees[0])
+            self.assertEqual(store.prior[-1], 1.0)
+            store.close()
+
+            # what an interrupted flush wrote before offsets.bin is cut off when we open it again
+            for name in ['trees', 'prior', 'likelihood', 'offsets']:
+                with open(store.filename(name), 'ab') as f:
+                    f.write('\x01\x02\x03')
+            store = HypothesisStore(path, grammar)
+            self.assertEqual(len(store), len(trees)+1)
+            self.assertEqual(len(store.likelihood), len(trees)+1)
+            self.assertEqual(store[-1], trees[0])
+            self.assertEqual(list(store)[:-1], trees)
+
+            # but a store missing what offsets.bin says it has is an error
+            store.close()
+            with open(store.filename('posterior_score'), 'r+b') as f:
+                f.truncate(8)
+            self.assertRaises(IOError, HypothesisStore, path, grammar)
+        finally:
+            shutil.rmtree(directory)